@@ -2,6 +2,8 @@
 ASGI config for movies project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Streaming responses (the catalogue export) are read off the event loop by
+movies.asgi.CatalogueASGIHandler, everything else is the stock Django handler.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -9,7 +11,7 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+from movies.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
@@ -0,0 +1,123 @@
+"""
+PostgreSQL с пулом соединений в процессе.
+
+Django открывает соединение на поток и закрывает его в конце запроса (CONN_MAX_AGE = 0).
+Здесь закрытие возвращает соединение в общий для потоков процесса пул: запросы берут
+уже открытые соединения, а всего их у процесса не больше POOL_MAX_SIZE.
+
+Дополнительные ключи DATABASES: POOL_MAX_SIZE (по умолчанию 10) и POOL_TIMEOUT -
+сколько секунд ждать свободного соединения (5). С DATABASE_HEALTH_CHECKS
+простаивавшее соединение проверяется перед выдачей.
+"""
+import threading
+
+from django.conf import settings
+from django.db.backends.postgresql import base, creation
+from django.db.utils import OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+Database = base.Database
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """Простаивающие соединения (последнее возвращенное выдается первым) и ограничение их общего числа"""
+
+    def __init__(self, connect, max_size, timeout):
+        self.connect = connect
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_size)
+
+    def get(self, check=False):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise OperationalError(f"Нет свободного соединения в пуле за {self.timeout} с")
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop() if self.idle else None
+                if connection is None:
+                    return self.connect()
+                if not connection.closed and (not check or self.is_usable(connection)):
+                    return connection
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def put(self, connection):
+        """Соединение возвращается в пул чистым: незавершенная транзакция откатывается, сломанное закрывается"""
+        try:
+            if not connection.closed:
+                if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                with self.lock:
+                    self.idle.append(connection)
+        except Database.Error:
+            connection.close()
+        finally:
+            self.slots.release()
+
+    def is_usable(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        except Database.Error:
+            connection.close()
+            return False
+        return True
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+
+def get_pool(key, connect, settings_dict):
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(
+                connect, settings_dict.get("POOL_MAX_SIZE", 10), settings_dict.get("POOL_TIMEOUT", 5),
+            )
+        return pool
+
+
+def close_pools():
+    """Закрывает простаивающие соединения всех пулов, например перед удалением базы"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Простаивающие в пуле соединения с тестовой базой не дали бы ее удалить
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_new_connection(self, conn_params):
+        # Пул на алиас и параметры: тестовая база с другим NAME получает свой пул
+        key = (self.alias, repr(sorted(conn_params.items())))
+        pool = get_pool(key, lambda: Database.connect(**conn_params), self.settings_dict)
+        connection = pool.get(check=getattr(settings, "DATABASE_HEALTH_CHECKS", False))
+        self.pool = pool
+        options = self.settings_dict["OPTIONS"]
+        self.isolation_level = options.get("isolation_level", connection.isolation_level)
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.put(self.connection)
@@ -88,17 +88,61 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
+# db_pool=1 - пул соединений в процессе (core.db.postgresql_pool): соединение
+# возвращается в пул в конце запроса, поэтому CONN_MAX_AGE по умолчанию 0.
+# Без пула соединение потока живет db_conn_max_age секунд (None - без ограничения)
+DATABASE_POOL = bool(int(os.getenv('db_pool', 0)))
+DATABASE_CONN_MAX_AGE = os.getenv('db_conn_max_age', '0' if DATABASE_POOL else '60')
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
-        'NAME': 'movies',
-        'USER': 'postgres',
-        'PASSWORD': 'admin',
-        'HOST': '127.0.0.1',
-        'PORT': '5432',
+        'ENGINE': 'core.db.postgresql_pool' if DATABASE_POOL else 'django.db.backends.postgresql_psycopg2',
+        'NAME': os.getenv('db_name', 'movies'),
+        'USER': os.getenv('db_user', 'postgres'),
+        'PASSWORD': os.getenv('db_password', 'admin'),
+        'HOST': os.getenv('db_host', '127.0.0.1'),
+        'PORT': os.getenv('db_port', '5432'),
+        'CONN_MAX_AGE': None if DATABASE_CONN_MAX_AGE == 'None' else int(DATABASE_CONN_MAX_AGE),
+        'POOL_MAX_SIZE': int(os.getenv('db_pool_max_size', 10)),
+        'POOL_TIMEOUT': float(os.getenv('db_pool_timeout', 5)),
     }
 }
 
+# Реплики для чтения каталога: db_replica_hosts=10.0.0.2,10.0.0.3:5433.
+# Те же имя базы и пользователь, что у основной; в тестах реплики - зеркала default
+DATABASE_REPLICAS = []
+for number, address in enumerate(filter(None, os.getenv('db_replica_hosts', '').split(',')), 1):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{number}')
+
+DATABASE_ROUTERS = ['movies.routers.ReadReplicaRouter']
+
+# Проверять постоянное соединение запросом SELECT 1 перед использованием в новом запросе:
+# после перезапуска базы упавшее соединение переоткрывается, а не роняет запрос
+DATABASE_HEALTH_CHECKS = bool(int(os.getenv('db_health_checks', 1)))
+# Соединение, простоявшее без запросов меньше стольких секунд, не проверяется
+DATABASE_HEALTH_CHECK_IDLE = float(os.getenv('db_health_check_idle', 10))
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('cache_backend', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('cache_location', 'movies'),
+    }
+}
+
+API_CACHE_ALIAS = 'default'
+API_CACHE_TIMEOUT = int(os.getenv('api_cache_timeout', 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -224,8 +268,67 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
+    # FastJSONRenderer кодирует ответы через orjson, если он установлен
+    'DEFAULT_RENDERER_CLASSES': (
+        os.getenv('api_json_renderer', 'movies.renderers.FastJSONRenderer'),
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'movies.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.getenv('page_size', 20)),
 }
 
+MAX_PAGE_SIZE = int(os.getenv('max_page_size', 100))
+
+# Прием голосов: 'sync' пишет оценку сразу, 'buffered' дописывает её в локальный буфер,
+# который пачками применяет manage.py flush_ratings
+RATING_INGESTION_MODE = os.getenv('rating_ingestion_mode', 'sync')
+RATING_BUFFER_DIR = os.getenv('rating_buffer_dir', os.path.join(BASE_DIR, 'var', 'ratings'))
+RATING_FLUSH_INTERVAL = float(os.getenv('rating_flush_interval', 1.0))
+RATING_FLUSH_BATCH_SIZE = int(os.getenv('rating_flush_batch_size', 1000))
+
+# Ограничения дерева отзывов: глубина вложенности и число ответов на одном уровне
+REVIEW_TREE_MAX_DEPTH = 20
+REVIEW_TREE_MAX_CHILDREN = 100
+
+# Выгрузка каталога: фильмов на одну пачку запросов с prefetch
+EXPORT_CHUNK_SIZE = int(os.getenv('export_chunk_size', 500))
+
+# Списки фильмов, персон и отзывов из строк .values() без полей DRF (тот же JSON)
+FAST_READ_SERIALIZERS = bool(int(os.getenv('fast_read_serializers', 0)))
+
+# Поиск: результатов каждого типа в ответе
+SEARCH_RESULTS_LIMIT = int(os.getenv('search_results_limit', 20))
+
+# Индексы в памяти процесса (подсказки, фасеты): как часто сверять их версию с общим кэшем, секунды
+LOCAL_INDEX_SYNC_INTERVAL = float(os.getenv('local_index_sync_interval', 1.0))
+# Журнал изменений индексов в общем кэше: сколько изменений процесс догоняет без перестройки
+# и сколько секунд хранится запись журнала
+LOCAL_INDEX_LOG_SIZE = int(os.getenv('local_index_log_size', 1000))
+LOCAL_INDEX_LOG_TIMEOUT = int(os.getenv('local_index_log_timeout', 3600))
+
+# Подсказки: минимальная доля общих триграмм для слова с опечаткой
+SUGGEST_TYPO_THRESHOLD = 0.3
+SUGGEST_LIMIT = 10
+
+# Превью постеров, фото персон и кадров: имя -> наибольшие (ширина, высота).
+# Пишутся рядом с оригиналом фоновой задачей после загрузки, для старых файлов - manage.py make_renditions
+IMAGE_RENDITIONS = {"thumb": (160, 240), "medium": (480, 720)}
+IMAGE_RENDITION_FORMAT = os.getenv('image_rendition_format', 'WEBP')
+IMAGE_RENDITION_QUALITY = int(os.getenv('image_rendition_quality', 80))
+
+# Фоновые задачи (превью, письма): очередь в базе, обработчик - manage.py run_tasks.
+# TASKS_EAGER выполняет задачи сразу в запросе, без обработчика
+TASKS_EAGER = bool(int(os.getenv('tasks_eager', 0)))
+TASKS_CONCURRENCY = int(os.getenv('tasks_concurrency', 4))
+TASKS_POLL_INTERVAL = float(os.getenv('tasks_poll_interval', 1.0))
+TASKS_MAX_ATTEMPTS = int(os.getenv('tasks_max_attempts', 3))
+# Задержка перед первым повтором, секунды; дальше удваивается
+TASKS_RETRY_DELAY = float(os.getenv('tasks_retry_delay', 10))
+# Через сколько секунд задача упавшего обработчика возвращается в очередь
+TASKS_LOCK_TIMEOUT = int(os.getenv('tasks_lock_timeout', 600))
+# Как часто выполняющаяся задача продлевает locked_at, должно быть меньше TASKS_LOCK_TIMEOUT
+TASKS_HEARTBEAT_INTERVAL = float(os.getenv('tasks_heartbeat_interval', 60))
+
 # smtp
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
@@ -240,6 +343,15 @@ DJOSER = {
     'ACTIVATION_URL': '#/activate/{uid}/{token}',
     'SEND_ACTIVATION_EMAIL': True,
     'SERIALIZERS': {},
+    # Письма рендерятся в запросе, а отправляются обработчиком фоновых задач
+    'EMAIL': {
+        'activation': 'movies.emails.ActivationEmail',
+        'confirmation': 'movies.emails.ConfirmationEmail',
+        'password_reset': 'movies.emails.PasswordResetEmail',
+        'password_changed_confirmation': 'movies.emails.PasswordChangedConfirmationEmail',
+        'username_changed_confirmation': 'movies.emails.UsernameChangedConfirmationEmail',
+        'username_reset': 'movies.emails.UsernameResetEmail',
+    },
 }
 
 
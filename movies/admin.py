@@ -1,10 +1,27 @@
 from django.contrib import admin
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django import forms
 
 from ckeditor_uploader.widgets import CKEditorUploadingWidget
 
-from .models import Person, Genre, Category, Movie, MovieShots, RatingStars, Rating, Review, Country
+from .cache import invalidate_all
+from .models import (
+    Person, Genre, Category, Movie, MovieShots, RatingStars, Rating, Review, Country, Task, get_version_bump,
+)
+from .renditions import get_thumbnail_url
+from .search import is_full_text_supported, search
+from .local_index import invalidate_local_indexes
+
+
+class FullTextSearchMixin:
+    """На PostgreSQL ищет по поисковому вектору вместо icontains по search_fields (кроме чисел, например года)"""
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if search_term and not search_term.isdigit() and is_full_text_supported():
+            return search(queryset, search_term), False
+        return super().get_search_results(request, queryset, search_term)
 
 
 class MovieAdminForm(forms.ModelForm):
@@ -33,13 +50,13 @@ class MovieShotsInline(admin.TabularInline):
     readonly_fields = ("get_image", )
 
     def get_image(self, obj):
-        return mark_safe(f"<img src={obj.image.url} width='100' height='110'>")
+        return mark_safe(f"<img src={get_thumbnail_url(obj.image)} width='100' height='110'>")
 
     get_image.short_description = "Изображение"
 
 
 @admin.register(Movie)
-class MovieAdmin(admin.ModelAdmin):
+class MovieAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ("id", "title", "get_image", "category", "year", "draft")
     list_display_links = ("title", "id")
     list_filter = ("category", "year")
@@ -77,11 +94,13 @@ class MovieAdmin(admin.ModelAdmin):
     )
 
     def get_image(self, obj):
-        return mark_safe(f"<img src={obj.poster.url} width='50' height='60'>")
+        return mark_safe(f"<img src={get_thumbnail_url(obj.poster)} width='50' height='60'>")
 
     def unpublish(self, request, queryset):
         """Снять с публикации"""
-        row_update = queryset.update(draft=True)
+        row_update = queryset.update(draft=True, **get_version_bump())
+        invalidate_all()
+        invalidate_local_indexes()
         if row_update == 1:
             message = "1 запись обновлена"
         else:
@@ -90,7 +109,9 @@ class MovieAdmin(admin.ModelAdmin):
 
     def publish(self, request, queryset):
         """Снять с публикации"""
-        row_update = queryset.update(draft=False)
+        row_update = queryset.update(draft=False, **get_version_bump())
+        invalidate_all()
+        invalidate_local_indexes()
         if row_update == 1:
             message = "1 запись обновлена"
         else:
@@ -116,14 +137,14 @@ class ReviewsAdmin(admin.ModelAdmin):
 
 
 @admin.register(Person)
-class PersonAdmin(admin.ModelAdmin):
+class PersonAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ("id", "first_name", "last_name", "second_name", "get_age", "get_image")
     list_display_links = ("last_name", "first_name", "id")
     search_fields = ("first_name", "last_name", "second_name")
     readonly_fields = ("get_image", )
 
     def get_image(self, obj):
-        return mark_safe(f"<img src={obj.image.url} width='50' height='60'>")
+        return mark_safe(f"<img src={get_thumbnail_url(obj.image)} width='50' height='60'>")
 
     get_image.short_description = "Изображение"
 
@@ -162,5 +183,23 @@ class CountryAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    """Очередь фоновых задач: упавшие задачи с последней ошибкой и повтор вручную"""
+    list_display = ("id", "name", "status", "attempts", "run_at", "locked_by")
+    list_filter = ("status", "name")
+    readonly_fields = ("locked_by", "locked_at", "last_error", "created_at")
+    actions = ["retry"]
+
+    def retry(self, request, queryset):
+        row_update = queryset.filter(status=Task.FAILED).update(
+            status=Task.PENDING, attempts=0, run_at=timezone.now(), last_error="",
+        )
+        self.message_user(request, f"Возвращено в очередь: {row_update}")
+
+    retry.short_description = "Повторить упавшие"
+    retry.allowed_permissions = ("change", )
+
+
 admin.site.site_title = "Django Movies"
 admin.site.site_header = "Django Movies"
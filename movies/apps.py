@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MoviesConfig(AppConfig):
     name = 'movies'
     verbose_name = "Фильм"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,64 @@
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+
+
+def get_response_headers(response):
+    """Заголовки и cookies ответа в виде списка ASGI, как в ASGIHandler.send_response"""
+    headers = []
+    for header, value in response.items():
+        if isinstance(header, str):
+            header = header.encode("ascii")
+        if isinstance(value, str):
+            value = value.encode("latin1")
+        headers.append((bytes(header), bytes(value)))
+    for cookie in response.cookies.values():
+        headers.append((b"Set-Cookie", cookie.output(header="").encode("ascii").strip()))
+    return headers
+
+
+def read_chunk(parts, size):
+    """Следующие части потокового ответа общим размером от size байт; b"" - ответ закончился"""
+    chunk = []
+    length = 0
+    for part in parts:
+        chunk.append(part)
+        length += len(part)
+        if length >= size:
+            break
+    return b"".join(chunk)
+
+
+class CatalogueASGIHandler(ASGIHandler):
+    """
+    ASGIHandler Django 3.0, который читает потоковые ответы (выгрузку каталога) не в цикле
+    событий: генератор выгрузки обращается к базе, а в цикле это SynchronousOnlyOperation.
+    Каждая часть до chunk_size байт читается отдельным вызовом sync_to_async в том же
+    потоке, где работало представление, так что поток не занят, пока медленный клиент
+    забирает отправленное. Ответ закрывается там же: request_finished должен закрыть
+    соединения с базой того потока, который их открыл.
+    """
+
+    async def send_response(self, response, send):
+        try:
+            await send({"type": "http.response.start", "status": response.status_code,
+                        "headers": get_response_headers(response)})
+            if response.streaming:
+                parts = iter(response)
+                while True:
+                    chunk = await sync_to_async(read_chunk)(parts, self.chunk_size)
+                    if not chunk:
+                        break
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                await send({"type": "http.response.body"})
+            else:
+                for chunk, last in self.chunk_bytes(response.content):
+                    await send({"type": "http.response.body", "body": chunk, "more_body": not last})
+        finally:
+            await sync_to_async(response.close)()
+
+
+def get_asgi_application():
+    """Как django.core.asgi.get_asgi_application, но с CatalogueASGIHandler"""
+    django.setup(set_prefix=False)
+    return CatalogueASGIHandler()
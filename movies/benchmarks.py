@@ -0,0 +1,321 @@
+import asyncio
+import math
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.db.models import Count
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from .asgi import CatalogueASGIHandler
+from .facets import FacetIndex
+from .models import Movie, Person, Genre, Category, Country, RatingStars, Rating, Review
+from .ratings import calculate_rating_aggregates, get_average, get_rated_movie_ids
+from .renderers import FastJSONRenderer, iter_json_array
+from .serializers import MovieDetailSerializer, MovieListSerializer, PersonListSerializer, ReviewSerializer
+from .values_serializers import MovieListValuesSerializer, PersonListValuesSerializer, ReviewValuesSerializer
+
+SEED_MARK = "benchmark"
+# Нагрузка: одновременных клиентов, потоков WSGI-сервера,
+# пауза медленного клиента на каждые ASGIHandler.chunk_size байт ответа, секунды,
+# и каждый какой клиент забирает выгрузку каталога
+LOAD_CLIENTS = 200
+LOAD_WSGI_THREADS = 8
+LOAD_CLIENT_DELAY = 0.05
+LOAD_EXPORT_EVERY = 25
+
+
+def measure(func, repeat):
+    """Медиана времени вызова func в миллисекундах"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def make_ip(number):
+    return f"10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}"
+
+
+def seed_catalogue(movies=1000, persons=200, ratings_per_movie=20, reviews_per_movie=5, batch_size=None):
+    """
+    Заполняет базу тестовым каталогом через bulk_create.
+    Возвращает id созданных фильмов.
+    """
+    rnd = random.Random(0)
+    stars = [RatingStars.objects.get_or_create(value=value)[0] for value in range(1, 6)]
+    category, _ = Category.objects.get_or_create(url=SEED_MARK, defaults={"name": "Фильмы", "description": "-"})
+    genres = [
+        Genre.objects.get_or_create(url=f"{SEED_MARK}-{i}", defaults={"name": f"Жанр {i}", "description": "-"})[0]
+        for i in range(10)
+    ]
+    countries = [Country.objects.get_or_create(name=f"Страна {i}")[0] for i in range(10)]
+
+    Person.objects.bulk_create([
+        Person(
+            first_name="Имя", last_name=f"Фамилия {i}", description=SEED_MARK, image="actors/image.jpg",
+            date_of_birthday="1970-01-01", slug=f"{SEED_MARK}-person-{i}",
+        )
+        for i in range(persons)
+    ], batch_size=batch_size)
+    person_ids = list(Person.objects.filter(description=SEED_MARK).values_list("id", flat=True))
+
+    Movie.objects.bulk_create([
+        Movie(
+            title=f"Фильм {i}", tagline=SEED_MARK, description="Описание", poster="movies/poster.jpg",
+            year=1950 + i % 70, category=category, slug=f"{SEED_MARK}-movie-{i}",
+        )
+        for i in range(movies)
+    ], batch_size=batch_size)
+    movie_ids = list(Movie.objects.filter(tagline=SEED_MARK).order_by("pk").values_list("id", flat=True))
+
+    Movie.genres.through.objects.bulk_create([
+        Movie.genres.through(movie_id=movie_id, genre_id=rnd.choice(genres).pk) for movie_id in movie_ids
+    ], batch_size=batch_size)
+    Movie.countries.through.objects.bulk_create([
+        Movie.countries.through(movie_id=movie_id, country_id=rnd.choice(countries).pk) for movie_id in movie_ids
+    ], batch_size=batch_size)
+    Movie.actors.through.objects.bulk_create([
+        Movie.actors.through(movie_id=movie_id, person_id=person_id)
+        for movie_id in movie_ids for person_id in rnd.sample(person_ids, min(5, len(person_ids)))
+    ], batch_size=batch_size)
+
+    voters = max(ratings_per_movie * 10, 1)
+    Rating.objects.bulk_create([
+        Rating(movie_id=movie_id, ip=make_ip(voter), star=rnd.choice(stars))
+        for movie_id in movie_ids for voter in rnd.sample(range(voters), ratings_per_movie)
+    ], batch_size=batch_size)
+    aggregates = calculate_rating_aggregates(movie_ids)
+    Movie.objects.bulk_update([
+        Movie(pk=movie_id, rating_count=count, rating_sum=total, average_rating=get_average(count, total))
+        for movie_id, (count, total) in aggregates.items()
+    ], ("rating_count", "rating_sum", "average_rating"), batch_size=batch_size)
+
+    Review.objects.bulk_create([
+        Review(movie_id=movie_id, email="user@example.com", name=f"Автор {i}", text="Текст")
+        for movie_id in movie_ids for i in range(reviews_per_movie)
+    ], batch_size=batch_size)
+    return movie_ids
+
+
+def delete_seeded_catalogue():
+    """
+    Удаляет зафиксированный каталог seed_catalogue. Оценки и отзывы удаляются
+    одним DELETE без сигналов: пересчитывать агрегаты и деревья удаляемых фильмов незачем.
+    """
+    movies = Movie.objects.filter(tagline=SEED_MARK)
+    with connection.cursor() as cursor:
+        for model in (Rating, Review):
+            sql, params = movies.values("id").query.sql_with_params()
+            cursor.execute(f"DELETE FROM {model._meta.db_table} WHERE movie_id IN ({sql})", params)
+    movies.delete()
+    Person.objects.filter(description=SEED_MARK).delete()
+    Genre.objects.filter(url__startswith=SEED_MARK).delete()
+    Category.objects.filter(url=SEED_MARK).delete()
+
+
+def rating_lookups(movie_ids, options):
+    """Запросы оценок и каталога, которые опираются на индексы Rating, Movie и Review"""
+    rnd = random.Random(1)
+    voters = max(options["ratings_per_movie"] * 10, 1)
+    page = movie_ids[:20]
+
+    def vote_lookup():
+        Rating.objects.filter(movie_id=rnd.choice(movie_ids), ip=make_ip(rnd.randrange(voters))).first()
+
+    def rated_page():
+        get_rated_movie_ids(make_ip(rnd.randrange(voters)), page)
+
+    def rated_movies():
+        get_rated_movie_ids(make_ip(rnd.randrange(voters)))
+
+    def movies_by_year():
+        year = rnd.randrange(1950, 2020)
+        list(Movie.objects.filter(draft=False, year__gte=year, year__lte=year + 1).values_list("id", flat=True))
+
+    def top_level_reviews():
+        list(Review.objects.filter(movie_id=rnd.choice(movie_ids), parent__isnull=True).values_list("id", flat=True))
+
+    return [
+        ("оценка по (movie, ip)", measure(vote_lookup, options["repeat"])),
+        ("оценки клиента на странице", measure(rated_page, options["repeat"])),
+        ("все оценки клиента", measure(rated_movies, options["repeat"])),
+        ("фильмы по году", measure(movies_by_year, options["repeat"])),
+        ("корневые отзывы фильма", measure(top_level_reviews, options["repeat"])),
+    ]
+
+
+def facet_counts(movie_ids, options):
+    """Счетчики фасетов по битовым картам против GROUP BY по базе"""
+    index = FacetIndex()
+    build_ms = measure(index.build, 1)
+    genre = Genre.objects.filter(url__startswith=SEED_MARK).first()
+    params = {"genres": [genre.name], "year": slice(1980, 2000)}
+    published = Movie.objects.filter(draft=False)
+
+    def group_by():
+        filtered = published.filter(genres__name__in=params["genres"], year__gte=1980, year__lte=2000)
+        list(published.filter(year__gte=1980, year__lte=2000).values("genres").annotate(count=Count("id")))
+        list(filtered.values("countries").annotate(count=Count("id")))
+        list(filtered.values("category").annotate(count=Count("id")))
+        list(published.filter(genres__name__in=params["genres"]).values("year").annotate(count=Count("id")))
+
+    return [
+        ("построение индекса", build_ms),
+        ("фасеты без фильтра", measure(lambda: index.get_facets({}), options["repeat"])),
+        ("фасеты с фильтром", measure(lambda: index.get_facets(params), options["repeat"])),
+        ("GROUP BY с фильтром", measure(group_by, options["repeat"])),
+    ]
+
+
+def read_serializers(movie_ids, options):
+    """ModelSerializer против ValuesSerializer на больших выборках: запрос и сериализация"""
+    context = {"request": Request(APIRequestFactory().get("/api/v1/movies/", HTTP_HOST="localhost"))}
+    cases = (
+        ("фильмы", MovieListSerializer, MovieListValuesSerializer, Movie.objects.select_related("category")),
+        ("персоны", PersonListSerializer, PersonListValuesSerializer, Person.objects.all()),
+        ("отзывы", ReviewSerializer, ReviewValuesSerializer, Review.objects.all()),
+    )
+    repeat = max(options["repeat"] // 20, 1)
+    results = []
+    for label, serializer_class, values_serializer_class, queryset in cases:
+        queryset = queryset.order_by("pk")[:5000]
+
+        def serialize_models():
+            serializer_class(queryset, many=True, context=context).data
+
+        def serialize_values():
+            serializer = values_serializer_class(context=context)
+            serializer.to_representation(queryset.values(*serializer.columns))
+
+        results.append((f"{label}: ModelSerializer", measure(serialize_models, repeat)))
+        results.append((f"{label}: ValuesSerializer", measure(serialize_values, repeat)))
+    return results
+
+
+def json_rendering(movie_ids, options):
+    """JSONRenderer DRF против FastJSONRenderer на карточках фильмов с сотнями актеров и отзывов"""
+    movie = Movie.objects.get(pk=movie_ids[0])
+    persons = list(Person.objects.values_list("id", flat=True)[:500])
+    movie.actors.add(*persons)
+    movie.directors.add(*persons[:50])
+    Review.objects.bulk_create([
+        Review(movie=movie, email="user@example.com", name=f"Автор {i}", text="Текст отзыва " * 20)
+        for i in range(500)
+    ])
+    context = {"request": Request(APIRequestFactory().get("/api/v1/movies/", HTTP_HOST="localhost"))}
+    data = MovieDetailSerializer(Movie.objects.get(pk=movie.pk), context=context).data
+    many = [data] * 20
+    repeat = max(options["repeat"] // 10, 1)
+    return [
+        ("карточка: JSONRenderer", measure(lambda: JSONRenderer().render(data), options["repeat"])),
+        ("карточка: FastJSONRenderer", measure(lambda: FastJSONRenderer().render(data), options["repeat"])),
+        ("20 карточек: JSONRenderer", measure(lambda: JSONRenderer().render(many), repeat)),
+        ("20 карточек: FastJSONRenderer", measure(lambda: FastJSONRenderer().render(many), repeat)),
+        ("20 карточек: потоком", measure(lambda: b"".join(iter_json_array(many)), repeat)),
+    ]
+
+
+def get_load_paths(movie_ids):
+    rnd = random.Random(3)
+    person_ids = list(Person.objects.filter(description=SEED_MARK).values_list("id", flat=True))
+    paths = []
+    for i in range(LOAD_CLIENTS):
+        kind = i % 4
+        if i % LOAD_EXPORT_EVERY == 0:
+            paths.append("/api/v1/movies/export/?fields=id,title,year&year_min=2000&year_max=2004")
+        elif kind == 0:
+            paths.append("/api/v1/movies/")
+        elif kind == 3:
+            paths.append(f"/api/v1/persons/{rnd.choice(person_ids)}/")
+        else:
+            paths.append(f"/api/v1/movies/{rnd.choice(movie_ids)}/")
+    return paths
+
+
+def run_wsgi_load(paths):
+    """Потоковый WSGI-сервер: поток занят запросом, пока медленный клиент не заберет ответ"""
+    handler = WSGIHandler()
+    factory = RequestFactory()
+    started = time.perf_counter()
+
+    def call(path):
+        result = handler(factory.get(path, HTTP_HOST="localhost").environ, lambda status, headers: None)
+        try:
+            size = sum(len(part) for part in result)
+            time.sleep(LOAD_CLIENT_DELAY * max(1, math.ceil(size / ASGIHandler.chunk_size)))
+        finally:
+            result.close()
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=LOAD_WSGI_THREADS) as executor:
+        return list(executor.map(call, paths)), time.perf_counter() - started
+
+
+def run_asgi_load(application, paths):
+    """Все клиенты одновременно в одном цикле событий, медленная отправка ответа не занимает поток"""
+    async def run():
+        started = time.perf_counter()
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            if message.get("body"):
+                await asyncio.sleep(LOAD_CLIENT_DELAY)
+
+        async def call(path):
+            path, _, query_string = path.partition("?")
+            scope = {
+                "type": "http", "method": "GET", "path": path, "root_path": "", "query_string": query_string.encode(),
+                "headers": [(b"host", b"localhost")], "server": ("localhost", 80), "client": ("127.0.0.1", 1),
+            }
+            await application(scope, receive, send)
+            return time.perf_counter() - started
+
+        latencies = await asyncio.gather(*(call(path) for path in paths))
+        return latencies, time.perf_counter() - started
+    return asyncio.run(run())
+
+
+def asgi_load(movie_ids, options):
+    """
+    LOAD_CLIENTS одновременных медленных клиентов читают каталог, часть из них - выгрузку:
+    потоковый WSGI-сервер и CatalogueASGIHandler (core/asgi.py). Стандартный ASGIHandler
+    Django 3.0 читает выгрузку в цикле событий и падает с SynchronousOnlyOperation.
+    Запросы выполняются в других потоках, поэтому каталог фиксируется в базе.
+    """
+    paths = get_load_paths(movie_ids)
+    servers = (
+        (f"WSGI, {LOAD_WSGI_THREADS} потоков", lambda: run_wsgi_load(paths)),
+        ("ASGI", lambda: run_asgi_load(CatalogueASGIHandler(), paths)),
+    )
+    results = []
+    for label, run in servers:
+        run()  # прогрев: кэш ответов и соединения
+        latencies, elapsed = run()
+        results.append((f"{label}: запросов/с", len(paths) / elapsed))
+        results.append((f"{label}: p99, мс", statistics.quantiles(latencies, n=100)[98] * 1000))
+    return results
+
+
+# Запросы идут из других потоков: каталог нужен зафиксированным, а не в откатываемой транзакции
+asgi_load.committed = True
+
+
+SCENARIOS = {
+    "rating-lookups": rating_lookups,
+    "facets": facet_counts,
+    "read-serializers": read_serializers,
+    "json": json_rendering,
+    "asgi-load": asgi_load,
+}
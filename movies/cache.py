@@ -0,0 +1,166 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework.response import Response
+
+GLOBAL_VERSION = "all"
+STATS_KEYS = ("hits", "misses")
+
+
+def get_cache():
+    return caches[getattr(settings, "API_CACHE_ALIAS", "default")]
+
+
+def make_version_key(name):
+    return f"api:version:{name}"
+
+
+def new_version():
+    """Начальная версия от времени, чтобы после вытеснения ключа не вернуть старые ответы"""
+    return int(time.time() * 1000)
+
+
+def get_versions(*names):
+    """Текущие версии пространств кэша одним запросом к бэкенду"""
+    cache = get_cache()
+    keys = [make_version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, new_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*names):
+    """
+    Инвалидирует пространства кэша, сдвигая их версии. Внутри транзакции - после фиксации:
+    промах кэша между сдвигом и COMMIT прочитал бы старые строки и сохранил их под новой версией.
+    """
+    transaction.on_commit(lambda: apply_bump_versions(names))
+
+
+def apply_bump_versions(names):
+    cache = get_cache()
+    for name in names:
+        key = make_version_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_version(), None)
+
+
+def invalidate_movie(movie_id):
+    """Сбрасывает список фильмов и карточку одного фильма"""
+    bump_versions("movie:list", f"movie:{movie_id}")
+
+
+def invalidate_all():
+    """Сбрасывает все ответы: изменились данные, общие для многих фильмов"""
+    bump_versions(GLOBAL_VERSION)
+
+
+def increment_stat(name):
+    cache = get_cache()
+    key = f"api:stats:{name}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def get_stats():
+    """Счетчики попаданий и промахов кэша ответов"""
+    cache = get_cache()
+    values = cache.get_many([f"api:stats:{name}" for name in STATS_KEYS])
+    return {name: values.get(f"api:stats:{name}", 0) for name in STATS_KEYS}
+
+
+def hash_query_params(request):
+    params = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+    return hashlib.md5(repr(params).encode()).hexdigest()
+
+
+class CachedResponseMixin:
+    """
+    Кэширует ответы list/retrieve. Ключ собирается из версий пространств кэша
+    ("<basename>:list" или "<basename>:<pk>" и общей), хоста (ссылки пагинации
+    абсолютные), параметров запроса и клиентской части (get_cache_client_part).
+    """
+
+    def list(self, request, *args, **kwargs):
+        versions = get_versions(GLOBAL_VERSION, f"{self.basename}:list")
+        return self.get_cached_response(versions, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        versions = get_versions(GLOBAL_VERSION, f"{self.basename}:{lookup}")
+        return self.get_cached_response(versions, super().retrieve, request, *args, **kwargs)
+
+    def get_cache_client_part(self, request):
+        """Часть ключа, зависящая от клиента"""
+        return ""
+
+    def get_cached_response(self, versions, handler, request, *args, **kwargs):
+        key = ":".join(map(str, (
+            "api", self.basename, self.action, *versions, request.get_host(),
+            kwargs.get(self.lookup_url_kwarg or self.lookup_field, ""),
+            hash_query_params(request), self.get_cache_client_part(request),
+        )))
+        cache = get_cache()
+        cached = cache.get(key)
+        if cached is not None:
+            increment_stat("hits")
+            data, etag, last_modified = cached
+            return get_conditional_or(request, etag, last_modified, lambda: Response(data))
+        increment_stat("misses")
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            # Заголовки ConditionalRetrieveMixin кэшируются вместе с ответом: попадание в кэш тоже отвечает 304
+            cached = (response.data, response.get("ETag"), parse_http_date_safe(response.get("Last-Modified", "")))
+            cache.set(key, cached, getattr(settings, "API_CACHE_TIMEOUT", 300))
+        return response
+
+
+def get_conditional_or(request, etag, last_modified, handler):
+    """
+    304, если If-None-Match или If-Modified-Since совпадают с версией ответа,
+    иначе ответ handler(). ETag и Last-Modified проставляются в оба ответа.
+    """
+    response = None
+    if etag is not None:
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = handler()
+    if etag is not None and response.status_code in (200, 304):
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+class ConditionalRetrieveMixin:
+    """
+    ETag и Last-Modified для retrieve по version и updated_at записи.
+    Версия читается одним запросом по первичному ключу; если клиент прислал
+    совпадающий If-None-Match или If-Modified-Since, ответ - 304 без сериализации.
+    ETag учитывает параметры запроса и формат ответа: ?fields= меняет представление.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        stamp = self.queryset.filter(**{self.lookup_field: lookup}).values_list("version", "updated_at").first()
+        if stamp is None:
+            return super().retrieve(request, *args, **kwargs)
+        version, updated_at = stamp
+        etag = quote_etag(hashlib.md5(":".join(map(str, (
+            version, updated_at.timestamp(), request.accepted_renderer.format, hash_query_params(request),
+        ))).encode()).hexdigest())
+        retrieve = super().retrieve
+        return get_conditional_or(request, etag, int(updated_at.timestamp()), lambda: retrieve(request, *args, **kwargs))
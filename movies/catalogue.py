@@ -0,0 +1,259 @@
+import csv
+import json
+from collections import Counter
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .cache import invalidate_all
+from .models import Category, Country, Genre, Movie, Person
+from .search import update_search_vectors
+from .local_index import invalidate_local_indexes
+
+LIST_SEPARATOR = "|"
+RECORD_TYPES = ("country", "genre", "category", "person", "movie")
+PERSON_FIELDS = (
+    "first_name", "last_name", "second_name", "date_of_birthday", "date_of_death", "description", "image", "slug",
+)
+REQUIRED_FIELDS = {
+    "country": ("name",),
+    "genre": ("name", "url"),
+    "category": ("name", "url"),
+    "person": ("first_name", "last_name", "date_of_birthday"),
+    "movie": ("title",),
+}
+MOVIE_FIELDS = (
+    "title", "tagline", "description", "poster", "year", "world_premier", "budget", "fees_in_usa",
+    "fees_in_world", "draft", "slug",
+)
+RECORD_MODELS = {
+    "country": (Country, ("name",)),
+    "genre": (Genre, ("name", "description", "url")),
+    "category": (Category, ("name", "description", "url")),
+    "person": (Person, PERSON_FIELDS),
+    "movie": (Movie, MOVIE_FIELDS),
+}
+
+
+def read_records(path, file_format, default_type=None):
+    """
+    Построчно читает файл каталога, не загружая его целиком.
+    Отдает пары (номер строки, запись); тип записи берется из поля type или default_type.
+    Вместо строки JSON Lines, которая не разбирается в объект, отдается запись None.
+    """
+    with open(path, newline="", encoding="utf-8") as source:
+        if file_format == "csv":
+            rows = enumerate(csv.DictReader(source), 2)
+        else:
+            rows = ((number, parse_line(line)) for number, line in enumerate(source, 1) if line.strip())
+        for number, record in rows:
+            if record is None:
+                yield number, None
+                continue
+            record = {key: value for key, value in record.items() if value not in ("", None)}
+            record.setdefault("type", default_type)
+            yield number, record
+
+
+def parse_line(line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) else None
+
+
+def get_list(record, name):
+    """Список ссылок: массив в JSON Lines или строка через | в CSV, без повторов"""
+    value = record.get(name, [])
+    if isinstance(value, str):
+        value = value.split(LIST_SEPARATOR)
+    return list(dict.fromkeys(str(item).strip() for item in value if str(item).strip()))
+
+
+def pick(record, fields):
+    return {field: record[field] for field in fields if field in record}
+
+
+class CatalogueImporter:
+    """
+    Импорт каталога пачками. Записи копятся по типам и на каждой пачке пишутся
+    через bulk_create в одной транзакции: сначала справочники, затем персоны
+    и фильмы со строками M2M. Значения каждой записи проверяются полями модели
+    при добавлении: ошибочная строка попадает в on_error и пропускается, не обрывая импорт.
+    Ссылки на страны (name), жанры и категории (url) разрешаются по словарям
+    справочников в памяти, на персон (slug) - одним запросом на пачку; в памяти
+    остаются только key персон, созданных этим импортом.
+    """
+
+    def __init__(self, batch_size=1000, on_error=None):
+        # batch_size - записей на транзакцию; размер INSERT выбирает бэкенд
+        # (Django 3.0 не ограничивает явный batch_size лимитами SQLite)
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.countries = dict(Country.objects.values_list("name", "id"))
+        self.genres = dict(Genre.objects.values_list("url", "id"))
+        self.categories = dict(Category.objects.values_list("url", "id"))
+        # key -> id персон этого импорта, у которых key не совпадает со slug
+        self.person_keys = {}
+        self.pending = {record_type: {} for record_type in RECORD_TYPES}
+        self.created = Counter()
+        self.errors = 0
+
+    def error(self, number, message):
+        self.errors += 1
+        if self.on_error:
+            self.on_error(number, message)
+
+    def add(self, number, record):
+        if record is None:
+            return self.error(number, "строка не разбирается как объект JSON")
+        record_type = record.get("type")
+        if record_type not in RECORD_TYPES:
+            return self.error(number, f"неизвестный тип записи: {record_type}")
+        missing = [field for field in REQUIRED_FIELDS[record_type] if field not in record]
+        if missing:
+            return self.error(number, f"нет обязательных полей: {', '.join(missing)}")
+        key = self.get_key(number, record_type, record)
+        if record_type != "movie" and (key in self.get_lookup(record_type) or key in self.pending[record_type]):
+            return
+        obj = self.build(number, record_type, record)
+        if obj is None:
+            return
+        self.pending[record_type][key] = (number, record, obj)
+        if len(self.pending[record_type]) >= self.batch_size:
+            self.flush()
+
+    def get_key(self, number, record_type, record):
+        """Ключ записи для поиска по ссылкам и отсева повторов; фильмы и персоны без key - по номеру строки"""
+        if record_type == "country":
+            return record["name"]
+        if record_type in ("genre", "category"):
+            return record["url"]
+        if record_type == "person" and (record.get("key") or record.get("slug")):
+            return str(record.get("key") or record["slug"])
+        return number
+
+    def get_lookup(self, record_type):
+        return {
+            "country": self.countries, "genre": self.genres, "category": self.categories, "person": self.person_keys,
+        }[record_type]
+
+    def build(self, number, record_type, record):
+        """Объект модели из записи; переданные поля приводятся и проверяются как в форме (clean_fields)"""
+        model, fields = RECORD_MODELS[record_type]
+        values = pick(record, fields)
+        obj = model(**values)
+        try:
+            obj.clean_fields(exclude=[field.name for field in model._meta.fields if field.name not in values])
+        except ValidationError as e:
+            return self.error(number, "; ".join(
+                f"{name}: {' '.join(messages)}" for name, messages in e.message_dict.items()
+            ))
+        return obj
+
+    def get_persons(self, keys):
+        """id персон по key или slug: ключи этого импорта из памяти, остальные одним запросом"""
+        persons = {key: self.person_keys[key] for key in keys if key in self.person_keys}
+        slugs = [key for key in keys if key not in persons]
+        if slugs:
+            persons.update(Person.objects.filter(slug__in=slugs).values_list("slug", "id"))
+        return persons
+
+    def flush(self):
+        """Пишет все накопленные записи; ссылки разрешаются после записи справочников"""
+        with transaction.atomic():
+            self.flush_references(Country, "name", self.countries, "country")
+            self.flush_references(Genre, "url", self.genres, "genre")
+            self.flush_references(Category, "url", self.categories, "category")
+            self.flush_persons()
+            self.flush_movies()
+
+    def flush_references(self, model, field, lookup, record_type):
+        pending = self.pending[record_type]
+        if not pending:
+            return
+        model.objects.bulk_create([obj for _, _, obj in pending.values()])
+        lookup.update(model.objects.filter(**{f"{field}__in": list(pending)}).values_list(field, "id"))
+        self.created[record_type] += len(pending)
+        pending.clear()
+
+    def resolve(self, number, record, name, lookup):
+        """id по списку ссылок записи; None, если какой-то ссылки нет"""
+        ids = []
+        for key in get_list(record, name):
+            if key not in lookup:
+                self.error(number, f"{name}: не найдено {key}")
+                return None
+            ids.append(lookup[key])
+        return ids
+
+    def flush_persons(self):
+        pending = self.pending["person"]
+        if not pending:
+            return
+        # Персона с key, который уже есть в базе как slug, не создается повторно
+        existing = self.get_persons([key for key in pending if isinstance(key, str)])
+        persons, countries = [], []
+        for key, (number, record, person) in pending.items():
+            if key in existing:
+                continue
+            country_ids = self.resolve(number, record, "countries", self.countries)
+            if country_ids is None:
+                continue
+            persons.append((key, person))
+            countries.append(country_ids)
+        Person.objects.bulk_create_with_slugs([person for _, person in persons])
+        for key, person in persons:
+            if isinstance(key, str) and key != person.slug:
+                self.person_keys[key] = person.pk
+        Person.countries.through.objects.bulk_create([
+            Person.countries.through(person_id=person.pk, country_id=country_id)
+            for (_, person), country_ids in zip(persons, countries) for country_id in country_ids
+        ])
+        update_search_vectors(Person.objects.filter(pk__in=[person.pk for _, person in persons]))
+        self.created["person"] += len(persons)
+        pending.clear()
+
+    def flush_movies(self):
+        pending = self.pending["movie"]
+        if not pending:
+            return
+        persons = self.get_persons({
+            key for _, record, _ in pending.values()
+            for name in ("directors", "actors") for key in get_list(record, name)
+        })
+        movies, relations = [], []
+        for number, record, movie in pending.values():
+            category = record.get("category")
+            if category is not None and category not in self.categories:
+                self.error(number, f"category: не найдено {category}")
+                continue
+            related = {
+                "countries": self.resolve(number, record, "countries", self.countries),
+                "genres": self.resolve(number, record, "genres", self.genres),
+                "directors": self.resolve(number, record, "directors", persons),
+                "actors": self.resolve(number, record, "actors", persons),
+            }
+            if None in related.values():
+                continue
+            movie.category_id = self.categories.get(category)
+            movies.append(movie)
+            relations.append(related)
+        Movie.objects.bulk_create_with_slugs(movies)
+        for name, column in (("countries", "country_id"), ("genres", "genre_id"),
+                             ("directors", "person_id"), ("actors", "person_id")):
+            through = getattr(Movie, name).through
+            through.objects.bulk_create([
+                through(movie_id=movie.pk, **{column: related_id})
+                for movie, related in zip(movies, relations) for related_id in related[name]
+            ])
+        update_search_vectors(Movie.objects.filter(pk__in=[movie.pk for movie in movies]))
+        self.created["movie"] += len(movies)
+        pending.clear()
+
+    def finish(self):
+        self.flush()
+        # bulk_create не шлет сигналы, поэтому кэш ответов и индексы в памяти сбрасываются целиком
+        invalidate_all()
+        invalidate_local_indexes()
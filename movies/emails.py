@@ -0,0 +1,48 @@
+from django.conf import settings
+from djoser import email
+
+from .tasks import send_email
+
+
+class QueuedEmailMixin:
+    """
+    Письмо djoser рендерится в запросе (шаблону нужны request, пользователь и токен),
+    а отправка по SMTP уходит в очередь задач.
+    """
+
+    def send(self, to, *args, **kwargs):
+        self.render()
+        send_email.delay(
+            self.subject,
+            "" if self.content_subtype == "html" else self.body,
+            kwargs.pop("from_email", settings.DEFAULT_FROM_EMAIL),
+            list(to),
+            html=self.html,
+            cc=kwargs.pop("cc", []),
+            bcc=kwargs.pop("bcc", []),
+            reply_to=kwargs.pop("reply_to", []),
+        )
+
+
+class ActivationEmail(QueuedEmailMixin, email.ActivationEmail):
+    pass
+
+
+class ConfirmationEmail(QueuedEmailMixin, email.ConfirmationEmail):
+    pass
+
+
+class PasswordResetEmail(QueuedEmailMixin, email.PasswordResetEmail):
+    pass
+
+
+class PasswordChangedConfirmationEmail(QueuedEmailMixin, email.PasswordChangedConfirmationEmail):
+    pass
+
+
+class UsernameChangedConfirmationEmail(QueuedEmailMixin, email.UsernameChangedConfirmationEmail):
+    pass
+
+
+class UsernameResetEmail(QueuedEmailMixin, email.UsernameResetEmail):
+    pass
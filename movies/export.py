@@ -0,0 +1,59 @@
+import csv
+import io
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from .renderers import encode_json, iter_json_array
+
+LIST_SEPARATOR = "|"
+
+
+def iter_id_chunks(queryset, chunk_size):
+    """
+    id записей в порядке pk пачками по chunk_size. Каждая пачка - отдельный запрос pk > последнего:
+    между пачками не остается открытого курсора, и под ASGI выгрузку можно читать по частям,
+    пока соединение потока обслуживает другие запросы (см. movies/asgi.py).
+    """
+    ids = queryset.order_by("pk").values_list("pk", flat=True)
+    chunk = list(ids[:chunk_size])
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        chunk = list(ids.filter(pk__gt=chunk[-1])[:chunk_size])
+
+
+def render_ndjson(rows):
+    for row in rows:
+        yield encode_json(row) + b"\n"
+
+
+def get_csv_value(value):
+    """Списки строк склеиваются через | (как в import_catalogue), вложенные объекты пишутся JSON"""
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return LIST_SEPARATOR.join(value)
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, cls=JSONEncoder, ensure_ascii=False)
+    return value
+
+
+def render_csv(rows):
+    """CSV построчно: заголовок по полям первой записи"""
+    buffer = io.StringIO()
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow({key: get_csv_value(value) for key, value in row.items()})
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+EXPORT_FORMATS = {
+    "ndjson": (render_ndjson, "application/x-ndjson"),
+    "json": (iter_json_array, "application/json"),
+    "csv": (render_csv, "text/csv"),
+}
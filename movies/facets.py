@@ -0,0 +1,294 @@
+from collections import defaultdict
+
+from django_filters.constants import EMPTY_VALUES
+
+from .local_index import LocalIndex
+from .models import Category, Country, Genre, Movie
+
+# Связи фильма со значениями фасетов через M2M: (модель значения, промежуточная таблица, колонка)
+RELATIONS = {
+    "genres": (Genre, Movie.genres.through, "genre_id"),
+    "countries": (Country, Movie.countries.through, "country_id"),
+}
+NAMED_FACETS = {"genres": Genre, "countries": Country, "category": Category}
+FACETS = ("genres", "countries", "category", "year")
+# Параметры MovieFilter, которые считаются по битовым картам; остальные отбираются запросом к базе
+INDEXED_FILTERS = FACETS
+
+
+class Bitmap:
+    """
+    Битовая карта позиций фильмов в изменяемом bytearray: бит ставится и снимается
+    без копирования всей карты. int для пересечений собирается при первом чтении
+    после изменения и хранится до следующего.
+    """
+    __slots__ = ("data", "number")
+
+    def __init__(self, positions=()):
+        positions = list(positions)
+        self.data = bytearray((max(positions) >> 3) + 1 if positions else 0)
+        self.number = None
+        for position in positions:
+            self.data[position >> 3] |= 1 << (position & 7)
+
+    def add(self, position):
+        index = position >> 3
+        if index >= len(self.data):
+            self.data.extend(bytes(index + 1 - len(self.data)))
+        self.data[index] |= 1 << (position & 7)
+        self.number = None
+
+    def discard(self, position):
+        index = position >> 3
+        if index < len(self.data):
+            self.data[index] &= ~(1 << (position & 7)) & 0xFF
+            self.number = None
+
+    def to_int(self):
+        if self.number is None:
+            self.number = int.from_bytes(self.data, "little")
+        return self.number
+
+
+def count_bits(bitmap):
+    return bitmap.bit_count() if hasattr(bitmap, "bit_count") else bin(bitmap).count("1")
+
+
+class FacetIndex(LocalIndex):
+    """
+    Битовые карты опубликованных фильмов по каждому значению фасетов:
+    жанру, стране, категории и году. Счетчики считаются пересечением карт,
+    поэтому ответ не зависит от числа фильмов в базе так, как GROUP BY по M2M.
+    Бит фильма - его позиция в индексе, а не id: карты занимают по биту
+    на опубликованный фильм, позиции удаленных фильмов занимают новые.
+    Для каждого фильма хранятся его значения фасетов, чтобы снять его биты
+    без обхода всех карт.
+    """
+    version_name = "facets"
+
+    def __init__(self):
+        super().__init__()
+        self.positions = {}
+        self.free = []
+        self.all = Bitmap()
+        self.values = {facet: {} for facet in FACETS}
+        self.movie_values = {facet: {} for facet in FACETS}
+        self.names = {facet: {} for facet in NAMED_FACETS}
+
+    def build(self):
+        with self.lock:
+            positions, values = {}, {facet: defaultdict(list) for facet in FACETS}
+            movies = Movie.objects.filter(draft=False).values_list("id", "year", "category_id")
+            for pk, year, category_id in movies.iterator():
+                positions[pk] = len(positions)
+                values["year"][year].append(pk)
+                if category_id is not None:
+                    values["category"][category_id].append(pk)
+            for facet, (_, through, column) in RELATIONS.items():
+                rows = through.objects.filter(movie__draft=False).values_list(column, "movie_id")
+                for value, pk in rows.iterator():
+                    if pk in positions:
+                        values[facet][value].append(pk)
+
+            movie_values = {facet: defaultdict(list) for facet in FACETS}
+            for facet in FACETS:
+                for value, pks in values[facet].items():
+                    for pk in pks:
+                        movie_values[facet][pk].append(value)
+            self.positions, self.free = positions, []
+            self.all = Bitmap(range(len(positions)))
+            self.values = {
+                facet: {value: Bitmap(positions[pk] for pk in pks) for value, pks in values[facet].items()}
+                for facet in FACETS
+            }
+            self.movie_values = {
+                facet: {pk: tuple(movie_values[facet][pk]) for pk in movie_values[facet]} for facet in FACETS
+            }
+            self.names = {
+                facet: dict(model.objects.values_list("id", "name")) for facet, model in NAMED_FACETS.items()
+            }
+
+    def set_values(self, facet, pk, values):
+        """Заменяет значения фасета у фильма: снимаются только биты его прежних значений"""
+        position = self.positions[pk]
+        bitmaps = self.values[facet]
+        for value in self.movie_values[facet].pop(pk, ()):
+            bitmaps[value].discard(position)
+        for value in values:
+            bitmap = bitmaps.get(value)
+            if bitmap is None:
+                bitmap = bitmaps[value] = Bitmap()
+            bitmap.add(position)
+        if values:
+            self.movie_values[facet][pk] = tuple(values)
+
+    def update_movie(self, pk, year, category_id, draft):
+        """Пересчитывает все биты фильма: год, категорию, связи и публикацию"""
+        self.remove_movie(pk)
+        if draft:
+            return
+        position = self.positions[pk] = self.free.pop() if self.free else len(self.positions)
+        self.all.add(position)
+        self.set_values("year", pk, (year,))
+        if category_id is not None:
+            self.set_values("category", pk, (category_id,))
+        self.refresh_relations([pk])
+
+    def remove_movie(self, pk):
+        if pk not in self.positions:
+            return
+        for facet in FACETS:
+            self.set_values(facet, pk, ())
+        position = self.positions.pop(pk)
+        self.all.discard(position)
+        self.free.append(position)
+
+    def refresh_relations(self, movie_ids, facets=tuple(RELATIONS)):
+        """Перечитывает M2M-связи фильмов одним запросом на фасет"""
+        movie_ids = [pk for pk in movie_ids if pk in self.positions]
+        for facet in facets:
+            _, through, column = RELATIONS[facet]
+            related = {pk: [] for pk in movie_ids}
+            for value, pk in through.objects.filter(movie_id__in=movie_ids).values_list(column, "movie_id"):
+                related[pk].append(value)
+            for pk, values in related.items():
+                self.set_values(facet, pk, values)
+
+    def clear_value(self, facet, value):
+        """Значение снято со всех фильмов; редкая операция, значения фильмов перебираются целиком"""
+        self.values[facet].pop(value, None)
+        movie_values = self.movie_values[facet]
+        for pk, values in list(movie_values.items()):
+            if value in values:
+                values = tuple(item for item in values if item != value)
+                if values:
+                    movie_values[pk] = values
+                else:
+                    del movie_values[pk]
+
+    def set_name(self, facet, value, name):
+        self.names[facet][value] = name
+
+    def remove_value(self, facet, value):
+        self.clear_value(facet, value)
+        self.names[facet].pop(value, None)
+
+    def make_bitmap(self, movie_ids):
+        """Карта фильмов индекса из списка id"""
+        return Bitmap(self.positions[pk] for pk in movie_ids if pk in self.positions).to_int()
+
+    def get_selections(self, params):
+        """
+        Отобранные фильтром фильмы по каждому фасету (None - фасет не фильтруется).
+        params - cleaned_data MovieFilter.
+        """
+        selections = dict.fromkeys(FACETS)
+        names = params.get("genres")
+        if names:
+            genre_ids = [pk for pk, name in self.names["genres"].items() if name in names]
+            selections["genres"] = self.union("genres", genre_ids)
+        for facet in ("countries", "category"):
+            if params.get(facet):
+                selections[facet] = self.union(facet, [int(pk) for pk in params[facet]])
+        years = params.get("year")
+        if years is not None:
+            selections["year"] = self.union("year", [
+                year for year in self.values["year"]
+                if (years.start is None or year >= years.start) and (years.stop is None or year <= years.stop)
+            ])
+        return selections
+
+    def union(self, facet, values):
+        bitmap = 0
+        for value in values:
+            if value in self.values[facet]:
+                bitmap |= self.values[facet][value].to_int()
+        return bitmap
+
+    def get_facets(self, params, candidates=None):
+        """
+        Счетчики всех значений фасетов для текущего фильтра. Для каждого фасета
+        учитываются все условия, кроме его собственного, чтобы было видно,
+        сколько фильмов добавит выбор еще одного значения.
+        candidates - id фильмов, отобранных условиями вне индекса.
+        """
+        with self.lock:
+            selections = self.get_selections(params)
+            if candidates is not None:
+                selections["candidates"] = self.make_bitmap(candidates)
+            result = {"total": count_bits(self.intersect(selections))}
+            for facet in FACETS:
+                base = self.intersect(selections, exclude=facet)
+                counts = []
+                for value, bitmap in self.values[facet].items():
+                    count = count_bits(bitmap.to_int() & base)
+                    if count:
+                        counts.append((value, count))
+                result[facet] = self.format_counts(facet, counts)
+            return result
+
+    def intersect(self, selections, exclude=None):
+        bitmap = self.all.to_int()
+        for facet, selected in selections.items():
+            if facet != exclude and selected is not None:
+                bitmap &= selected
+        return bitmap
+
+    def format_counts(self, facet, counts):
+        if facet not in NAMED_FACETS:
+            return [{"value": value, "count": count} for value, count in sorted(counts, reverse=True)]
+        names = self.names[facet]
+        items = [{"id": value, "name": names.get(value, ""), "count": count} for value, count in counts]
+        return sorted(items, key=lambda item: (-item["count"], item["name"]))
+
+
+def movie_changed(movie):
+    index.apply_change(("update_movie", movie.pk, movie.year, movie.category_id, movie.draft))
+
+
+def movie_deleted(movie_id):
+    index.apply_change(("remove_movie", movie_id))
+
+
+def relations_changed(facet, instance, action, reverse, pk_set):
+    """M2M фильма с жанрами или странами изменился с любой стороны"""
+    if not reverse:
+        index.apply_change(("refresh_relations", [instance.pk], (facet,)))
+    elif action == "post_clear":
+        index.apply_change(("clear_value", facet, instance.pk))
+    else:
+        index.apply_change(("refresh_relations", sorted(pk_set), (facet,)))
+
+
+def value_changed(facet, instance):
+    index.apply_change(("set_name", facet, instance.pk, instance.name))
+
+
+def value_deleted(facet, pk):
+    index.apply_change(("remove_value", facet, pk))
+
+
+def get_candidates(filterset):
+    """
+    Фильмы, отобранные параметрами фильтра вне индекса (персоны, даты, бюджет, рейтинг),
+    одним запросом id. None, если таких параметров нет.
+    """
+    params = {
+        name: value for name, value in filterset.form.cleaned_data.items()
+        if name not in INDEXED_FILTERS and value not in EMPTY_VALUES
+    }
+    if not params:
+        return None
+    queryset = Movie.objects.filter(draft=False)
+    for name, value in params.items():
+        queryset = filterset.filters[name].filter(queryset, value)
+    return list(queryset.order_by().values_list("id", flat=True))
+
+
+def get_facets(filterset):
+    """Фасеты для проверенного MovieFilter"""
+    index.ensure_fresh()
+    return index.get_facets(filterset.form.cleaned_data, get_candidates(filterset))
+
+
+index = FacetIndex()
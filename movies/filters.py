@@ -1,4 +1,6 @@
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
+from django_filters.constants import EMPTY_VALUES
 
 from movies.models import Movie
 
@@ -7,10 +9,58 @@ class CharFilterInFilter(filters.BaseInFilter, filters.CharFilter):
     pass
 
 
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
+
+
+class ExistsInFilterMixin:
+    """
+    Фильтр по M2M через EXISTS в промежуточной таблице. Несколько таких условий
+    не размножают JOIN и строки фильма, поэтому DISTINCT не нужен.
+    related_lookup - поле связанной модели, по умолчанию id.
+    """
+
+    def __init__(self, *args, related_lookup=None, **kwargs):
+        self.related_lookup = related_lookup
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        field = qs.model._meta.get_field(self.field_name)
+        lookup = field.m2m_reverse_field_name()
+        if self.related_lookup:
+            lookup = f"{lookup}__{self.related_lookup}"
+        related = field.remote_field.through.objects.filter(**{
+            field.m2m_field_name(): OuterRef("pk"), f"{lookup}__in": value,
+        })
+        return qs.filter(Exists(related))
+
+
+class CharExistsInFilter(ExistsInFilterMixin, CharFilterInFilter):
+    pass
+
+
+class NumberExistsInFilter(ExistsInFilterMixin, NumberInFilter):
+    pass
+
+
 class MovieFilter(filters.FilterSet):
-    genres = CharFilterInFilter(field_name='genres__name', lookup_expr='in')
+    genres = CharExistsInFilter(field_name='genres', related_lookup='name')
     year = filters.RangeFilter()
+    countries = NumberExistsInFilter(field_name='countries')
+    category = NumberInFilter(field_name='category', lookup_expr='in')
+    directors = NumberExistsInFilter(field_name='directors')
+    actors = NumberExistsInFilter(field_name='actors')
+    premiere = filters.DateFromToRangeFilter(field_name='world_premier')
+    budget = filters.RangeFilter()
+    fees_in_usa = filters.RangeFilter()
+    fees_in_world = filters.RangeFilter()
+    rating_min = filters.NumberFilter(field_name='average_rating', lookup_expr='gte')
 
     class Meta:
         model = Movie
-        fields = ('genres', 'year')
+        fields = (
+            'genres', 'year', 'countries', 'category', 'directors', 'actors', 'premiere',
+            'budget', 'fees_in_usa', 'fees_in_world', 'rating_min',
+        )
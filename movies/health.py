@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connections
+
+
+def check_database(alias):
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+    except DatabaseError:
+        return False
+    return True
+
+
+def check_cache():
+    cache = caches[settings.API_CACHE_ALIAS]
+    try:
+        cache.set("health", 1, 10)
+        return cache.get("health") == 1
+    except Exception:  # у бэкендов кэша нет общего класса ошибок
+        return False
+
+
+def get_health():
+    """Доступность каждой базы из DATABASES и кэша ответов"""
+    checks = {alias: check_database(alias) for alias in connections}
+    checks["cache"] = check_cache()
+    return checks
+
+
+def check_connections():
+    """
+    Постоянные соединения (CONN_MAX_AGE) проверяются в начале запроса: соединение,
+    оборванное перезапуском базы или балансировщиком, закрывается и открывается заново,
+    а не роняет запрос. Закрытое в конце прошлого запроса соединение не проверяется,
+    как и то, что отработало запрос не дольше DATABASE_HEALTH_CHECK_IDLE секунд назад:
+    под нагрузкой SELECT 1 к каждой базе в каждом запросе был бы лишним.
+    """
+    idle_since = time.monotonic() - settings.DATABASE_HEALTH_CHECK_IDLE
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        if getattr(connection, "released_at", 0) < idle_since and not connection.is_usable():
+            connection.close()
+
+
+def mark_connections_released():
+    """Конец запроса: открытые соединения только что работали, отсюда отсчет простоя"""
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.released_at = now
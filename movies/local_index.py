@@ -0,0 +1,108 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .cache import get_cache, get_versions, make_version_key, new_version
+
+INDEXES = []
+
+
+class LocalIndex:
+    """
+    Индекс в памяти процесса, построенный по базе. Изменение - кортеж
+    (имя метода индекса, аргументы...): после коммита оно пишется в журнал
+    в общем кэше под следующей версией version_name, и каждый процесс,
+    увидев новую версию, применяет пропущенные изменения журнала по порядку.
+    Перестройка нужна, только если журнал неполон (вытеснен, отстал больше
+    чем на LOCAL_INDEX_LOG_SIZE изменений, индекс сброшен через invalidate).
+    Версия сверяется не чаще раза в LOCAL_INDEX_SYNC_INTERVAL секунд.
+    """
+    version_name = None
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.checked_at = 0
+        INDEXES.append(self)
+
+    def build(self):
+        raise NotImplementedError
+
+    def apply(self, change):
+        name, *args = change
+        getattr(self, name)(*args)
+
+    def ensure_fresh(self):
+        """Догоняет версию в кэше по журналу, а без полного журнала перестраивает индекс"""
+        now = time.monotonic()
+        if self.version is not None and now - self.checked_at < settings.LOCAL_INDEX_SYNC_INTERVAL:
+            return
+        with self.lock:
+            version = get_versions(self.version_name)[0]
+            if version != self.version and not self.replay(version):
+                self.build()
+            self.version = version
+            self.checked_at = now
+
+    def replay(self, version):
+        """Применяет изменения журнала после своей версии до version; False, если журнал неполон"""
+        if self.version is None or not 0 < version - self.version <= settings.LOCAL_INDEX_LOG_SIZE:
+            return False
+        keys = [self.make_change_key(number) for number in range(self.version + 1, version + 1)]
+        changes = get_cache().get_many(keys)
+        if len(changes) < len(keys):
+            return False
+        for key in keys:
+            self.apply(changes[key])
+        return True
+
+    def apply_change(self, change):
+        """
+        Изменение применяется и публикуется только после коммита: при откате
+        индексы всех процессов остаются как были.
+        """
+        transaction.on_commit(lambda: self.publish(change))
+
+    def publish(self, change):
+        """
+        Пишет изменение в журнал. Свой индекс применяет его сразу, если до этого
+        был на предыдущей версии, иначе догонит журнал при следующем запросе.
+        """
+        with self.lock:
+            version = self.bump_version()
+            get_cache().set(self.make_change_key(version), change, settings.LOCAL_INDEX_LOG_TIMEOUT)
+            if self.version is not None and version == self.version + 1:
+                self.apply(change)
+                self.version = version
+            else:
+                self.checked_at = 0
+
+    def make_change_key(self, version):
+        return f"{make_version_key(self.version_name)}:change:{version}"
+
+    def invalidate(self):
+        """Заставляет все процессы перестроить индекс, например после массовых изменений без сигналов"""
+        transaction.on_commit(self.reset)
+
+    def reset(self):
+        with self.lock:
+            self.bump_version()
+            self.version = None
+
+    def bump_version(self):
+        cache = get_cache()
+        key = make_version_key(self.version_name)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            version = new_version()
+            cache.set(key, version, None)
+            return version
+
+
+def invalidate_local_indexes():
+    """Перестраивает все индексы во всех процессах: после bulk_create и update() сигналов не бывает"""
+    for index in INDEXES:
+        index.invalidate()
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from movies.benchmarks import SCENARIOS, delete_seeded_catalogue, seed_catalogue
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет базу тестовым каталогом и замеряет сценарии (медиана, мс). "
+        "Данные откатываются после замера, если не указан --keep. "
+        "Для нагрузочных сценариев каталог фиксируется и удаляется после замера."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenarios", nargs="*", help=f"Сценарии: {', '.join(sorted(SCENARIOS))}. По умолчанию все")
+        parser.add_argument("--movies", type=int, default=2000)
+        parser.add_argument("--persons", type=int, default=500)
+        parser.add_argument("--ratings-per-movie", type=int, default=50)
+        parser.add_argument("--reviews-per-movie", type=int, default=5)
+        parser.add_argument("--repeat", type=int, default=200, help="Повторов на каждый замер")
+        parser.add_argument("--keep", action="store_true", help="Не откатывать тестовые данные")
+
+    def handle(self, *args, **options):
+        unknown = set(options["scenarios"]) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+        names = options["scenarios"] or sorted(SCENARIOS)
+        if options["keep"]:
+            self.run(names, options)
+            return
+        committed = [name for name in names if getattr(SCENARIOS[name], "committed", False)]
+        isolated = [name for name in names if name not in committed]
+        if isolated:
+            try:
+                with transaction.atomic():
+                    self.run(isolated, options)
+                    raise Rollback
+            except Rollback:
+                pass
+        if committed:
+            try:
+                self.run(committed, options)
+            finally:
+                delete_seeded_catalogue()
+
+    def run(self, names, options):
+        movie_ids = seed_catalogue(
+            movies=options["movies"],
+            persons=options["persons"],
+            ratings_per_movie=options["ratings_per_movie"],
+            reviews_per_movie=options["reviews_per_movie"],
+        )
+        self.stdout.write(f"Фильмов: {len(movie_ids)}, оценок: {len(movie_ids) * options['ratings_per_movie']}")
+        for name in names:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, value in SCENARIOS[name](movie_ids, options):
+                self.stdout.write(f"  {label:<40} {value:10.3f}")
@@ -0,0 +1,25 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from movies.ratings import flush_rating_buffer
+
+
+class Command(BaseCommand):
+    help = "Фоновый обработчик буфера голосов: применяет голоса пачками раз в интервал"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=settings.RATING_FLUSH_INTERVAL, help="Секунд между сбросами")
+        parser.add_argument("--batch-size", type=int, default=settings.RATING_FLUSH_BATCH_SIZE)
+        parser.add_argument("--once", action="store_true", help="Сбросить буфер один раз и выйти")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            applied = flush_rating_buffer(batch_size=options["batch_size"])
+            if applied:
+                self.stdout.write(f"Применено голосов: {applied} за {time.monotonic() - started:.3f} с")
+            if options["once"]:
+                return
+            time.sleep(max(options["interval"] - (time.monotonic() - started), 0))
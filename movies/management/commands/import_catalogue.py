@@ -0,0 +1,52 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.catalogue import RECORD_TYPES, CatalogueImporter, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Импортирует каталог (страны, жанры, категории, персоны, фильмы) из JSON Lines или CSV. "
+        "Файл читается построчно, записи пишутся пачками через bulk_create. "
+        "Ссылки: страны по name, жанры и категории по url, персоны по key или slug, списки в CSV через |."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Файл .jsonl или .csv")
+        parser.add_argument("--format", help="jsonl или csv. По умолчанию по расширению файла")
+        parser.add_argument("--type", help=f"Тип записей без поля type: {', '.join(RECORD_TYPES)}")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Записей в пачке и транзакции")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"Файл не найден: {path}")
+        file_format = options["format"] or ("csv" if path.lower().endswith(".csv") else "jsonl")
+        if file_format not in ("jsonl", "csv"):
+            raise CommandError(f"Неизвестный формат: {file_format}")
+        if options["type"] is not None and options["type"] not in RECORD_TYPES:
+            raise CommandError(f"Неизвестный тип записей: {options['type']}")
+
+        importer = CatalogueImporter(batch_size=options["batch_size"], on_error=self.report_error)
+        started = time.monotonic()
+        rows = 0
+        try:
+            for number, record in read_records(path, file_format, options["type"]):
+                rows += 1
+                importer.add(number, record)
+            importer.finish()
+        except ValueError as e:
+            raise CommandError(f"Ошибка чтения файла после строки {rows}: {e}")
+        elapsed = time.monotonic() - started
+
+        created = ", ".join(f"{record_type}: {importer.created[record_type]}" for record_type in RECORD_TYPES)
+        style = self.style.WARNING if importer.errors else self.style.SUCCESS
+        self.stdout.write(style(
+            f"Строк: {rows} за {elapsed:.2f} с ({rows / max(elapsed, 1e-6):.0f} строк/с). "
+            f"Создано - {created}. Ошибок: {importer.errors}"
+        ))
+
+    def report_error(self, number, message):
+        self.stderr.write(f"Строка {number}: {message}")
@@ -0,0 +1,49 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from movies.renditions import IMAGE_FIELDS, make_renditions, record_renditions
+
+
+class Command(BaseCommand):
+    help = (
+        "Строит превью для уже загруженных постеров, фото персон и кадров. "
+        "Файлы обрабатываются параллельно: Pillow отпускает GIL на декодировании и сжатии. "
+        "Построенные превью отмечаются у записей, и API отдает ссылки на них вместо оригинала"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--type", choices=sorted(IMAGE_FIELDS), action="append", help="По умолчанию все")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--overwrite", action="store_true", help="Перестроить и уже существующие превью")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        files = set()
+        for name in options["type"] or sorted(IMAGE_FIELDS):
+            model, field = IMAGE_FIELDS[name]
+            storage = model._meta.get_field(field).storage
+            for file_name in model.objects.exclude(**{field: ""}).values_list(field, flat=True).distinct():
+                files.add((name, storage, file_name))
+        files = list(files)
+
+        def process(item):
+            _, storage, file_name = item
+            try:
+                return make_renditions(storage, file_name, overwrite=options["overwrite"]), None
+            except (OSError, ValueError) as error:
+                return 0, f"{file_name}: {error}"
+
+        written = 0
+        with ThreadPoolExecutor(max_workers=max(options["workers"], 1)) as executor:
+            for (image_type, _, file_name), (count, error) in zip(files, executor.map(process, files)):
+                written += count
+                if error:
+                    self.stderr.write(error)
+                else:
+                    record_renditions(image_type, file_name)
+        self.stdout.write(self.style.SUCCESS(
+            f"Файлов: {len(files)}, записано превью: {written} за {time.monotonic() - started:.1f} с"
+        ))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from movies.cache import invalidate_all
+from movies.models import RATING_AGGREGATE_FIELDS, Movie, get_version_bump
+from movies.ratings import calculate_rating_aggregates, get_average
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает хранимые агрегаты рейтинга фильмов и сообщает о расхождениях"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Размер пачки для bulk_update")
+        parser.add_argument("--dry-run", action="store_true", help="Только показать расхождения")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        actual = calculate_rating_aggregates()
+        movies = Movie.objects.only("id", "title", "rating_count", "rating_sum", "average_rating").order_by("pk")
+
+        drifted = []
+        checked = 0
+        for movie in movies.iterator(chunk_size=batch_size):
+            checked += 1
+            count, total = actual.get(movie.pk, (0, 0))
+            average = get_average(count, total)
+            if (movie.rating_count, movie.rating_sum, movie.average_rating) == (count, total, average):
+                continue
+            self.stdout.write(
+                f"{movie.pk} {movie}: count {movie.rating_count} -> {count}, sum {movie.rating_sum} -> {total}, "
+                f"average {movie.average_rating} -> {average}"
+            )
+            movie.rating_count = count
+            movie.rating_sum = total
+            movie.average_rating = average
+            drifted.append(movie)
+
+        if drifted and not options["dry_run"]:
+            with transaction.atomic():
+                Movie.objects.bulk_update(drifted, RATING_AGGREGATE_FIELDS, batch_size=batch_size)
+                Movie.objects.filter(pk__in=[movie.pk for movie in drifted]).update(**get_version_bump())
+            invalidate_all()
+
+        style = self.style.WARNING if drifted else self.style.SUCCESS
+        action = "найдено" if options["dry_run"] else "исправлено"
+        self.stdout.write(style(f"Проверено фильмов: {checked}, расхождений {action}: {len(drifted)}"))
@@ -0,0 +1,43 @@
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from movies.task_queue import release_stale_tasks, run_pending
+
+
+class Command(BaseCommand):
+    help = (
+        "Обработчик фоновых задач из очереди в базе: превью изображений, письма. "
+        "Задачи выполняются в --concurrency потоках, упавшие повторяются с растущей задержкой"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=settings.TASKS_CONCURRENCY)
+        parser.add_argument("--interval", type=float, default=settings.TASKS_POLL_INTERVAL,
+                            help="Пауза между опросами пустой очереди, с")
+        parser.add_argument("--once", action="store_true", help="Выполнить готовые задачи и выйти")
+
+    def handle(self, *args, **options):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        concurrency = max(options["concurrency"], 1)
+        executor = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+        done = failed = 0
+        try:
+            while True:
+                release_stale_tasks()
+                succeeded, errors = run_pending(worker, concurrency * 2, executor)
+                done, failed = done + succeeded, failed + errors
+                if not succeeded + errors:
+                    if options["once"]:
+                        break
+                    time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        self.stdout.write(self.style.SUCCESS(f"Выполнено задач: {done}, с ошибкой: {failed}"))
@@ -0,0 +1,173 @@
+# Generated by Django 3.0.5 on 2026-10-17 11:27
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=150, verbose_name='Категория')),
+                ('description', models.TextField(verbose_name='Описание')),
+                ('url', models.SlugField(max_length=150, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Категория',
+                'verbose_name_plural': 'Категории',
+            },
+        ),
+        migrations.CreateModel(
+            name='Country',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=90, verbose_name='Имя')),
+            ],
+            options={
+                'verbose_name': 'Страна',
+                'verbose_name_plural': 'Страны',
+            },
+        ),
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=60, verbose_name='Жанр')),
+                ('description', models.TextField(verbose_name='Описание')),
+                ('url', models.SlugField(max_length=60, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Жанр',
+                'verbose_name_plural': 'Жанры',
+            },
+        ),
+        migrations.CreateModel(
+            name='Movie',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=120, verbose_name='Название')),
+                ('tagline', models.CharField(default='', max_length=120, verbose_name='Слоган')),
+                ('description', models.TextField(verbose_name='Описание')),
+                ('poster', models.ImageField(upload_to='movies/', verbose_name='Постер')),
+                ('year', models.PositiveIntegerField(default=2019, verbose_name='Дата выхода')),
+                ('world_premier', models.DateField(default=datetime.date.today, verbose_name='Премьера в мире')),
+                ('budget', models.PositiveIntegerField(default=0, help_text='указывать сумму в долларах', verbose_name='Бюджет')),
+                ('fees_in_usa', models.PositiveIntegerField(default=0, help_text='указывать сумму в долларах', verbose_name='Сборы в США')),
+                ('fees_in_world', models.PositiveIntegerField(default=0, help_text='указывать сумму в долларах', verbose_name='Сборы в мире')),
+                ('draft', models.BooleanField(default=False, verbose_name='Черновик')),
+                ('slug', models.SlugField(blank=True)),
+            ],
+            options={
+                'verbose_name': 'Фильм',
+                'verbose_name_plural': 'Фильмы',
+            },
+        ),
+        migrations.CreateModel(
+            name='RatingStars',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.PositiveSmallIntegerField(default=0, verbose_name='Значение')),
+            ],
+            options={
+                'verbose_name': 'Звезда рейтинга',
+                'verbose_name_plural': 'Звезды рейтинга',
+                'ordering': ('-value',),
+            },
+        ),
+        migrations.CreateModel(
+            name='Review',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254)),
+                ('name', models.CharField(max_length=90, verbose_name='Имя')),
+                ('text', models.TextField(max_length=5000, verbose_name='Сообщение')),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reviews', to='movies.Movie', verbose_name='фильм')),
+                ('parent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='children', to='movies.Review', verbose_name='Родитель')),
+            ],
+            options={
+                'verbose_name': 'Отзыв',
+                'verbose_name_plural': 'Отзывы',
+            },
+        ),
+        migrations.CreateModel(
+            name='Rating',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip', models.CharField(max_length=90, verbose_name='IP адрес')),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ratings', to='movies.Movie', verbose_name='фильм')),
+                ('star', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ratings', to='movies.RatingStars', verbose_name='звезда')),
+            ],
+            options={
+                'verbose_name': 'Рейтинг',
+                'verbose_name_plural': 'Рейтинги',
+                'ordering': ('-star',),
+            },
+        ),
+        migrations.CreateModel(
+            name='Person',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_name', models.CharField(max_length=90, verbose_name='Имя')),
+                ('last_name', models.CharField(max_length=90, verbose_name='Фамилия')),
+                ('second_name', models.CharField(blank=True, max_length=90, verbose_name='Отчество')),
+                ('date_of_birthday', models.DateField(verbose_name='Дата рождния')),
+                ('date_of_death', models.DateField(blank=True, default=None, null=True, verbose_name='Дата смерти')),
+                ('description', models.TextField(verbose_name='Описание')),
+                ('image', models.ImageField(upload_to='actors/', verbose_name='Изображение')),
+                ('slug', models.SlugField(blank=True)),
+                ('countries', models.ManyToManyField(related_name='person_country', to='movies.Country', verbose_name='страны')),
+            ],
+            options={
+                'verbose_name': 'Актеры и режиссеры',
+                'verbose_name_plural': 'Актеры и режиссеры',
+            },
+        ),
+        migrations.CreateModel(
+            name='MovieShots',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=120, verbose_name='Заголовок')),
+                ('description', models.TextField(verbose_name='Описание')),
+                ('image', models.ImageField(upload_to='movie_shots/', verbose_name='Изображение')),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movieshots', to='movies.Movie', verbose_name='Фильм')),
+            ],
+            options={
+                'verbose_name': 'Кадр из фильма',
+                'verbose_name_plural': 'Кадры из фильма',
+            },
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='actors',
+            field=models.ManyToManyField(related_name='movie_actor', to='movies.Person', verbose_name='актеры'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='category',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='movies.Category', verbose_name='Категория'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='countries',
+            field=models.ManyToManyField(blank=True, related_name='movie_country', to='movies.Country', verbose_name='страны'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='directors',
+            field=models.ManyToManyField(related_name='movie_director', to='movies.Person', verbose_name='режиссеры'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='genres',
+            field=models.ManyToManyField(to='movies.Genre', verbose_name='жанры'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.0.5 on 2026-10-17 11:28
+
+from django.db import migrations, models
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    Rating = apps.get_model('movies', 'Rating')
+    rows = Rating.objects.order_by().values('movie_id').annotate(
+        count=models.Count('id'), total=models.Sum('star__value')
+    )
+    for row in rows:
+        total = row['total'] or 0
+        Movie.objects.filter(pk=row['movie_id']).update(
+            rating_count=row['count'], rating_sum=total, average_rating=total / row['count']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='average_rating',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Средняя оценка'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество оценок'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Сумма оценок'),
+        ),
+        migrations.RunPython(fill_rating_aggregates, migrations.RunPython.noop),
+    ]
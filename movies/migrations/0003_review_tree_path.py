@@ -0,0 +1,60 @@
+# Generated by Django 3.0.5 on 2026-10-17 11:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_review_paths(apps, schema_editor):
+    Review = apps.get_model('movies', 'Review')
+    parents = dict(Review.objects.values_list('id', 'parent_id'))
+    positions = {}
+
+    def position(review_id):
+        # Путь считается от корня вниз, без рекурсии
+        chain = []
+        while review_id is not None and review_id not in positions and review_id not in chain:
+            chain.append(review_id)
+            review_id = parents.get(review_id)
+        for current in reversed(chain):
+            parent_id = parents.get(current)
+            if parent_id not in positions:
+                positions[current] = ('', 0, None)
+            else:
+                path, depth, thread = positions[parent_id]
+                positions[current] = (f'{path}{parent_id:010d}', depth + 1, thread or parent_id)
+        return positions[chain[0]] if chain else positions[review_id]
+
+    reviews = list(Review.objects.only('id'))
+    for review in reviews:
+        review.path, review.depth, review.thread_id = position(review.id)
+    Review.objects.bulk_update(reviews, ('path', 'depth', 'thread'), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0002_movie_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Глубина'),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=1000, verbose_name='Путь в дереве'),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='thread',
+            field=models.ForeignKey(blank=True, db_constraint=False, editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='thread_replies', to='movies.Review', verbose_name='Корневой отзыв'),
+        ),
+        migrations.RunPython(fill_review_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['movie', 'path'], name='movies_revi_movie_i_4abfbf_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.5 on 2026-10-17 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0003_review_tree_path'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['draft', 'id'], name='movie_draft_id_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.0.5 on 2026-10-17 11:34
+
+from django.db import migrations, models
+
+
+def remove_duplicate_ratings(apps, schema_editor):
+    """Оставляет последнюю оценку на пару (фильм, ip) и пересчитывает агрегаты затронутых фильмов"""
+    Movie = apps.get_model('movies', 'Movie')
+    Rating = apps.get_model('movies', 'Rating')
+    duplicates = Rating.objects.order_by().values('movie_id', 'ip').annotate(
+        n=models.Count('id'), keep=models.Max('id')
+    ).filter(n__gt=1)
+    movie_ids = set()
+    for row in duplicates:
+        Rating.objects.filter(movie_id=row['movie_id'], ip=row['ip']).exclude(pk=row['keep']).delete()
+        movie_ids.add(row['movie_id'])
+    rows = Rating.objects.filter(movie_id__in=movie_ids).order_by().values('movie_id').annotate(
+        count=models.Count('id'), total=models.Sum('star__value')
+    )
+    for row in rows:
+        Movie.objects.filter(pk=row['movie_id']).update(
+            rating_count=row['count'], rating_sum=row['total'], average_rating=row['total'] / row['count']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0004_movie_draft_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_ratings, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['year'], name='movie_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['ip', 'movie'], name='rating_ip_movie_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['movie', 'parent'], name='review_movie_parent_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.UniqueConstraint(fields=('movie', 'ip'), name='rating_movie_ip_unique'),
+        ),
+    ]
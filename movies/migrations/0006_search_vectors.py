@@ -0,0 +1,57 @@
+# Generated by Django 3.0.5 on 2026-10-17 11:51
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Векторы как в movies.search.SEARCH_FIELDS; GIN-индексы только на PostgreSQL,
+# на остальных базах поиск работает через icontains
+SEARCH_VECTORS = {
+    'movies_movie': (
+        "setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('simple', regexp_replace(coalesce(slug, ''), '^[0-9]+-', '')), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(tagline, '')), 'B') || "
+        "setweight(to_tsvector('russian', coalesce(description, '')), 'C')"
+    ),
+    'movies_person': (
+        "setweight(to_tsvector('russian', coalesce(first_name, '')), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(last_name, '')), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(second_name, '')), 'B') || "
+        "setweight(to_tsvector('simple', regexp_replace(coalesce(slug, ''), '^[0-9]+-', '')), 'A')"
+    ),
+}
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, vector in SEARCH_VECTORS.items():
+        schema_editor.execute(f'UPDATE {table} SET search_vector = {vector}')
+        schema_editor.execute(f'CREATE INDEX {table}_search_idx ON {table} USING gin (search_vector)')
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in SEARCH_VECTORS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {table}_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0005_rating_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.5 on 2026-10-17 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_search_vectors'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(condition=models.Q(draft=False), fields=['world_premier'], name='movie_premiere_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(condition=models.Q(draft=False), fields=['budget'], name='movie_budget_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(condition=models.Q(draft=False), fields=['fees_in_usa'], name='movie_fees_usa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(condition=models.Q(draft=False), fields=['fees_in_world'], name='movie_fees_world_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(condition=models.Q(draft=False), fields=['average_rating'], name='movie_rating_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.5 on 2026-10-17 12:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0009_task_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='renditions',
+            field=models.CharField(blank=True, editable=False, max_length=200, verbose_name='Построенные превью'),
+        ),
+        migrations.AddField(
+            model_name='movieshots',
+            name='renditions',
+            field=models.CharField(blank=True, editable=False, max_length=200, verbose_name='Построенные превью'),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='renditions',
+            field=models.CharField(blank=True, editable=False, max_length=200, verbose_name='Построенные превью'),
+        ),
+    ]
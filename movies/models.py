@@ -1,12 +1,13 @@
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import ValidationError
+from django.db import connections, models, transaction
+from django.db.models.functions import Coalesce, Concat, Substr
 from django.urls import reverse
-from django.utils.text import slugify
+from django.utils import timezone
 
 from datetime import date
 
-from transliterate import translit
-
-from .services import get_client_ip_from_request
+from .services import get_client_ip_from_request, make_slug, reserve_pks
 
 class Country(models.Model):
     name = models.CharField("Имя", max_length=90)
@@ -19,7 +20,95 @@ class Country(models.Model):
         verbose_name_plural = "Страны"
 
 
-class Person(models.Model):
+class SlugQuerySet(models.QuerySet):
+
+    def bulk_create_with_slugs(self, objs, batch_size=None):
+        """
+        bulk_create, который заполняет пустые слаги и id всех новых объектов.
+        На PostgreSQL id резервируются заранее и пачка пишется одним INSERT.
+        На остальных базах id новых строк возвращает сама вставка (пачкой,
+        если бэкенд умеет RETURNING, иначе по строке), а слаги дописываются
+        одним bulk_update после нее.
+        """
+        objs = list(objs)
+        unslugged = [obj for obj in objs if not obj.slug]
+        new = [obj for obj in objs if obj.pk is None]
+        pks = reserve_pks(self.model, len(new))
+        if pks is not None:
+            for obj, pk in zip(new, pks):
+                obj.pk = pk
+            for obj in unslugged:
+                obj.slug = make_slug(obj.pk, obj.get_slug_text())
+            return self.bulk_create(objs, batch_size=batch_size)
+
+        with transaction.atomic(using=self.db):
+            if connections[self.db].features.can_return_rows_from_bulk_insert:
+                self.bulk_create(objs, batch_size=batch_size)
+            else:
+                self.bulk_create([obj for obj in objs if obj.pk is not None], batch_size=batch_size)
+                self.insert_one_by_one(new)
+            for obj in unslugged:
+                obj.slug = make_slug(obj.pk, obj.get_slug_text())
+            self.bulk_update(unslugged, ("slug",), batch_size=batch_size)
+        return objs
+
+    def insert_one_by_one(self, objs):
+        """
+        Вставка без RETURNING у многострочного INSERT: по строке на объект,
+        id берется из ответа базы на каждую вставку, как в Model.save(), но без сигналов.
+        """
+        meta = self.model._meta
+        fields = [field for field in meta.local_concrete_fields if field is not meta.auto_field]
+        for obj in objs:
+            [obj.pk] = self._insert([obj], fields=fields, returning_fields=[meta.pk], using=self.db)
+            obj._state.adding, obj._state.db = False, self.db
+
+
+class SlugMixin:
+    """
+    Слаг вида <id>-<транслит> за одну запись в базу.
+    Модель задает текст слага в get_slug_text().
+    """
+
+    def save(self, *args, **kwargs):
+        if not self.slug:
+            if self.pk is None and not args:
+                pks = reserve_pks(type(self), 1)
+                if pks:
+                    self.pk = pks[0]
+                    kwargs["force_insert"] = True
+            if self.pk is not None:
+                self.slug = make_slug(self.pk, self.get_slug_text())
+                if kwargs.get("update_fields") is not None:
+                    kwargs["update_fields"] = [*kwargs["update_fields"], "slug"]
+        super().save(*args, **kwargs)
+        if not self.slug:
+            # id известен только после вставки: слаг дописывается UPDATE, без повторного save и сигналов
+            self.slug = make_slug(self.pk, self.get_slug_text())
+            type(self)._default_manager.filter(pk=self.pk).update(slug=self.slug)
+
+
+def get_version_bump():
+    """Значения UPDATE, которые сдвигают версию записей и время их изменения"""
+    return {"version": models.F("version") + 1, "updated_at": timezone.now()}
+
+
+class VersionMixin:
+    """
+    Версия записи для условных запросов (ETag, Last-Modified): version растет
+    при каждом save, updated_at ставит auto_now. Изменения связей и агрегатов
+    сдвигают версию UPDATE-ом с get_version_bump().
+    """
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = [*kwargs["update_fields"], "version", "updated_at"]
+        super().save(*args, **kwargs)
+
+
+class Person(SlugMixin, VersionMixin, models.Model):
     """Актеры и режиссеры"""
     first_name = models.CharField("Имя", max_length=90)
     last_name = models.CharField("Фамилия", max_length=90)
@@ -29,23 +118,17 @@ class Person(models.Model):
     date_of_death = models.DateField("Дата смерти", blank=True, null=True, default=None)
     description = models.TextField("Описание")
     image = models.ImageField("Изображение", upload_to="actors/")
+    renditions = models.CharField("Построенные превью", max_length=200, blank=True, editable=False)
     slug = models.SlugField(blank=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField("Изменено", auto_now=True)
+    version = models.PositiveIntegerField("Версия", default=1, editable=False)
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+    objects = SlugQuerySet.as_manager()
 
-        """
-        Пытаемся создать слаг-транслит русских имени и фамилии, иначе делает слаг из английского.
-        Обязательные требования: у модели должны быть поля first_name, last_name и slug.
-        Пример: Арнольд Шварцнеггер(id:1) -> 1-arnold-shvartsnegger
-        """
-        if not self.slug:
-            try:
-                self.slug = f"{self.pk}-" \
-                    f"{slugify(translit(f'{self.first_name} {self.last_name}', reversed=True))}"
-            except:
-                self.slug = f"{self.pk}-{slugify(f'{self.first_name} {self.last_name}')}"
-            self.save(update_fields=("slug",))
+    def get_slug_text(self):
+        """Пример: Арнольд Шварцнеггер(id:1) -> 1-arnold-shvartsnegger"""
+        return f"{self.first_name} {self.last_name}"
 
     def get_age(self):
         if self.date_of_death:
@@ -100,12 +183,17 @@ class Category(models.Model):
         verbose_name_plural = "Категории"
 
 
-class Movie(models.Model):
+# Агрегаты оценок фильма: пишутся только UPDATE с F-выражениями (ratings.py) и пересчетом
+RATING_AGGREGATE_FIELDS = ("rating_count", "rating_sum", "average_rating")
+
+
+class Movie(SlugMixin, VersionMixin, models.Model):
     """Фильмы"""
     title = models.CharField("Название", max_length=120)
     tagline = models.CharField("Слоган", max_length=120, default="")
     description = models.TextField("Описание")
     poster = models.ImageField("Постер", upload_to="movies/")
+    renditions = models.CharField("Построенные превью", max_length=200, blank=True, editable=False)
     year = models.PositiveIntegerField("Дата выхода", default=2019)
     countries = models.ManyToManyField(Country, verbose_name="страны", related_name="movie_country", blank=True)
     directors = models.ManyToManyField(Person, verbose_name="режиссеры", related_name="movie_director")
@@ -124,22 +212,32 @@ class Movie(models.Model):
     )
     draft = models.BooleanField("Черновик", default=False)
     slug = models.SlugField(blank=True)
+    rating_count = models.PositiveIntegerField("Количество оценок", default=0, editable=False)
+    rating_sum = models.PositiveIntegerField("Сумма оценок", default=0, editable=False)
+    average_rating = models.FloatField("Средняя оценка", null=True, blank=True, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField("Изменено", auto_now=True)
+    version = models.PositiveIntegerField("Версия", default=1, editable=False)
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+    objects = SlugQuerySet.as_manager()
 
+    def get_slug_text(self):
+        """Примеры: Терминатор(id:1) -> 1-terminator, Terminator 2(id:2) -> 2-terminator"""
+        return self.title
+
+    def save(self, *args, **kwargs):
         """
-        Пытаемся создать слаг-транслит русского названия, иначе делать слаг из английского.
-        Обязательные требования: у модели должны быть поля title и slug.
-        Примеры: Терминатор(id:1) -> 1-terminator
-        Terminator 2(id:2) -> 2-terminator
+        Сохранение существующего фильма не пишет агрегаты оценок: значения, прочитанные
+        раньше, затерли бы голоса, учтенные F-выражениями после чтения.
         """
-        if not self.slug:
-            try:
-                self.slug = f"{self.pk}-{slugify(translit(self.title, reversed=True))}"
-            except:
-                self.slug = f"{self.pk}-{slugify(self.title)}"
-            self.save(update_fields=("slug",))
+        full_update = not args and kwargs.get("update_fields") is None and not kwargs.get("force_insert")
+        if full_update and not self._state.adding:
+            skipped = {*self.get_deferred_fields(), *RATING_AGGREGATE_FIELDS}
+            kwargs["update_fields"] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skipped
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
@@ -151,19 +249,29 @@ class Movie(models.Model):
         return self.reviews_set.filter(parent__isnull=True)
 
     def get_average_rating(self):
-        """Возвразает среднее значение рейтинга для фильма"""
-        avg = self.rating_set.select_related().aggregate(models.Avg('star__value'))['star__value__avg']
-        return avg
+        """Возвразает среднее значение рейтинга для фильма (хранится в average_rating)"""
+        return self.average_rating
 
     def get_avg_rating_str(self):
-        return "{0:.2f}".format(float(self.get_average_rating()))
+        return "{0:.2f}".format(float(self.get_average_rating() or 0))
 
     def get_current_user_rating(self, request):
-        return self.rating_set.get(ip=get_client_ip_from_request(request))
+        return self.ratings.get(ip=get_client_ip_from_request(request))
 
     class Meta:
         verbose_name = "Фильм"
         verbose_name_plural = "Фильмы"
+        indexes = [
+            # Список опубликованных фильмов по курсору: WHERE draft = false ORDER BY id DESC
+            models.Index(fields=("draft", "id"), name="movie_draft_id_idx"),
+            models.Index(fields=("year",), name="movie_year_idx"),
+            # Диапазоны MovieFilter: частичные индексы только по опубликованным фильмам
+            models.Index(fields=("world_premier",), name="movie_premiere_idx", condition=models.Q(draft=False)),
+            models.Index(fields=("budget",), name="movie_budget_idx", condition=models.Q(draft=False)),
+            models.Index(fields=("fees_in_usa",), name="movie_fees_usa_idx", condition=models.Q(draft=False)),
+            models.Index(fields=("fees_in_world",), name="movie_fees_world_idx", condition=models.Q(draft=False)),
+            models.Index(fields=("average_rating",), name="movie_rating_idx", condition=models.Q(draft=False)),
+        ]
 
 
 class MovieShots(models.Model):
@@ -171,6 +279,7 @@ class MovieShots(models.Model):
     title = models.CharField("Заголовок", max_length=120)
     description = models.TextField("Описание")
     image = models.ImageField("Изображение", upload_to="movie_shots/")
+    renditions = models.CharField("Построенные превью", max_length=200, blank=True, editable=False)
     movie = models.ForeignKey(Movie, verbose_name="Фильм", on_delete=models.CASCADE, related_name="movieshots")
 
     def __str__(self):
@@ -207,9 +316,61 @@ class Rating(models.Model):
         verbose_name = "Рейтинг"
         verbose_name_plural = "Рейтинги"
         ordering = ("-star",)
+        constraints = [
+            models.UniqueConstraint(fields=("movie", "ip"), name="rating_movie_ip_unique"),
+        ]
+        indexes = [
+            # Оценки клиента по всем фильмам: rating_user и /movies/rated/
+            models.Index(fields=("ip", "movie"), name="rating_ip_movie_idx"),
+        ]
+
+
+REVIEW_PATH_STEP = 10
+# Самый глубокий ответ, путь которого помещается в Review.path (max_length=1000)
+REVIEW_MAX_DEPTH = 1000 // REVIEW_PATH_STEP - 1
+
 
+class ReviewQuerySet(models.QuerySet):
+    """Запросы к дереву отзывов по материализованному пути"""
 
-class Review(models.Model):
+    def subtree(self, review):
+        """Отзыв и все ответы на него в порядке обхода дерева"""
+        return self.filter(
+            models.Q(pk=review.pk) | models.Q(path__startswith=review.subtree_path)
+        ).order_by("path", "pk")
+
+    def top_level(self):
+        return self.filter(parent__isnull=True)
+
+    def with_reply_count(self):
+        """Корневые отзывы с числом всех ответов в ветке"""
+        return self.top_level().annotate(reply_count=models.Count("thread_replies"))
+
+    def by_activity(self):
+        """Корневые отзывы, ветки с самыми свежими ответами первыми"""
+        return self.top_level().annotate(
+            last_activity=Coalesce(models.Max("thread_replies__id"), "id")
+        ).order_by("-last_activity")
+
+    def reroot_orphans(self):
+        """
+        Ответы, чей родитель удален (parent обнулен SET_NULL), становятся корнями:
+        пути их веток укорачиваются на префикс удаленных предков. Самые глубокие идут
+        первыми: ветка мелкого сироты может содержать глубокого, а ветка глубокого
+        мелкого не содержит, поэтому загруженные пути остальных не устаревают.
+        """
+        orphans = self.filter(parent__isnull=True, depth__gt=0).only("id", "path", "depth").order_by("-depth")
+        for orphan in orphans:
+            Review.objects.filter(path__startswith=orphan.subtree_path).update(
+                path=Substr("path", len(orphan.path) + 1),
+                depth=models.F("depth") - orphan.depth,
+                thread=orphan.pk,
+                **get_version_bump(),
+            )
+            Review.objects.filter(pk=orphan.pk).update(path="", depth=0, thread=None, **get_version_bump())
+
+
+class Review(VersionMixin, models.Model):
     """Отзывы"""
     email = models.EmailField()
     name = models.CharField("Имя", max_length=90)
@@ -218,6 +379,82 @@ class Review(models.Model):
         "self", verbose_name="Родитель", on_delete=models.SET_NULL, null=True, blank=True, related_name="children"
     )
     movie = models.ForeignKey(Movie, verbose_name="фильм", on_delete=models.CASCADE, related_name="reviews")
+    path = models.CharField("Путь в дереве", max_length=1000, default="", editable=False, db_index=True)
+    depth = models.PositiveSmallIntegerField("Глубина", default=0, editable=False)
+    thread = models.ForeignKey(
+        "self", verbose_name="Корневой отзыв", on_delete=models.DO_NOTHING, db_constraint=False,
+        null=True, blank=True, editable=False, related_name="thread_replies"
+    )
+    updated_at = models.DateTimeField("Изменено", auto_now=True)
+    version = models.PositiveIntegerField("Версия", default=1, editable=False)
+
+    objects = ReviewQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_parent_id = instance.__dict__.get("parent_id")
+        return instance
+
+    @property
+    def subtree_path(self):
+        """Префикс пути всех ответов на отзыв"""
+        return f"{self.path}{self.pk:0{REVIEW_PATH_STEP}d}"
+
+    def save(self, *args, **kwargs):
+        """
+        Путь хранит id всех предков, поэтому считается до записи без второго save.
+        При смене родителя пути всей ветки переписываются одним UPDATE.
+        """
+        moved = self.pk is not None and getattr(self, "_loaded_parent_id", self.parent_id) != self.parent_id
+        if moved or self.pk is None:
+            self.check_parent()
+        if moved:
+            old_subtree_path, old_depth = self.subtree_path, self.depth
+        self.set_tree_position()
+        super().save(*args, **kwargs)
+        if moved:
+            Review.objects.filter(path__startswith=old_subtree_path).update(
+                path=Concat(models.Value(self.subtree_path), Substr("path", len(old_subtree_path) + 1)),
+                depth=models.F("depth") + (self.depth - old_depth),
+                thread=self.thread_id or self.pk,
+                **get_version_bump(),
+            )
+        self._loaded_parent_id = self.parent_id
+
+    def clean(self):
+        super().clean()
+        self.check_parent()
+
+    def check_parent(self):
+        """
+        Отзыв нельзя сделать ответом на себя или на ответ из своей ветки (путь стал бы
+        префиксом самого себя), а самый глубокий ответ ветки должен остаться
+        не глубже REVIEW_MAX_DEPTH.
+        """
+        if self.parent_id is None:
+            return
+        parent = self.parent
+        if self.pk is not None and (parent.pk == self.pk or parent.path.startswith(self.subtree_path)):
+            raise ValidationError({"parent": "Нельзя ответить на свой отзыв или на ответ в его ветке"})
+        depth = parent.depth + 1
+        if self.pk is not None:
+            deepest = Review.objects.filter(path__startswith=self.subtree_path).aggregate(
+                depth=models.Max("depth")
+            )["depth"]
+            if deepest is not None:
+                depth += deepest - self.depth
+        if depth > REVIEW_MAX_DEPTH:
+            raise ValidationError({"parent": f"Ответы не могут быть вложены глубже {REVIEW_MAX_DEPTH} уровней"})
+
+    def set_tree_position(self):
+        if self.parent_id is None:
+            self.path, self.depth, self.thread_id = "", 0, None
+        else:
+            parent = self.parent
+            self.path = parent.subtree_path
+            self.depth = parent.depth + 1
+            self.thread_id = parent.thread_id or parent.pk
 
     def __str__(self):
         return f"{self.movie} - {self.name}"
@@ -225,3 +462,36 @@ class Review(models.Model):
     class Meta:
         verbose_name = "Отзыв"
         verbose_name_plural = "Отзывы"
+        indexes = [
+            models.Index(fields=("movie", "path")),
+            models.Index(fields=("movie", "parent"), name="review_movie_parent_idx"),
+        ]
+
+
+class Task(models.Model):
+    """Фоновая задача: очередь хранится в базе, отдельный брокер не нужен (manage.py run_tasks)"""
+    PENDING, RUNNING, FAILED = "pending", "running", "failed"
+    STATUSES = ((PENDING, "В очереди"), (RUNNING, "Выполняется"), (FAILED, "Ошибка"))
+
+    name = models.CharField("Задача", max_length=150)
+    arguments = models.TextField("Аргументы (JSON)", default="{}")
+    status = models.CharField("Статус", max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField("Попыток", default=0)
+    max_attempts = models.PositiveSmallIntegerField("Максимум попыток", default=1)
+    run_at = models.DateTimeField("Запустить не раньше", default=timezone.now)
+    locked_by = models.CharField("Обработчик", max_length=100, blank=True)
+    locked_at = models.DateTimeField("Взята в работу", null=True, blank=True)
+    last_error = models.TextField("Последняя ошибка", blank=True)
+    created_at = models.DateTimeField("Создана", auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        indexes = [
+            # Выборка обработчиком: WHERE status = 'pending' AND run_at <= now ORDER BY run_at
+            models.Index(fields=("run_at",), name="task_pending_idx", condition=models.Q(status="pending")),
+            models.Index(fields=("locked_at",), name="task_running_idx", condition=models.Q(status="running")),
+        ]
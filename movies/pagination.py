@@ -0,0 +1,12 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Пагинация по курсору (keyset): страница выбирается условием по индексированному
+    полю сортировки, без OFFSET и COUNT(*), поэтому время ответа не растет с таблицей.
+    """
+    ordering = "-id"
+    page_size_query_param = "page_size"
+    max_page_size = getattr(settings, "MAX_PAGE_SIZE", 100)
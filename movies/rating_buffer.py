@@ -0,0 +1,165 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+CURRENT_FILE = "current.jsonl"
+LOCK_FILE = "buffer.lock"
+BATCH_PREFIX = "batch-"
+
+
+def is_buffered():
+    """Голоса пишутся в локальный буфер и применяются пачками фоновым flush_ratings"""
+    return getattr(settings, "RATING_INGESTION_MODE", "sync") == "buffered"
+
+
+def get_buffer_dir():
+    path = settings.RATING_BUFFER_DIR
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+@contextmanager
+def buffer_lock():
+    """Межпроцессная блокировка буфера: запись голоса и ротация файла не пересекаются"""
+    with open(os.path.join(get_buffer_dir(), LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def append_vote(ip, movie_id, star_id):
+    """Дописывает голос в буфер и сбрасывает его на диск до ответа клиенту"""
+    line = json.dumps({"ip": ip, "movie": movie_id, "star": star_id}) + "\n"
+    with buffer_lock():
+        with open(os.path.join(get_buffer_dir(), CURRENT_FILE), "a") as buffer:
+            buffer.write(line)
+            buffer.flush()
+            os.fsync(buffer.fileno())
+
+
+def read_votes(path):
+    """Голоса из файла буфера по порядку; недописанная строка пропускается"""
+    votes = []
+    try:
+        with open(path) as buffer:
+            for line in buffer:
+                try:
+                    votes.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return votes
+
+
+def get_batch_paths():
+    directory = get_buffer_dir()
+    return [
+        os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.startswith(BATCH_PREFIX)
+    ]
+
+
+def claim_batches():
+    """Закрывает текущий файл буфера в пачку и возвращает все необработанные пачки по порядку"""
+    directory = get_buffer_dir()
+    current = os.path.join(directory, CURRENT_FILE)
+    with buffer_lock():
+        if os.path.exists(current) and os.path.getsize(current):
+            os.rename(current, os.path.join(directory, f"{BATCH_PREFIX}{time.time_ns():020d}.jsonl"))
+    return get_batch_paths()
+
+
+def complete_batch(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class BufferFileIndex:
+    """Разобранная часть файла буфера: голоса по ip и место, до которого файл прочитан"""
+
+    def __init__(self, inode):
+        self.inode = inode
+        self.offset = 0
+        self.last_line = b""
+        self.votes = {}
+
+    def is_same_file(self, buffer, stat):
+        """
+        Текущий файл после ротации создается заново и может получить тот же inode,
+        поэтому проверяется и последняя разобранная строка на своем месте.
+        """
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            return False
+        buffer.seek(self.offset - len(self.last_line))
+        return buffer.read(len(self.last_line)) == self.last_line
+
+    def read(self, buffer):
+        """Дочитывает дописанные целые строки; недописанная строка ждет следующего раза"""
+        buffer.seek(self.offset)
+        data = buffer.read()
+        data = data[:data.rfind(b"\n") + 1]
+        if not data:
+            return
+        for line in data.splitlines():
+            try:
+                vote = json.loads(line)
+            except ValueError:
+                continue
+            self.votes.setdefault(vote["ip"], {})[vote["movie"]] = vote["star"]
+        self.offset += len(data)
+        self.last_line = data[data.rfind(b"\n", 0, -1) + 1:]
+
+
+class PendingVotesIndex:
+    """
+    Голоса буфера по ip в памяти процесса. Файлы пачек не меняются и разбираются
+    один раз, текущий файл дочитывается с места, где остановился прошлый запрос,
+    так что запрос не разбирает весь буфер заново.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+
+    def get(self, ip):
+        with self.lock:
+            paths = [*get_batch_paths(), os.path.join(get_buffer_dir(), CURRENT_FILE)]
+            files = {}
+            for path in paths:
+                index = self.update(path, self.files.get(path))
+                if index is not None:
+                    files[path] = index
+            self.files = files
+            pending = {}
+            for index in files.values():
+                pending.update(index.votes.get(ip, {}))
+        return pending
+
+    def update(self, path, index):
+        try:
+            buffer = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        with buffer:
+            stat = os.fstat(buffer.fileno())
+            if index is None or not index.is_same_file(buffer, stat):
+                index = BufferFileIndex(stat.st_ino)
+            index.read(buffer)
+        return index
+
+
+pending_votes = PendingVotesIndex()
+
+
+def get_pending_votes(ip):
+    """Еще не примененные голоса клиента: {movie_id: star_id}, последний голос побеждает"""
+    return pending_votes.get(ip)
@@ -0,0 +1,243 @@
+from django.db import IntegrityError, connection, models, transaction
+
+from . import rating_buffer
+from .cache import invalidate_movie
+from .models import Movie, Rating, RatingStars, get_version_bump
+
+# Одна инструкция на голос: upsert по уникальному (movie_id, ip) и сдвиг агрегатов фильма.
+# previous блокирует прежнюю оценку и должен прочитаться до upsert (JOIN в его SELECT):
+# строку, измененную этой же инструкцией, FOR UPDATE уже пропускает.
+# (xmax = 0) отличает вставку от обновления. Обновляется только строка, прочитанная
+# в previous: если конфликт дала строка параллельного голоса, которой не было в снимке
+# инструкции, upsert ничего не меняет и не возвращает, и голос повторяется новой инструкцией.
+UPSERT_RATING_SQL = """
+WITH new_star AS (
+    SELECT value FROM {stars} WHERE id = %(star)s
+), previous AS (
+    SELECT s.value FROM {ratings} r JOIN {stars} s ON s.id = r.star_id
+    WHERE r.movie_id = %(movie)s AND r.ip = %(ip)s
+    FOR UPDATE OF r
+), upsert AS (
+    INSERT INTO {ratings} (ip, movie_id, star_id)
+    SELECT %(ip)s, %(movie)s, %(star)s FROM (SELECT 1) AS vote LEFT JOIN previous ON true
+    ON CONFLICT (movie_id, ip) DO UPDATE SET star_id = EXCLUDED.star_id
+    WHERE EXISTS (SELECT 1 FROM previous)
+    RETURNING id, (xmax = 0) AS inserted
+), delta AS (
+    SELECT
+        upsert.id,
+        CASE WHEN upsert.inserted THEN 1 ELSE 0 END AS count_delta,
+        (SELECT value FROM new_star) - CASE WHEN upsert.inserted THEN 0
+            ELSE (SELECT value FROM previous) END AS sum_delta
+    FROM upsert
+), movie AS (
+    UPDATE {movies} m SET
+        rating_count = m.rating_count + delta.count_delta,
+        rating_sum = m.rating_sum + delta.sum_delta,
+        average_rating = CASE WHEN m.rating_count + delta.count_delta > 0
+            THEN (m.rating_sum + delta.sum_delta)::float / (m.rating_count + delta.count_delta) END,
+        version = m.version + 1,
+        updated_at = now()
+    FROM delta
+    WHERE m.id = %(movie)s AND (delta.count_delta <> 0 OR delta.sum_delta <> 0)
+)
+SELECT id, count_delta = 1 FROM delta
+""".format(movies=Movie._meta.db_table, ratings=Rating._meta.db_table, stars=RatingStars._meta.db_table)
+
+BULK_UPSERT_RATINGS_SQL = """
+INSERT INTO {ratings} (ip, movie_id, star_id) VALUES {{values}}
+ON CONFLICT (movie_id, ip) DO UPDATE SET star_id = EXCLUDED.star_id
+""".format(ratings=Rating._meta.db_table)
+
+
+def get_aggregate_update(count_delta, sum_delta):
+    """
+    Выражения для UPDATE, сдвигающие хранимые агрегаты рейтинга фильма на дельту.
+    Все правые части считаются от старых значений строки, поэтому среднее
+    пересчитывается в том же запросе.
+    """
+    count = models.F("rating_count") + count_delta
+    total = models.F("rating_sum") + sum_delta
+    return {
+        "rating_count": count,
+        "rating_sum": total,
+        "average_rating": models.Case(
+            models.When(
+                rating_count__gt=-count_delta,
+                then=models.functions.Cast(total, models.FloatField()) /
+                models.functions.Cast(count, models.FloatField()),
+            ),
+            default=models.Value(None),
+            output_field=models.FloatField(),
+        ),
+    }
+
+
+def apply_rating_delta(movie_id, count_delta, sum_delta):
+    """Атомарно сдвигает агрегаты рейтинга фильма и его версию"""
+    if not count_delta and not sum_delta:
+        return
+    Movie.objects.filter(pk=movie_id).update(**get_aggregate_update(count_delta, sum_delta), **get_version_bump())
+
+
+def get_star_value(rating):
+    """Значение звезды оценки: из уже загруженной связи или подзапросом, без отдельного SELECT"""
+    if Rating.star.is_cached(rating):
+        return rating.star.value
+    return models.Subquery(RatingStars.objects.filter(pk=rating.star_id).values("value")[:1])
+
+
+def rate_movie(ip, movie, star):
+    """
+    Создает или меняет оценку фильма с ip и обновляет агрегаты фильма:
+    новая оценка добавляет её значение, смена звезды - разницу.
+    На PostgreSQL это одна инструкция INSERT ... ON CONFLICT, на остальных базах - транзакция ORM.
+    """
+    if connection.vendor == "postgresql":
+        return upsert_rating(ip, movie, star)
+    try:
+        return save_rating(ip, movie, star)
+    except IntegrityError:
+        # Параллельный голос с того же ip успел вставить строку, повторяем как обновление
+        return save_rating(ip, movie, star)
+
+
+def upsert_rating(ip, movie, star):
+    """
+    Голос одним запросом. Сигнал post_save отправляется как при save(),
+    поэтому побочные эффекты оценки остаются в обработчиках signals.
+    """
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(UPSERT_RATING_SQL, {"ip": ip, "movie": movie.pk, "star": star.pk})
+            row = cursor.fetchone()
+        if row is not None:
+            break
+    rating_id, created = row
+    rating = Rating(pk=rating_id, ip=ip, movie=movie, star=star)
+    models.signals.post_save.send(
+        sender=Rating, instance=rating, created=created, update_fields=None, raw=False, using=connection.alias,
+    )
+    return rating
+
+
+def save_rating(ip, movie, star):
+    with transaction.atomic():
+        rating = Rating.objects.select_for_update().select_related("star").filter(ip=ip, movie=movie).first()
+        if rating is None:
+            rating = Rating.objects.create(ip=ip, movie=movie, star=star)
+            apply_rating_delta(movie.pk, 1, star.value)
+        elif rating.star_id != star.pk:
+            old_value = rating.star.value
+            rating.star = star
+            rating.save(update_fields=("star",))
+            apply_rating_delta(movie.pk, 0, star.value - old_value)
+    return rating
+
+
+def enqueue_rating(ip, movie, star):
+    """Голос в буфер: в базу и агрегаты он попадет при следующем flush_rating_buffer"""
+    rating_buffer.append_vote(ip, movie.pk, star.pk)
+    return Rating(ip=ip, movie=movie, star=star)
+
+
+def flush_rating_buffer(batch_size=1000):
+    """
+    Применяет накопленные в буфере голоса. Внутри файла буфера последний голос
+    с ip за фильм побеждает. Повторное применение файла после сбоя безопасно:
+    оценки перезаписываются, агрегаты пересчитываются по таблице.
+    Возвращает число примененных голосов.
+    """
+    applied = 0
+    for path in rating_buffer.claim_batches():
+        votes = {}
+        for vote in rating_buffer.read_votes(path):
+            votes[(vote["movie"], vote["ip"])] = vote["star"]
+        items = list(votes.items())
+        for start in range(0, len(items), batch_size):
+            applied += apply_rating_batch(dict(items[start:start + batch_size]))
+        rating_buffer.complete_batch(path)
+    return applied
+
+
+def apply_rating_batch(votes):
+    """Записывает пачку голосов {(movie_id, ip): star_id} и пересчитывает агрегаты затронутых фильмов"""
+    movie_ids = set(Movie.objects.filter(pk__in={movie_id for movie_id, _ in votes}).values_list("pk", flat=True))
+    star_ids = set(RatingStars.objects.filter(pk__in=set(votes.values())).values_list("pk", flat=True))
+    votes = {key: star_id for key, star_id in votes.items() if key[0] in movie_ids and star_id in star_ids}
+    if not votes:
+        return 0
+    applied = len(votes)
+
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    BULK_UPSERT_RATINGS_SQL.format(values=", ".join(["(%s, %s, %s)"] * len(votes))),
+                    [value for (movie_id, ip), star_id in votes.items() for value in (ip, movie_id, star_id)],
+                )
+        else:
+            existing = Rating.objects.filter(
+                movie_id__in={movie_id for movie_id, _ in votes}, ip__in={ip for _, ip in votes}
+            ).only("id", "movie_id", "ip", "star_id")
+            changed = []
+            for rating in existing:
+                star_id = votes.pop((rating.movie_id, rating.ip), None)
+                if star_id is not None and star_id != rating.star_id:
+                    rating.star_id = star_id
+                    changed.append(rating)
+            Rating.objects.bulk_update(changed, ("star",))
+            Rating.objects.bulk_create(
+                [Rating(movie_id=movie_id, ip=ip, star_id=star_id) for (movie_id, ip), star_id in votes.items()]
+            )
+        refresh_rating_aggregates(movie_ids)
+
+    for movie_id in movie_ids:
+        invalidate_movie(movie_id)
+    return applied
+
+
+def refresh_rating_aggregates(movie_ids):
+    """
+    Пересчитывает агрегаты фильмов по таблице оценок и сдвигает их версии, в транзакции.
+    Строки фильмов блокируются до подсчета: синхронный голос (rate_movie, удаление оценки)
+    либо уже зафиксирован и попадет в подсчет, либо ждет блокировки и сдвинет F() записанное.
+    """
+    list(Movie.objects.select_for_update().filter(pk__in=movie_ids).order_by("pk").values_list("pk", flat=True))
+    aggregates = calculate_rating_aggregates(movie_ids)
+    movies = []
+    for movie_id in movie_ids:
+        count, total = aggregates.get(movie_id, (0, 0))
+        movies.append(Movie(pk=movie_id, rating_count=count, rating_sum=total, average_rating=get_average(count, total)))
+    Movie.objects.bulk_update(movies, ("rating_count", "rating_sum", "average_rating"))
+    Movie.objects.filter(pk__in=movie_ids).update(**get_version_bump())
+
+
+def get_rated_movie_ids(ip, movie_ids=None):
+    """
+    id фильмов, оцененных с ip (среди movie_ids, если переданы),
+    вместе с голосами, которые еще ждут в буфере.
+    """
+    ratings = Rating.objects.filter(ip=ip)
+    if movie_ids is not None:
+        ratings = ratings.filter(movie_id__in=movie_ids)
+    rated = set(ratings.order_by().values_list("movie_id", flat=True))
+    if rating_buffer.is_buffered():
+        pending = rating_buffer.get_pending_votes(ip)
+        rated.update(pending if movie_ids is None else set(pending) & set(movie_ids))
+    return rated
+
+
+def calculate_rating_aggregates(movie_ids=None):
+    """Считает агрегаты рейтинга по таблице оценок: {movie_id: (count, sum)}"""
+    ratings = Rating.objects.all()
+    if movie_ids is not None:
+        ratings = ratings.filter(movie_id__in=movie_ids)
+    rows = ratings.order_by().values("movie_id").annotate(
+        count=models.Count("id"), total=models.Sum("star__value")
+    )
+    return {row["movie_id"]: (row["count"], row["total"] or 0) for row in rows}
+
+
+def get_average(count, total):
+    return total / count if count else None
@@ -0,0 +1,120 @@
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+from .cache import invalidate_all
+from .models import Movie, MovieShots, Person, get_version_bump
+
+# Поля изображений, для которых строятся превью
+IMAGE_FIELDS = {"movie": (Movie, "poster"), "person": (Person, "image"), "shot": (MovieShots, "image")}
+EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg", "PNG": "png"}
+
+
+def get_rendition_format():
+    """Формат превью из настроек; WebP без поддержки в сборке Pillow заменяется на JPEG"""
+    image_format = settings.IMAGE_RENDITION_FORMAT.upper()
+    if image_format == "WEBP" and not features.check("webp"):
+        return "JPEG"
+    return image_format
+
+
+def get_rendition_name(name, rendition):
+    """movies/poster.jpg -> movies/poster.thumb.webp: превью лежат рядом с оригиналом"""
+    return f"{os.path.splitext(name)[0]}.{rendition}.{EXTENSIONS[get_rendition_format()]}"
+
+
+def get_built_renditions(file, built=None):
+    """
+    Превью, построенные для текущего файла поля: их список пишет в поле renditions
+    записи задача build_renditions. built - значение этого поля, если записи нет под рукой.
+    """
+    if built is None:
+        built = getattr(file.instance, "renditions", "")
+    return set(built.split(",")) if built else set()
+
+
+def get_rendition_url(file, rendition, built):
+    """Превью, если оно построено, иначе оригинал"""
+    if rendition in built:
+        return file.storage.url(get_rendition_name(file.name, rendition))
+    return file.url
+
+
+def get_rendition_urls(file, request=None, built=None):
+    """
+    Ссылки на все превью файла, абсолютные при наличии request; для пустого поля - None.
+    Пока превью не построено, вместо него отдается оригинал.
+    """
+    if not file:
+        return None
+    built = get_built_renditions(file, built)
+    urls = {}
+    for rendition in settings.IMAGE_RENDITIONS:
+        url = get_rendition_url(file, rendition, built)
+        urls[rendition] = request.build_absolute_uri(url) if request is not None else url
+    return urls
+
+
+def get_thumbnail_url(file, rendition="thumb"):
+    """Превью для админки, пока его нет - оригинал; хранилище не опрашивается"""
+    return get_rendition_url(file, rendition, get_built_renditions(file))
+
+
+def record_renditions(image_type, name):
+    """
+    Отмечает у записей с файлом name, что все превью построены. Ответы API с этими
+    записями сбрасываются: в них ссылки на оригинал сменятся ссылками на превью.
+    """
+    model, field = IMAGE_FIELDS[image_type]
+    changes = {"renditions": ",".join(settings.IMAGE_RENDITIONS)}
+    if image_type != "shot":
+        changes.update(get_version_bump())
+    if model.objects.filter(**{field: name}).update(**changes):
+        invalidate_all()
+
+
+def delete_renditions(storage, name):
+    """Удаляет превью файла name, например после замены изображения"""
+    for rendition in settings.IMAGE_RENDITIONS:
+        rendition_name = get_rendition_name(name, rendition)
+        if storage.exists(rendition_name):
+            storage.delete(rendition_name)
+
+
+def convert_mode(image, image_format):
+    if image_format == "JPEG":
+        return image if image.mode == "RGB" else image.convert("RGB")
+    if image.mode in ("RGB", "RGBA"):
+        return image
+    return image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+
+
+def make_renditions(storage, name, overwrite=False):
+    """
+    Пишет недостающие (или все при overwrite) превью файла name из IMAGE_RENDITIONS.
+    JPEG декодируется сразу в уменьшенном масштабе (draft), каждое превью
+    уменьшается из предыдущего, более крупного. Возвращает число записанных файлов.
+    """
+    sizes = sorted(settings.IMAGE_RENDITIONS.items(), key=lambda item: item[1], reverse=True)
+    pending = [
+        (get_rendition_name(name, rendition), size) for rendition, size in sizes
+        if overwrite or not storage.exists(get_rendition_name(name, rendition))
+    ]
+    if not pending:
+        return 0
+    image_format = get_rendition_format()
+    with storage.open(name) as source:
+        image = Image.open(source)
+        image.draft("RGB", pending[0][1])
+        image = convert_mode(ImageOps.exif_transpose(image), image_format)
+    for rendition_name, size in pending:
+        image.thumbnail(size, Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, image_format, quality=settings.IMAGE_RENDITION_QUALITY, optimize=True)
+        if storage.exists(rendition_name):
+            storage.delete(rendition_name)
+        storage.save(rendition_name, ContentFile(buffer.getvalue()))
+    return len(pending)
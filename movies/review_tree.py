@@ -0,0 +1,60 @@
+from collections import defaultdict
+
+from django.conf import settings
+
+
+def get_tree_limits():
+    """Ограничения дерева отзывов из настроек: (максимальная глубина, максимум ответов на уровне)"""
+    return (
+        getattr(settings, "REVIEW_TREE_MAX_DEPTH", None),
+        getattr(settings, "REVIEW_TREE_MAX_CHILDREN", None),
+    )
+
+
+def build_review_tree(reviews, max_depth=None, max_children=None):
+    """
+    Связывает отзывы в дерево за O(N) и возвращает корневые отзывы.
+    Каждому отзыву дерева проставляется tree_children. Ответы глубже max_depth
+    и сверх max_children на одном уровне отбрасываются.
+    """
+    children = defaultdict(list)
+    for review in reviews:
+        children[review.parent_id].append(review)
+
+    roots = children[None]
+    stack = [(review, 0) for review in roots]
+    while stack:
+        review, depth = stack.pop()
+        if max_depth is not None and depth >= max_depth:
+            review.tree_children = []
+            continue
+        nodes = children.get(review.pk, [])
+        if max_children is not None:
+            nodes = nodes[:max_children]
+        review.tree_children = nodes
+        stack.extend((child, depth + 1) for child in nodes)
+    return roots
+
+
+def get_tree_children(review):
+    """Дочерние отзывы из построенного дерева, иначе из базы"""
+    try:
+        return review.tree_children
+    except AttributeError:
+        return list(review.children.all())
+
+
+def serialize_review_tree(roots, render):
+    """
+    Выводит дерево без рекурсии. render(review) возвращает словарь полей отзыва,
+    вложенные ответы кладутся в ключ children.
+    """
+    result = []
+    stack = [(review, result) for review in reversed(roots)]
+    while stack:
+        review, siblings = stack.pop()
+        item = render(review)
+        item["children"] = []
+        siblings.append(item)
+        stack.extend((child, item["children"]) for child in reversed(get_tree_children(review)))
+    return result
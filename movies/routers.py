@@ -0,0 +1,54 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Реплика, которой отдается чтение в этом контексте (см. ReplicaReadMixin); None - основная база
+current_replica = ContextVar("current_replica", default=None)
+# Модели, которые всегда читаются с основной базы: пользователь сразу видит свою оценку и отзыв
+PRIMARY_MODELS = {"movies.rating", "movies.review"}
+
+
+@contextmanager
+def replica_reads():
+    """
+    Все чтение в контексте идет с одной случайно выбранной реплики: основной запрос,
+    префетчи и версия для ETag читаются с одним отставанием, а не с разных реплик.
+    """
+    replica = random.choice(settings.DATABASE_REPLICAS) if settings.DATABASE_REPLICAS else None
+    token = current_replica.set(replica)
+    try:
+        yield
+    finally:
+        current_replica.reset(token)
+
+
+class ReadReplicaRouter:
+    """
+    Запись и все чтение по умолчанию - основная база (default). Реплики из DATABASE_REPLICAS
+    получают только чтение внутри replica_reads(): GET каталога фильмов и персон,
+    кроме оценок и отзывов. Реплика может отставать, поэтому чтение внутри записи
+    и в админке остается на основной базе.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower in PRIMARY_MODELS:
+            # Явно: иначе связи объекта, прочитанного с реплики, читались бы с нее же
+            return "default"
+        return current_replica.get()
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Реплики - копии основной базы: связи между их объектами допустимы"""
+        databases = {"default", *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
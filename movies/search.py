@@ -0,0 +1,92 @@
+import operator
+import re
+from functools import reduce
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, SearchVectorField
+from django.db import connection, models
+from django.db.models.expressions import CombinedExpression
+
+from .models import Movie, Person
+from .services import slugify_text
+
+# Поля поискового вектора: (поле, вес, словарь). Слаг - транслит названия или имени,
+# по нему латинский запрос находит русское название: terminator -> Терминатор
+SEARCH_FIELDS = {
+    Movie: (("title", "A", "russian"), ("slug", "A", "simple"), ("tagline", "B", "russian"),
+            ("description", "C", "russian")),
+    Person: (("first_name", "A", "russian"), ("last_name", "A", "russian"), ("second_name", "B", "russian"),
+             ("slug", "A", "simple")),
+}
+
+# id в начале слага не должен находиться поиском
+SLUG_ID_PATTERN = "^[0-9]+-"
+
+
+def strip_slug_id(slug):
+    return re.sub(SLUG_ID_PATTERN, "", slug)
+
+
+def is_full_text_supported():
+    return connection.vendor == "postgresql"
+
+
+def make_search_vector(model, instance=None):
+    """
+    Выражение поискового вектора. По колонкам - для UPDATE,
+    по значениям instance - чтобы записать вектор в том же INSERT, что и саму строку.
+    """
+    vectors = []
+    for name, weight, config in SEARCH_FIELDS[model]:
+        if instance is not None:
+            value = getattr(instance, name) or ""
+            source = models.Value(strip_slug_id(value) if name == "slug" else value, models.TextField())
+        elif name == "slug":
+            source = models.Func(
+                models.F(name), models.Value(SLUG_ID_PATTERN), models.Value(""),
+                function="regexp_replace", output_field=models.TextField(),
+            )
+        else:
+            source = name
+        vectors.append(SearchVector(source, weight=weight, config=config))
+    # SearchVector.__add__ в Django 3.0 не склеивает векторы с разными словарями
+    return reduce(lambda left, right: CombinedExpression(left, "||", right, SearchVectorField()), vectors)
+
+
+def update_search_vectors(queryset):
+    """Пересчитывает векторы одним UPDATE, например после bulk_create"""
+    if is_full_text_supported():
+        queryset.update(search_vector=make_search_vector(queryset.model))
+
+
+def get_latin_text(text):
+    return slugify_text(text).replace("-", " ")
+
+
+def make_search_query(text):
+    """Запрос по-русски с морфологией, как есть и в транслите"""
+    query = SearchQuery(text, config="russian") | SearchQuery(text, config="simple")
+    latin = get_latin_text(text)
+    if latin and latin != text:
+        query |= SearchQuery(latin, config="simple")
+    return query
+
+
+def search(queryset, text):
+    """
+    Поиск по SEARCH_FIELDS модели. На PostgreSQL - по GIN-индексу вектора
+    с ранжированием SearchRank, на остальных базах - icontains без ранжирования.
+    """
+    model = queryset.model
+    if is_full_text_supported():
+        query = make_search_query(text)
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(models.F("search_vector"), query)
+        ).order_by("-rank", "pk")
+
+    condition = reduce(operator.or_, (
+        models.Q(**{f"{name}__icontains": text}) for name, _, _ in SEARCH_FIELDS[model]
+    ))
+    latin = slugify_text(text)
+    if latin:
+        condition |= models.Q(slug__icontains=latin)
+    return queryset.filter(condition).order_by("pk")
@@ -1,6 +1,64 @@
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 
 from .models import Movie, Review, Rating, Person, Country
+from .rating_buffer import is_buffered
+from .ratings import enqueue_rating, rate_movie
+from .renditions import get_rendition_urls
+from .review_tree import build_review_tree, get_tree_limits, serialize_review_tree
+
+
+def parse_field_names(value):
+    """"id, title" -> ["id", "title"]"""
+    return [name.strip() for name in (value or "").split(",") if name.strip()]
+
+
+def get_requested_fields(context):
+    """Списки ?fields= и ?expand= из GET-запроса в контексте сериализатора"""
+    request = context.get("request")
+    if request is None or request.method not in SAFE_METHODS:
+        return [], []
+    params = request.query_params
+    return parse_field_names(params.get("fields")), parse_field_names(params.get("expand"))
+
+
+class DynamicFieldsMixin:
+    """
+    Выбор полей ответа: ?fields=id,title оставляет только перечисленные поля,
+    ?expand=genres добавляет связи из Meta.expandable_fields, которых нет в ответе по умолчанию.
+    Параметры берутся из аргументов fields/expand, а если их нет - из GET-запроса в контексте.
+    Поля Meta.required_fields выводятся всегда, вложенные сериализаторы - целиком.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested_fields, requested_expand = get_requested_fields(self._context)
+        fields = requested_fields if fields is None else fields
+        expand = requested_expand if expand is None else expand
+        expandable = getattr(self.Meta, "expandable_fields", {})
+        for name in expand:
+            if name in expandable:
+                field_class, field_kwargs = expandable[name]
+                self.fields[name] = field_class(**field_kwargs)
+        if fields:
+            keep = {*fields, *expand, *getattr(self.Meta, "required_fields", ())}
+            for name in [name for name in self.fields if name not in keep]:
+                self.fields.pop(name)
+
+
+class RenditionsField(serializers.ReadOnlyField):
+    """
+    Ссылки на превью изображения из source: {"thumb": ..., "medium": ...}.
+    Какие превью построены, поле читает из колонки renditions той же записи.
+    """
+    extra_sources = ("renditions",)
+
+    def to_representation(self, value):
+        return get_rendition_urls(value, self.context.get("request"))
 
 
 class CountryListSerializer(serializers.ModelSerializer):
@@ -11,21 +69,23 @@ class CountryListSerializer(serializers.ModelSerializer):
         fields = ('name', )
 
 
-class PersonListSerializer(serializers.ModelSerializer):
+class PersonListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Описание актера и режиссера"""
+    image_renditions = RenditionsField(source="image")
 
     class Meta:
         model = Person
-        fields = ('id', 'first_name', 'last_name', 'image')
+        fields = ('id', 'first_name', 'last_name', 'image', 'image_renditions')
 
 
-class PersonDetailSerializer(serializers.ModelSerializer):
+class PersonDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Описание актера и режиссера"""
     countries = CountryListSerializer(read_only=True, many=True)
+    image_renditions = RenditionsField(source="image")
 
     class Meta:
         model = Person
-        fields = '__all__'
+        exclude = ('search_vector', 'renditions')
 
 
 class ReviewCreateSerializer(serializers.ModelSerializer):
@@ -35,33 +95,67 @@ class ReviewCreateSerializer(serializers.ModelSerializer):
         model = Review
         fields = "__all__"
 
+    def validate(self, attrs):
+        review = Review(pk=getattr(self.instance, "pk", None), **{**self.get_initial_tree(), **attrs})
+        try:
+            review.check_parent()
+        except ValidationError as error:
+            raise serializers.ValidationError(error.message_dict)
+        return attrs
+
+    def get_initial_tree(self):
+        """Положение в дереве, из которого переносится изменяемый отзыв"""
+        if self.instance is None:
+            return {}
+        return {"path": self.instance.path, "depth": self.instance.depth, "parent": self.instance.parent}
+
 
 class RecursiveSerializer(serializers.Serializer):
-    """Рекурсивный вывод дочерних отзывов."""
+    """
+    Дочерние отзывы. Само дерево выводит ReviewSerializer без рекурсии,
+    поле остается для схемы API.
+    """
 
     def to_representation(self, value):
-        serializer = self.parent.parent.__class__(value, context=self.context)
-        return serializer.data
+        return self.parent.parent.to_representation(value)
+
 
 class FilterReviewListSerializer(serializers.ListSerializer):
-    """Фильтрует отзывы. Оставляет только родительские."""
+    """
+    Фильтрует отзывы. Оставляет только родительские.
+    Дерево строится в памяти из уже загруженного набора, без запросов на каждый отзыв.
+    """
 
     def to_representation(self, data):
-        data = data.filter(parent=None)
-        return super().to_representation(data)
+        reviews = data.all() if isinstance(data, models.Manager) else data
+        max_depth, max_children = get_tree_limits()
+        roots = build_review_tree(reviews, max_depth=max_depth, max_children=max_children)
+        return [self.child.to_representation(review) for review in roots]
 
 
-class ReviewSerializer(serializers.ModelSerializer):
-    """Вывод отзыва."""
-    children = RecursiveSerializer(many=True)
+class ReviewSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Вывод отзыва. Ответы выводятся всегда: по ним строится дерево."""
+    children = RecursiveSerializer(many=True, read_only=True)
 
     class Meta:
         list_serializer_class = FilterReviewListSerializer
         model = Review
         fields = ("name", "text", "children")
+        required_fields = ("children",)
+
+    def to_representation(self, instance):
+        return serialize_review_tree([instance], self.to_node_representation)[0]
 
+    def to_node_representation(self, instance):
+        """Поля одного отзыва без дочерних"""
+        ret = OrderedDict()
+        for field in self._readable_fields:
+            if field.field_name != "children":
+                ret[field.field_name] = field.to_representation(field.get_attribute(instance))
+        return ret
 
-class RatingSerializer(serializers.ModelSerializer):
+
+class RatingSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Добавление рейтинга пользователем."""
 
     class Meta:
@@ -69,27 +163,46 @@ class RatingSerializer(serializers.ModelSerializer):
         fields = ("star", "movie")
 
     def create(self, validated_data):
-        rating, _ = Rating.objects.update_or_create(
+        save = enqueue_rating if is_buffered() else rate_movie
+        return save(
             ip=validated_data.get("ip", None),
             movie=validated_data.get("movie", None),
-            defaults={"star": validated_data.get("star", None)}
+            star=validated_data.get("star", None),
         )
-        return rating
+
+    def update(self, instance, validated_data):
+        """Перенос оценки на другой фильм - удаление и новый голос, одной транзакцией"""
+        movie = validated_data.get("movie", instance.movie)
+        with transaction.atomic():
+            if movie.pk != instance.movie_id:
+                instance.delete()
+            return rate_movie(ip=instance.ip, movie=movie, star=validated_data.get("star", instance.star))
 
 
-class MovieListSerializer(serializers.ModelSerializer):
-    """Список фильмов"""
+class MovieListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """
+    Список фильмов. rating_user зависит от клиента и проставляется вьюсетом
+    поверх общей части списка по id, поэтому id выводится всегда.
+    """
     category = serializers.SlugRelatedField(slug_field="name", read_only=True)
-    rating_user = serializers.BooleanField()
+    rating_user = serializers.BooleanField(read_only=True, default=False)
     average_rating = serializers.FloatField()
 
     class Meta:
         model = Movie
         fields = ("id", "title", "tagline", "category", "rating_user", "average_rating")
+        required_fields = ("id",)
+        expandable_fields = {
+            "genres": (serializers.SlugRelatedField, {"slug_field": "name", "read_only": True, "many": True}),
+            "countries": (CountryListSerializer, {"read_only": True, "many": True}),
+            "directors": (PersonListSerializer, {"read_only": True, "many": True}),
+            "actors": (PersonListSerializer, {"read_only": True, "many": True}),
+        }
 
 
-class MovieDetailSerializer(serializers.ModelSerializer):
+class MovieDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Подробности фильма"""
+    poster_renditions = RenditionsField(source="poster")
     category = serializers.SlugRelatedField(slug_field="name", read_only=True)
     directors = PersonListSerializer(read_only=True, many=True)
     actors = PersonListSerializer(read_only=True, many=True)
@@ -99,4 +212,4 @@ class MovieDetailSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Movie
-        exclude = ("draft",)
+        exclude = ("draft", "search_vector", "renditions")
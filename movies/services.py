@@ -1,3 +1,11 @@
+from functools import lru_cache
+
+from django.db import connection
+from django.utils.text import slugify
+
+from transliterate import translit
+
+
 def get_client_ip_from_request(request):
     """Возвращает ip пользователя через запрос"""
 
@@ -7,3 +15,35 @@ def get_client_ip_from_request(request):
     else:
         ip = request.META.get('REMOTE_ADDR')
     return ip
+
+
+@lru_cache(maxsize=4096)
+def slugify_text(text):
+    """
+    Слаг-транслит русского текста, иначе слаг из английского.
+    Транслитерация медленная, поэтому результат кэшируется по тексту.
+    """
+    try:
+        return slugify(translit(text, reversed=True))
+    except Exception:
+        return slugify(text)
+
+
+def make_slug(pk, text):
+    """Пример: Арнольд Шварцнеггер(id:1) -> 1-arnold-shvartsnegger"""
+    return f"{pk}-{slugify_text(text)}"
+
+
+def reserve_pks(model, count):
+    """
+    Резервирует count id из последовательности таблицы модели, чтобы слаг
+    можно было посчитать до вставки. Только PostgreSQL, на остальных базах None.
+    """
+    if connection.vendor != "postgresql" or not count:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+            [model._meta.db_table, model._meta.pk.column, count],
+        )
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,250 @@
+import threading
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+
+from .cache import invalidate_all, invalidate_movie
+from .health import check_connections, mark_connections_released
+from .models import Rating, Review, Movie, MovieShots, Person, Genre, Category, Country, get_version_bump
+from .renditions import IMAGE_FIELDS
+from .ratings import apply_rating_delta, get_star_value
+from .search import is_full_text_supported, make_search_vector
+from .tasks import build_renditions
+from . import facets, suggest
+
+
+# id фильмов, которые удаляются в этом потоке: их оценки и отзывы уходят каскадом,
+# пересчитывать агрегаты и деревья удаляемого фильма незачем
+deleting = threading.local()
+
+
+def is_movie_deleted(movie_id):
+    return movie_id in getattr(deleting, "movies", ())
+
+
+@receiver(pre_delete, sender=Movie)
+def movie_deleting(sender, instance, **kwargs):
+    if not hasattr(deleting, "movies"):
+        deleting.movies = set()
+    deleting.movies.add(instance.pk)
+
+
+@receiver(post_delete, sender=Movie)
+def movie_deleted(sender, instance, **kwargs):
+    getattr(deleting, "movies", set()).discard(instance.pk)
+
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, **kwargs):
+    """Вычитает удаленную оценку из агрегатов фильма, значение звезды - в том же UPDATE"""
+    if not is_movie_deleted(instance.movie_id):
+        apply_rating_delta(instance.movie_id, -1, -get_star_value(instance))
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    """Переносит ветки ответов удаленного отзыва в корень, кроме каскада удаляемого фильма"""
+    if not is_movie_deleted(instance.movie_id):
+        Review.objects.filter(movie_id=instance.movie_id).reroot_orphans()
+
+
+@receiver(pre_save, sender=Movie)
+@receiver(pre_save, sender=Person)
+def set_search_vector(sender, instance, **kwargs):
+    """Поисковый вектор считается из значений объекта и пишется тем же запросом, что и строка"""
+    if is_full_text_supported():
+        instance.search_vector = make_search_vector(sender, instance)
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def movie_changed(sender, instance, **kwargs):
+    invalidate_movie(instance.pk)
+
+
+@receiver(post_save, sender=Movie)
+def movie_indexes_changed(sender, instance, **kwargs):
+    suggest.movie_changed(instance)
+    facets.movie_changed(instance)
+
+
+@receiver(post_delete, sender=Movie)
+def movie_indexes_deleted(sender, instance, **kwargs):
+    suggest.movie_deleted(instance.pk)
+    facets.movie_deleted(instance.pk)
+
+
+@receiver(post_save, sender=Person)
+def person_suggestion_changed(sender, instance, **kwargs):
+    suggest.person_changed(instance)
+
+
+@receiver(post_delete, sender=Person)
+def person_suggestion_deleted(sender, instance, **kwargs):
+    suggest.person_deleted(instance.pk)
+
+
+FACET_SENDERS = {Genre: "genres", Country: "countries", Category: "category"}
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Country)
+@receiver(post_save, sender=Category)
+def facet_value_changed(sender, instance, **kwargs):
+    facets.value_changed(FACET_SENDERS[sender], instance)
+
+
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Country)
+@receiver(post_delete, sender=Category)
+def facet_value_deleted(sender, instance, **kwargs):
+    facets.value_deleted(FACET_SENDERS[sender], instance.pk)
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+@receiver(m2m_changed, sender=Movie.countries.through)
+def movie_facets_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action.startswith("post_"):
+        facet = "genres" if sender is Movie.genres.through else "countries"
+        facets.relations_changed(facet, instance, action, reverse, pk_set)
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def movie_relation_changed(sender, instance, **kwargs):
+    invalidate_movie(instance.movie_id)
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Country)
+@receiver(post_delete, sender=Country)
+def shared_data_changed(sender, instance, **kwargs):
+    """Персоны, жанры, категории и страны выводятся во многих фильмах сразу"""
+    invalidate_all()
+
+
+@receiver(m2m_changed, sender=Movie.countries.through)
+@receiver(m2m_changed, sender=Movie.directors.through)
+@receiver(m2m_changed, sender=Movie.actors.through)
+@receiver(m2m_changed, sender=Movie.genres.through)
+def movie_m2m_changed(sender, instance, action, reverse, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if reverse:
+        invalidate_all()
+    else:
+        invalidate_movie(instance.pk)
+
+
+def touch(queryset):
+    """Сдвигает версии записей, чьи ответы API зависят от измененных данных"""
+    queryset.update(**get_version_bump())
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_version_changed(sender, instance, **kwargs):
+    """Отзывы выводятся в карточке фильма"""
+    if not is_movie_deleted(instance.movie_id):
+        touch(Movie.objects.filter(pk=instance.movie_id))
+
+
+# Связи, которые выводятся в карточках: промежуточная таблица -> (модель карточки, поле связи)
+VERSIONED_RELATIONS = {
+    Movie.genres.through: (Movie, "genres"),
+    Movie.countries.through: (Movie, "countries"),
+    Movie.directors.through: (Movie, "directors"),
+    Movie.actors.through: (Movie, "actors"),
+    Person.countries.through: (Person, "countries"),
+}
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+@receiver(m2m_changed, sender=Movie.countries.through)
+@receiver(m2m_changed, sender=Movie.directors.through)
+@receiver(m2m_changed, sender=Movie.actors.through)
+@receiver(m2m_changed, sender=Person.countries.through)
+def relation_version_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Со стороны карточки сдвигается версия самой записи, с обратной - версии
+    записей из pk_set, а при clear - всех связанных, пока строки связи еще есть.
+    """
+    model, field = VERSIONED_RELATIONS[sender]
+    if not reverse and action.startswith("post_"):
+        touch(model.objects.filter(pk=instance.pk))
+    elif reverse and action in ("post_add", "post_remove"):
+        touch(model.objects.filter(pk__in=pk_set))
+    elif reverse and action == "pre_clear":
+        touch(model.objects.filter(**{field: instance.pk}))
+
+
+@receiver(post_save, sender=Person)
+@receiver(pre_delete, sender=Person)
+def person_version_changed(sender, instance, **kwargs):
+    """Имена персон выводятся в карточках фильмов; при удалении строки связей еще на месте"""
+    touch(Movie.objects.filter(Q(actors=instance.pk) | Q(directors=instance.pk)))
+
+
+@receiver(post_save, sender=Genre)
+@receiver(pre_delete, sender=Genre)
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+@receiver(post_save, sender=Country)
+@receiver(pre_delete, sender=Country)
+def reference_version_changed(sender, instance, **kwargs):
+    field = {Genre: "genres", Category: "category", Country: "countries"}[sender]
+    touch(Movie.objects.filter(**{field: instance.pk}))
+    if sender is Country:
+        touch(Person.objects.filter(countries=instance.pk))
+
+
+RENDITION_FIELDS = {model: (image_type, field) for image_type, (model, field) in IMAGE_FIELDS.items()}
+
+
+@receiver(pre_save, sender=Movie)
+@receiver(pre_save, sender=Person)
+@receiver(pre_save, sender=MovieShots)
+def image_uploaded(sender, instance, **kwargs):
+    """
+    Новый файл еще не записан в хранилище (_committed): превью строятся после сохранения,
+    а до тех пор у записи их нет. Имя прежнего файла нужно, чтобы удалить его превью.
+    """
+    field = RENDITION_FIELDS[sender][1]
+    instance._image_uploaded = not getattr(getattr(instance, field), "_committed", True)
+    if instance._image_uploaded:
+        instance.renditions = ""
+        previous = sender.objects.filter(pk=instance.pk).values_list(field, flat=True) if instance.pk else []
+        instance._previous_image = next(iter(previous), None)
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=MovieShots)
+def image_renditions(sender, instance, **kwargs):
+    """Превью строит обработчик фоновых задач, сохранение ждет только записи строки очереди"""
+    image_type, field = RENDITION_FIELDS[sender]
+    file = getattr(instance, field)
+    if getattr(instance, "_image_uploaded", False) and file:
+        build_renditions.delay(image_type, file.name, instance._previous_image)
+
+
+@receiver(request_started)
+def database_health_checks(sender, **kwargs):
+    if settings.DATABASE_HEALTH_CHECKS:
+        check_connections()
+
+
+@receiver(request_finished)
+def database_connections_released(sender, **kwargs):
+    if settings.DATABASE_HEALTH_CHECKS:
+        mark_connections_released()
@@ -0,0 +1,208 @@
+import re
+from bisect import bisect_left, insort
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+from transliterate import get_translit_function
+
+from .local_index import LocalIndex
+from .models import Movie, Person
+
+WORD_RE = re.compile(r"\w+")
+LATIN_RE = re.compile(r"[a-z]")
+
+
+def normalize(text):
+    return text.lower().replace("ё", "е")
+
+
+@lru_cache(maxsize=None)
+def get_ru_translit():
+    """Языковой пакет создается один раз: translit() строит его и определяет язык на каждый вызов"""
+    return get_translit_function("ru")
+
+
+@lru_cache(maxsize=4096)
+def get_words(label):
+    """Слова подписи вместе с транслитом: Терминатор -> терминатор, terminator"""
+    ru_translit = get_ru_translit()
+    text = normalize(label)
+    words = set(WORD_RE.findall(text))
+    words.update(WORD_RE.findall(normalize(ru_translit(label, reversed=True).replace("'", ""))))
+    if LATIN_RE.search(text):
+        words.update(WORD_RE.findall(normalize(ru_translit(label))))
+    return frozenset(words)
+
+
+def get_trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SuggestIndex(LocalIndex):
+    """
+    Индекс подсказок по названиям фильмов и именам персон.
+    Префиксы ищутся бинарным поиском по отсортированному списку слов,
+    опечатки - по общим триграммам слов.
+    """
+    version_name = "suggest"
+
+    def __init__(self):
+        super().__init__()
+        self.entries = {}
+        self.words = []
+        self.word_keys = {}
+        self.trigrams = {}
+
+    def build(self):
+        with self.lock:
+            self.entries, self.words, self.word_keys, self.trigrams = {}, [], {}, {}
+            for movie in Movie.objects.filter(draft=False).only("id", "title"):
+                self.add(make_movie_entry(movie), insert_sorted=False)
+            for person in Person.objects.only("id", "first_name", "second_name", "last_name"):
+                self.add(make_person_entry(person), insert_sorted=False)
+            self.words = sorted(self.word_keys)
+
+    def add(self, entry, insert_sorted=True):
+        key = (entry["type"], entry["id"])
+        self.remove(key)
+        self.entries[key] = entry
+        for word in entry["words"]:
+            keys = self.word_keys.get(word)
+            if keys is None:
+                keys = self.word_keys[word] = set()
+                if insert_sorted:
+                    insort(self.words, word)
+                for trigram in get_trigrams(word):
+                    self.trigrams.setdefault(trigram, set()).add(word)
+            keys.add(key)
+
+    def add_entry(self, entry_type, pk, label):
+        self.add(make_entry(entry_type, pk, label))
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for word in entry["words"]:
+            keys = self.word_keys[word]
+            keys.discard(key)
+            if keys:
+                continue
+            del self.word_keys[word]
+            del self.words[bisect_left(self.words, word)]
+            for trigram in get_trigrams(word):
+                words = self.trigrams[trigram]
+                words.discard(word)
+                if not words:
+                    del self.trigrams[trigram]
+
+    def iter_prefixed(self, prefix):
+        """Слова с префиксом в алфавитном порядке: короткие и точные совпадения идут первыми"""
+        for position in range(bisect_left(self.words, prefix), len(self.words)):
+            word = self.words[position]
+            if not word.startswith(prefix):
+                return
+            yield word
+
+    def get_prefixed_keys(self, prefix):
+        keys = set()
+        for word in self.iter_prefixed(prefix):
+            keys.update(self.word_keys[word])
+        return keys
+
+    def get_similar_words(self, word, threshold):
+        """Слова, похожие на word по доле общих триграмм, от самых похожих"""
+        trigrams = get_trigrams(word)
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(self.trigrams.get(trigram, ()))
+        similar = []
+        for candidate, count in shared.items():
+            score = count / (len(trigrams) + len(get_trigrams(candidate)) - count)
+            if score >= threshold:
+                similar.append((-score, candidate))
+        return [candidate for _, candidate in sorted(similar)]
+
+    def suggest(self, text, limit=10):
+        """
+        Подсказки по началу слов запроса: все слова, кроме последнего, должны
+        встретиться целиком или префиксом, последнее - префиксом.
+        Если совпадений мало, последнее слово ищется с опечатками.
+        """
+        words = WORD_RE.findall(normalize(text))
+        if not words:
+            return []
+        with self.lock:
+            *complete, last = words
+            required = None
+            for word in complete:
+                keys = self.get_prefixed_keys(word)
+                required = keys if required is None else required & keys
+                if not required:
+                    return []
+
+            found = []
+            for word in self.iter_prefixed(last):
+                self.collect(found, self.word_keys[word], required, limit)
+                if len(found) >= limit:
+                    break
+            if len(found) < limit and len(last) >= 3:
+                for word in self.get_similar_words(last, settings.SUGGEST_TYPO_THRESHOLD):
+                    self.collect(found, self.word_keys[word], required, limit)
+                    if len(found) >= limit:
+                        break
+            return [
+                {"type": entry["type"], "id": entry["id"], "label": entry["label"]}
+                for entry in (self.entries[key] for key in found)
+            ]
+
+    @staticmethod
+    def collect(found, keys, required, limit):
+        if required is not None:
+            keys = keys & required
+        for key in keys:
+            if len(found) >= limit:
+                return
+            if key not in found:
+                found.append(key)
+
+
+def make_entry(entry_type, pk, label):
+    return {"type": entry_type, "id": pk, "label": label, "words": get_words(label)}
+
+
+def make_movie_entry(movie):
+    return make_entry("movie", movie.pk, movie.title)
+
+
+def make_person_entry(person):
+    return make_entry("person", person.pk, person.get_full_name())
+
+
+def movie_changed(movie):
+    if movie.draft:
+        index.apply_change(("remove", ("movie", movie.pk)))
+    else:
+        index.apply_change(("add_entry", "movie", movie.pk, movie.title))
+
+
+def movie_deleted(movie_id):
+    index.apply_change(("remove", ("movie", movie_id)))
+
+
+def person_changed(person):
+    index.apply_change(("add_entry", "person", person.pk, person.get_full_name()))
+
+
+def person_deleted(person_id):
+    index.apply_change(("remove", ("person", person_id)))
+
+
+def suggest(text, limit=10):
+    index.ensure_fresh()
+    return index.suggest(text, limit)
+
+
+index = SuggestIndex()
@@ -0,0 +1,165 @@
+import json
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Task
+
+# Зарегистрированные задачи: полное имя функции -> функция
+TASKS = {}
+
+
+def task(func=None, max_attempts=None):
+    """
+    Регистрирует функцию как фоновую задачу: func.delay(*args, **kwargs) ставит ее
+    в очередь вместо вызова. Аргументы должны сериализоваться в JSON.
+    """
+    def register(func):
+        name = f"{func.__module__}.{func.__name__}"
+        TASKS[name] = func
+        func.delay = lambda *args, **kwargs: enqueue(name, args, kwargs, max_attempts)
+        return func
+    return register(func) if func is not None else register
+
+
+def enqueue(name, args=(), kwargs=None, max_attempts=None):
+    """
+    Ставит задачу в очередь. Строка пишется в текущей транзакции: обработчик увидит
+    задачу только вместе с данными, ради которых она создана, а при откате ее не будет.
+    С TASKS_EAGER задача выполняется сразу (тесты, разработка без обработчика).
+    """
+    kwargs = kwargs or {}
+    if settings.TASKS_EAGER:
+        TASKS[name](*args, **kwargs)
+        return None
+    return Task.objects.create(
+        name=name,
+        arguments=json.dumps({"args": list(args), "kwargs": kwargs}),
+        max_attempts=max_attempts or settings.TASKS_MAX_ATTEMPTS,
+    )
+
+
+def claim_tasks(worker, limit):
+    """
+    Забирает до limit готовых задач обработчику worker. На PostgreSQL строки
+    блокируются с SKIP LOCKED, и обработчики не ждут друг друга; на остальных
+    базах задачу получает тот, чей UPDATE со status = pending прошел первым.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        pending = Task.objects.filter(status=Task.PENDING, run_at__lte=now).order_by("run_at")
+        if connection.features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True)
+        ids = list(pending.values_list("id", flat=True)[:limit])
+        if not ids:
+            return []
+        Task.objects.filter(pk__in=ids, status=Task.PENDING).update(
+            status=Task.RUNNING, locked_by=worker, locked_at=now, attempts=F("attempts") + 1,
+        )
+    return list(Task.objects.filter(pk__in=ids, status=Task.RUNNING, locked_by=worker).order_by("run_at"))
+
+
+@contextmanager
+def heartbeat(task):
+    """
+    Пока задача выполняется, каждые TASKS_HEARTBEAT_INTERVAL секунд обновляет ее locked_at
+    в отдельном потоке, чтобы release_stale_tasks не вернул в очередь живую задачу.
+    """
+    stopped = threading.Event()
+
+    def beat():
+        try:
+            while not stopped.wait(settings.TASKS_HEARTBEAT_INTERVAL):
+                Task.objects.filter(pk=task.pk, status=Task.RUNNING, locked_by=task.locked_by).update(
+                    locked_at=timezone.now(),
+                )
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f"task-heartbeat-{task.pk}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def run_task(task):
+    """
+    Выполняет взятую задачу: удачная удаляется, упавшая уходит на повтор. Возвращает успех.
+    Строка меняется, только пока задача числится за этим обработчиком: если ее уже
+    вернули в очередь и взял другой, результат этого запуска не трогает чужую попытку.
+    """
+    with heartbeat(task):
+        try:
+            func = TASKS.get(task.name)
+            if func is None:
+                raise LookupError(f"Задача {task.name} не зарегистрирована")
+            arguments = json.loads(task.arguments)
+            func(*arguments["args"], **arguments["kwargs"])
+        except Exception:
+            retry_task(task, traceback.format_exc())
+            return False
+    Task.objects.filter(pk=task.pk, status=Task.RUNNING, locked_by=task.locked_by).delete()
+    return True
+
+
+def get_retry_delay(attempts):
+    """Экспоненциальная задержка: TASKS_RETRY_DELAY, вдвое больше, вчетверо..."""
+    return timedelta(seconds=settings.TASKS_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def retry_task(task, error, **conditions):
+    """
+    Возвращает задачу в очередь с задержкой, после max_attempts оставляет со статусом failed.
+    Срабатывает, только если задача все еще числится за task.locked_by (и подходит
+    под conditions). Возвращает, изменилась ли строка.
+    """
+    if task.attempts >= task.max_attempts:
+        changes = {"status": Task.FAILED}
+    else:
+        changes = {"status": Task.PENDING, "run_at": timezone.now() + get_retry_delay(task.attempts)}
+    return bool(Task.objects.filter(pk=task.pk, status=Task.RUNNING, locked_by=task.locked_by, **conditions).update(
+        last_error=error, locked_by="", locked_at=None, **changes,
+    ))
+
+
+def release_stale_tasks():
+    """
+    Задачи, которые дольше TASKS_LOCK_TIMEOUT числятся за обработчиком (процесс упал
+    или был убит), возвращаются в очередь; попытка при этом уже засчитана. Живой
+    обработчик продлевает locked_at через heartbeat, и его задачи сюда не попадают.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.TASKS_LOCK_TIMEOUT)
+    released = 0
+    for task in Task.objects.filter(status=Task.RUNNING, locked_at__lt=cutoff):
+        error = task.last_error or f"Обработчик {task.locked_by} не завершил задачу"
+        # Повторная проверка locked_at: обработчик мог отметиться после выборки
+        released += retry_task(task, error, locked_at__lt=cutoff)
+    return released
+
+
+def run_in_thread(task):
+    """run_task для потока обработчика: у каждого потока свое соединение с базой"""
+    close_old_connections()
+    try:
+        return run_task(task)
+    finally:
+        close_old_connections()
+
+
+def run_pending(worker, limit, executor=None):
+    """
+    Один проход обработчика: забирает готовые задачи и выполняет их в пуле потоков,
+    без executor - по очереди в текущем потоке. Возвращает число удачных и упавших.
+    """
+    tasks = claim_tasks(worker, limit)
+    results = list(executor.map(run_in_thread, tasks) if executor is not None else map(run_task, tasks))
+    return results.count(True), results.count(False)
@@ -0,0 +1,32 @@
+from django.core.mail import EmailMultiAlternatives
+
+from .renditions import IMAGE_FIELDS, delete_renditions, make_renditions, record_renditions
+from .task_queue import task
+
+
+@task
+def build_renditions(image_type, name, previous=None):
+    """
+    Превью загруженного файла: строятся обработчиком, а не в запросе, который его сохранил.
+    Превью замененного файла previous удаляются.
+    """
+    model, field = IMAGE_FIELDS[image_type]
+    storage = model._meta.get_field(field).storage
+    make_renditions(storage, name, overwrite=True)
+    record_renditions(image_type, name)
+    if previous and previous != name:
+        delete_renditions(storage, previous)
+
+
+@task(max_attempts=5)
+def send_email(subject, body, from_email, to, html=None, cc=None, bcc=None, reply_to=None):
+    """
+    Отправка готового письма: SMTP-сервер отвечает медленно и бывает недоступен.
+    Без текстовой части письмо уходит как HTML, как у BaseEmailMessage templated_mail.
+    """
+    message = EmailMultiAlternatives(subject, body or html, from_email, to, bcc=bcc, cc=cc, reply_to=reply_to)
+    if html and body:
+        message.attach_alternative(html, "text/html")
+    elif html:
+        message.content_subtype = "html"
+    message.send()
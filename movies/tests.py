@@ -1,3 +1,1172 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from core.asgi import application
+from core.db.postgresql_pool.base import ConnectionPool
+
+from .models import Movie, Rating, RatingStars, Person, Genre, Country, Category, Review, Task
+from .cache import get_stats, get_versions
+from .health import check_connections, mark_connections_released
+from .local_index import INDEXES
+from .ratings import apply_rating_batch, flush_rating_buffer, rate_movie
+from .renderers import FastJSONRenderer
+from .renditions import get_rendition_name, get_thumbnail_url
+from .review_tree import build_review_tree
+from .routers import ReadReplicaRouter, replica_reads
+from .task_queue import claim_tasks, release_stale_tasks, run_task, task
+from . import facets, rating_buffer, suggest
+
+
+def create_movie(title="Терминатор", **kwargs):
+    return Movie.objects.create(title=title, description="Описание", poster="movies/poster.jpg", **kwargs)
+
+
+def create_person(first_name="Арнольд", last_name="Шварценеггер"):
+    return Person.objects.create(
+        first_name=first_name, last_name=last_name, date_of_birthday=date(1947, 7, 30),
+        description="Описание", image="actors/image.jpg"
+    )
+
+
+class SlugTest(TestCase):
+
+    def test_slug_on_create(self):
+        movie = create_movie("Терминатор")
+        person = create_person()
+        self.assertEqual(movie.slug, f"{movie.pk}-terminator")
+        self.assertEqual(Movie.objects.get(pk=movie.pk).slug, movie.slug)
+        self.assertEqual(Person.objects.get(pk=person.pk).slug, f"{person.pk}-arnold-shvartsenegger")
+        self.assertEqual(create_movie("Terminator 2").slug.split("-", 1)[1], "terminator-2")
+
+    def test_bulk_create_with_slugs(self):
+        create_movie("Чужой")
+        movies = Movie.objects.bulk_create_with_slugs([
+            Movie(title=title, description="-", poster="movies/poster.jpg") for title in ("Терминатор", "Матрица")
+        ] + [
+            Movie(title="Свой слаг", description="-", poster="movies/poster.jpg", slug="own"),
+            Movie(pk=1000, title="Свой id", description="-", poster="movies/poster.jpg"),
+        ])
+        saved = dict(Movie.objects.exclude(title="Чужой").values_list("title", "slug"))
+        self.assertEqual(saved, {movie.title: movie.slug for movie in movies})
+        self.assertEqual(movies[0].slug, f"{movies[0].pk}-terminator")
+        self.assertEqual(movies[1].slug, f"{movies[1].pk}-matritsa")
+        self.assertEqual(movies[2].slug, "own")
+        self.assertEqual(movies[3].slug, "1000-svoj-id")
+
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.movie = create_movie("Терминатор", tagline="Он вернется")
+        create_movie("Чужой")
+        create_movie("Терминатор: черновик", draft=True)
+        self.person = create_person()
+
+    def search(self, text):
+        data = self.client.get("/api/v1/search/", {"q": text}).json()
+        return [movie["id"] for movie in data["movies"]], [person["id"] for person in data["persons"]]
+
+    def test_search_movies_and_persons(self):
+        self.assertEqual(self.search("Терминатор"), ([self.movie.pk], []))
+        self.assertEqual(self.search("terminator"), ([self.movie.pk], []))
+        self.assertEqual(self.search("Шварценеггер"), ([], [self.person.pk]))
+        self.assertEqual(self.search("shvartsenegger"), ([], [self.person.pk]))
+        self.assertEqual(self.search(""), ([], []))
+
+    def test_vector_follows_updates(self):
+        self.movie.title = "Хищник"
+        self.movie.save()
+        self.assertEqual(self.search("Хищник"), ([self.movie.pk], []))
+        self.assertEqual(self.search("Чужой")[0], [Movie.objects.get(title="Чужой").pk])
+
+
+class SuggestTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        suggest.index.version = None
+        self.client = APIClient()
+        self.terminator = create_movie("Терминатор")
+        self.terminator_2 = create_movie("Terminator 2")
+        self.person = create_person()
+
+    def labels(self, text):
+        return [item["label"] for item in self.client.get("/api/v1/suggest/", {"q": text}).json()]
+
+    def test_prefix_translit_and_typos(self):
+        self.assertEqual(sorted(self.labels("тер")), ["Terminator 2", "Терминатор"])
+        self.assertEqual(sorted(self.labels("TERM")), ["Terminator 2", "Терминатор"])
+        self.assertEqual(sorted(self.labels("терминатр")), ["Terminator 2", "Терминатор"])
+        self.assertEqual(self.labels("шварценегер"), ["Арнольд Шварценеггер"])
+        self.assertEqual(self.labels("арнольд шварц"), ["Арнольд Шварценеггер"])
+        self.assertEqual(self.labels("arnold shv"), ["Арнольд Шварценеггер"])
+        self.assertEqual(self.labels("арнольд тер"), [])
+        self.assertEqual(self.labels(""), [])
+
+    def test_index_follows_signals(self):
+        self.labels("тер")
+        self.terminator.title = "Хищник"
+        self.terminator.save()
+        self.terminator_2.draft = True
+        self.terminator_2.save()
+        self.assertEqual(self.labels("хищ"), ["Хищник"])
+        self.assertEqual(self.labels("тер"), [])
+        self.person.delete()
+        self.assertEqual(self.labels("арн"), [])
+
+
+class FacetsTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        facets.index.version = None
+        self.client = APIClient()
+        self.drama = Genre.objects.create(name="Драма", description="-", url="drama")
+        self.comedy = Genre.objects.create(name="Комедия", description="-", url="comedy")
+        self.usa = Country.objects.create(name="США")
+        self.category = Category.objects.create(name="Фильмы", description="-", url="films")
+        self.movies = []
+        for year, genres in ((1990, [self.drama]), (1990, [self.comedy]), (2000, [self.drama, self.comedy])):
+            movie = create_movie(year=year, category=self.category)
+            movie.genres.set(genres)
+            self.movies.append(movie)
+        self.movies[0].countries.add(self.usa)
+        create_movie("Черновик", year=1990, draft=True).genres.add(self.drama)
+
+    def get_facets(self, **params):
+        data = self.client.get("/api/v1/movies/facets/", params).json()
+        return {
+            "total": data["total"],
+            "genres": {item["name"]: item["count"] for item in data["genres"]},
+            "countries": {item["name"]: item["count"] for item in data["countries"]},
+            "category": {item["name"]: item["count"] for item in data["category"]},
+            "year": {item["value"]: item["count"] for item in data["year"]},
+        }
+
+    def test_disjunctive_counts(self):
+        self.assertEqual(self.get_facets(), {
+            "total": 3, "genres": {"Драма": 2, "Комедия": 2}, "countries": {"США": 1},
+            "category": {"Фильмы": 3}, "year": {1990: 2, 2000: 1},
+        })
+        data = self.get_facets(genres="Драма", year_min=1990, year_max=1995)
+        self.assertEqual(data["total"], 1)
+        self.assertEqual(data["genres"], {"Драма": 1, "Комедия": 1})
+        self.assertEqual(data["year"], {1990: 1, 2000: 1})
+        self.assertEqual(self.client.get("/api/v1/movies/facets/", {"year_min": "x"}).status_code, 400)
+
+    def test_index_follows_signals(self):
+        self.get_facets()
+        self.movies[1].genres.add(self.drama)
+        self.drama.movie_set.remove(self.movies[2])
+        self.movies[0].draft = True
+        self.movies[0].save()
+        self.usa.movie_country.add(self.movies[2])
+        self.comedy.delete()
+        self.assertEqual(self.get_facets(), {
+            "total": 2, "genres": {"Драма": 1}, "countries": {"США": 1},
+            "category": {"Фильмы": 2}, "year": {1990: 1, 2000: 1},
+        })
+
+    def test_bits_are_positions(self):
+        self.get_facets()
+        far = create_movie(pk=10 ** 7, year=2010)
+        far.genres.add(self.comedy)
+        index = facets.index
+        self.assertLessEqual(len(index.all.data), 1)
+        self.assertEqual(index.movie_values["genres"][far.pk], (self.comedy.pk,))
+        freed = index.positions[self.movies[2].pk]
+        self.movies[2].delete()
+        self.assertEqual(self.get_facets()["genres"], {"Драма": 1, "Комедия": 2})
+        self.assertEqual(index.positions[create_movie(year=2010).pk], freed)
+
+    def test_rollback_leaves_index_unchanged(self):
+        self.get_facets()
+        with self.assertRaises(ValueError), transaction.atomic():
+            create_movie(year=2010, category=self.category).genres.add(self.comedy)
+            raise ValueError
+        self.assertEqual(self.get_facets()["year"], {1990: 2, 2000: 1})
+
+    def test_other_process_replays_changes(self):
+        other = facets.FacetIndex()
+        self.addCleanup(INDEXES.remove, other)
+        other.ensure_fresh()
+        create_movie(year=2010, category=self.category).genres.add(self.comedy)
+        self.movies[0].delete()
+        other.checked_at = 0
+        with mock.patch.object(other, "build") as build:
+            other.ensure_fresh()
+        build.assert_not_called()
+        counts = other.get_facets({})
+        self.assertEqual(counts["total"], 3)
+        self.assertEqual(counts["year"], [{"value": 2010, "count": 1}, {"value": 2000, "count": 1},
+                                          {"value": 1990, "count": 1}])
+
+        facets.index.invalidate()
+        other.checked_at = 0
+        with mock.patch.object(other, "build") as build:
+            other.ensure_fresh()
+        build.assert_called_once()
+
+
+class MovieFilterTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        facets.index.version = None
+        self.client = APIClient()
+        self.drama = Genre.objects.create(name="Драма", description="-", url="drama")
+        self.comedy = Genre.objects.create(name="Комедия", description="-", url="comedy")
+        self.usa = Country.objects.create(name="США")
+        self.cameron = create_person("Джеймс", "Кэмерон")
+        self.arnold = create_person()
+        self.terminator = create_movie(
+            "Терминатор", year=1984, budget=6400000, fees_in_world=78000000, world_premier=date(1984, 10, 26)
+        )
+        self.terminator.genres.set([self.drama, self.comedy])
+        self.terminator.countries.add(self.usa)
+        self.terminator.directors.add(self.cameron)
+        self.terminator.actors.add(self.arnold)
+        self.titanic = create_movie(
+            "Титаник", year=1997, budget=200000000, fees_in_world=2000000000, world_premier=date(1997, 11, 1)
+        )
+        self.titanic.genres.add(self.drama)
+        self.titanic.directors.add(self.cameron)
+        Movie.objects.filter(pk=self.terminator.pk).update(rating_count=1, rating_sum=5, average_rating=5.0)
+        Movie.objects.filter(pk=self.titanic.pk).update(rating_count=1, rating_sum=3, average_rating=3.0)
+
+    def titles(self, **params):
+        response = self.client.get("/api/v1/movies/", params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(movie["title"] for movie in response.json()["results"])
+
+    def test_filters(self):
+        self.assertEqual(self.titles(genres="Драма,Комедия"), ["Терминатор", "Титаник"])
+        self.assertEqual(self.titles(directors=self.cameron.pk, actors=self.arnold.pk), ["Терминатор"])
+        self.assertEqual(self.titles(countries=self.usa.pk), ["Терминатор"])
+        self.assertEqual(self.titles(premiere_after="1990-01-01"), ["Титаник"])
+        self.assertEqual(self.titles(budget_max=10000000), ["Терминатор"])
+        self.assertEqual(self.titles(fees_in_world_min=1000000000), ["Титаник"])
+        self.assertEqual(self.titles(rating_min=4), ["Терминатор"])
+        self.assertEqual(self.titles(genres="Драма", directors=self.cameron.pk, rating_min=1), ["Терминатор", "Титаник"])
+
+    def test_single_query_without_joins(self):
+        with CaptureQueriesContext(connection) as context:
+            self.titles(genres="Драма,Комедия", directors=self.cameron.pk, actors=self.arnold.pk)
+        sql = next(query["sql"] for query in context.captured_queries if "EXISTS" in query["sql"])
+        self.assertNotIn("DISTINCT", sql)
+        self.assertNotIn("JOIN \"movies_movie_genres\"", sql.split("EXISTS")[0])
+
+    def test_facets_honour_filters(self):
+        data = self.client.get("/api/v1/movies/facets/", {"directors": self.cameron.pk, "rating_min": 4}).json()
+        self.assertEqual(data["total"], 1)
+        self.assertEqual({item["name"]: item["count"] for item in data["genres"]}, {"Драма": 1, "Комедия": 1})
+        data = self.client.get("/api/v1/movies/facets/", {"countries": self.usa.pk}).json()
+        self.assertEqual(data["total"], 1)
+        self.assertEqual(data["countries"], [{"id": self.usa.pk, "name": "США", "count": 1}])
+
+
+class RendererTest(TestCase):
+
+    def test_same_bytes_as_drf(self):
+        data = OrderedDict([
+            ("title", "Терминатор\u2028"), ("budget", Decimal("6.40")), ("premiere", date(1984, 10, 26)),
+            ("updated", datetime(2020, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc)), ("id", uuid.UUID(int=1)),
+            ("counts", {1: 2}), ("tags", ("a", "b")), ("rating", None), ("huge", 2 ** 70),
+        ])
+        for value in (data, [data, {"nested": [data]}], {"huge": 1}):
+            self.assertEqual(FastJSONRenderer().render(value), JSONRenderer().render(value))
+
+    def test_nan_differs_from_drf(self):
+        self.assertEqual(FastJSONRenderer().render({"rating": float("nan")}), b'{"rating":null}')
+        with self.assertRaises(ValueError):
+            JSONRenderer().render({"rating": float("nan")})
+
+    def test_files_and_api_responses(self):
+        person = create_person()
+        rendered = FastJSONRenderer().render({"image": person.image, "empty": Person().image})
+        self.assertEqual(json.loads(rendered), {"image": "/media/actors/image.jpg", "empty": None})
+        response = APIClient().get(f"/api/v1/persons/{person.pk}/")
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+
+class RatingAggregatesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stars = {value: RatingStars.objects.create(value=value) for value in range(1, 6)}
+
+    def setUp(self):
+        self.movie = create_movie()
+
+    def assertAggregates(self, count, total, average):
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.rating_count, count)
+        self.assertEqual(self.movie.rating_sum, total)
+        self.assertEqual(self.movie.average_rating, average)
+
+    def test_new_ratings_are_added(self):
+        rate_movie("127.0.0.1", self.movie, self.stars[5])
+        rate_movie("127.0.0.2", self.movie, self.stars[2])
+        self.assertAggregates(2, 7, 3.5)
+
+    def test_star_change_replaces_value(self):
+        rate_movie("127.0.0.1", self.movie, self.stars[5])
+        rate_movie("127.0.0.1", self.movie, self.stars[1])
+        self.assertEqual(Rating.objects.count(), 1)
+        self.assertAggregates(1, 1, 1.0)
+
+    def test_delete_subtracts_value(self):
+        rating = rate_movie("127.0.0.1", self.movie, self.stars[4])
+        rate_movie("127.0.0.2", self.movie, self.stars[2])
+        rating.delete()
+        self.assertAggregates(1, 2, 2.0)
+        Rating.objects.all().delete()
+        self.assertAggregates(0, 0, None)
+
+    def test_movie_delete_skips_rating_updates(self):
+        for number in range(5):
+            rate_movie(f"127.0.0.{number}", self.movie, self.stars[3])
+        with CaptureQueriesContext(connection) as context:
+            self.movie.delete()
+        self.assertFalse([query for query in context if query["sql"].startswith("UPDATE")])
+
+    def test_recompute_command_fixes_drift(self):
+        Rating.objects.create(ip="127.0.0.1", movie=self.movie, star=self.stars[3])
+        call_command("recompute_ratings", stdout=StringIO())
+        self.assertAggregates(1, 3, 3.0)
+
+        Movie.objects.update(average_rating=4.0)
+        out = StringIO()
+        call_command("recompute_ratings", stdout=out)
+        self.assertIn("average 4.0 -> 3.0", out.getvalue())
+        self.assertAggregates(1, 3, 3.0)
+
+    def test_save_keeps_concurrent_votes(self):
+        stale = Movie.objects.get(pk=self.movie.pk)
+        rate_movie("127.0.0.1", self.movie, self.stars[5])
+        stale.title = "Терминатор 2"
+        stale.save()
+        self.assertAggregates(1, 5, 5.0)
+        self.assertEqual(self.movie.title, "Терминатор 2")
+
+
+@skipUnless(connection.vendor == "postgresql", "гонки голосов воспроизводятся только на PostgreSQL")
+class ConcurrentRatingTest(TransactionTestCase):
+
+    def test_concurrent_first_votes_keep_sum(self):
+        movie = create_movie()
+        stars = {value: RatingStars.objects.create(value=value) for value in (2, 5)}
+        inserted, voting = threading.Event(), threading.Event()
+
+        def first():
+            with transaction.atomic():
+                rate_movie("127.0.0.1", movie, stars[5])
+                inserted.set()
+                voting.wait()
+                # второй голос успевает упереться в незафиксированную строку
+                time.sleep(0.3)
+            connection.close()
+
+        def second():
+            inserted.wait()
+            voting.set()
+            rate_movie("127.0.0.1", movie, stars[2])
+            connection.close()
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        movie.refresh_from_db()
+        self.assertEqual((movie.rating_count, movie.rating_sum), (1, 2))
+        self.assertEqual(Rating.objects.get().star_id, stars[2].pk)
+
+    def test_batch_keeps_concurrent_vote(self):
+        movie = create_movie()
+        star = RatingStars.objects.create(value=5)
+        voted = threading.Event()
+
+        def vote():
+            with transaction.atomic():
+                rate_movie("10.0.0.1", movie, star)
+                voted.set()
+                # пачка успевает посчитать агрегаты, пока голос не зафиксирован
+                time.sleep(0.3)
+            connection.close()
+
+        thread = threading.Thread(target=vote)
+        thread.start()
+        voted.wait()
+        apply_rating_batch({(movie.pk, "10.0.0.2"): star.pk})
+        thread.join()
+        movie.refresh_from_db()
+        self.assertEqual((movie.rating_count, movie.rating_sum), (2, 10))
+
+
+class MovieDetailQueriesTest(TransactionTestCase):
+    """Кэш ответов сбрасывается после фиксации транзакции, отсюда TransactionTestCase"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.movie = create_movie(category=Category.objects.create(name="Фильмы", description="-", url="movies"))
+
+    def grow(self, size):
+        start = self.movie.actors.count()
+        for i in range(start, start + size):
+            self.movie.actors.add(create_person(last_name=f"Актер {i}"))
+            self.movie.directors.add(create_person(last_name=f"Режиссер {i}"))
+            self.movie.genres.add(Genre.objects.create(name=f"Жанр {i}", description="-", url=f"genre-{i}"))
+            self.movie.countries.add(Country.objects.create(name=f"Страна {i}"))
+            parent = None
+            for depth in range(3):
+                parent = Review.objects.create(
+                    email="user@example.com", name=f"Автор {i}", text="Текст", movie=self.movie, parent=parent
+                )
+
+    def count_retrieve_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f"/api/v1/movies/{self.movie.pk}/")
+        self.assertEqual(response.status_code, 200)
+        return len(context), response.json()
+
+    def test_query_count_does_not_depend_on_size(self):
+        self.grow(1)
+        small, _ = self.count_retrieve_queries()
+        self.grow(10)
+        large, data = self.count_retrieve_queries()
+        self.assertEqual(small, large)
+        self.assertEqual(len(data["actors"]), 11)
+        self.assertEqual(len(data["reviews"]), 11)
+        self.assertEqual(data["reviews"][0]["children"][0]["children"][0]["children"], [])
+
+    def test_sparse_fields(self):
+        self.grow(2)
+        full, _ = self.count_retrieve_queries()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f"/api/v1/movies/{self.movie.pk}/", {"fields": "title,genres"})
+        self.assertEqual(response.json(), {"title": "Терминатор", "genres": ["Жанр 0", "Жанр 1"]})
+        self.assertEqual(len(context), full - 4)
+        self.assertFalse(any("description" in query["sql"] for query in context.captured_queries))
+
+        response = self.client.get("/api/v1/movies/", {"fields": "title", "expand": "genres,actors"})
+        movie = response.json()["results"][0]
+        self.assertEqual(list(movie), ["id", "title", "genres", "actors"])
+        self.assertEqual(len(movie["actors"]), 2)
+        response = self.client.get(f"/api/v1/persons/{self.movie.actors.first().pk}/", {"fields": "last_name"})
+        self.assertEqual(response.json(), {"last_name": "Актер 0"})
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_export_streams_detail_shape(self):
+        self.grow(2)
+        create_movie("Чужой")
+        create_movie("Черновик", draft=True)
+        _, detail = self.count_retrieve_queries()
+
+        response = self.client.get("/api/v1/movies/export/")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row["title"] for row in rows], ["Терминатор", "Чужой"])
+        self.assertEqual(rows[0], detail)
+
+        response = self.client.get("/api/v1/movies/export/", {"as": "csv"})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn("Жанр 0|Жанр 1", lines[1])
+        self.assertEqual(self.client.get("/api/v1/movies/export/", {"as": "xml"}).status_code, 400)
+
+        response = self.client.get("/api/v1/movies/export/", {"as": "json"})
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), rows)
+
+
+class ReviewTreeTest(TestCase):
+
+    def setUp(self):
+        self.movie = create_movie()
+
+    def reply(self, parent=None):
+        return Review.objects.create(
+            email="user@example.com", name="Автор", text="Текст", movie=self.movie, parent=parent
+        )
+
+    def test_tree_is_built_from_one_query(self):
+        root = self.reply()
+        first = self.reply(root)
+        self.reply(first)
+        self.reply(root)
+        with self.assertNumQueries(1):
+            roots = build_review_tree(self.movie.reviews.all())
+        self.assertEqual(roots, [root])
+        self.assertEqual(len(roots[0].tree_children), 2)
+        self.assertEqual(len(roots[0].tree_children[0].tree_children), 1)
+
+    def test_limits(self):
+        root = self.reply()
+        for _ in range(3):
+            self.reply(self.reply(root))
+        roots = build_review_tree(self.movie.reviews.all(), max_depth=1, max_children=2)
+        self.assertEqual(len(roots[0].tree_children), 2)
+        self.assertEqual(roots[0].tree_children[0].tree_children, [])
+
+
+class ReviewPathTest(TestCase):
+
+    def setUp(self):
+        self.movie = create_movie()
+
+    def reply(self, parent=None):
+        return Review.objects.create(
+            email="user@example.com", name="Автор", text="Текст", movie=self.movie, parent=parent
+        )
+
+    def test_subtree_and_counts(self):
+        first, second = self.reply(), self.reply()
+        child = self.reply(first)
+        grandchild = self.reply(child)
+        self.reply(second)
+        self.assertEqual(list(Review.objects.subtree(first)), [first, child, grandchild])
+        self.assertEqual(grandchild.thread_id, first.pk)
+        counts = dict(Review.objects.with_reply_count().values_list("pk", "reply_count"))
+        self.assertEqual(counts, {first.pk: 2, second.pk: 1})
+        self.assertEqual(list(Review.objects.by_activity()), [second, first])
+
+    def test_delete_and_move_keep_paths(self):
+        root = self.reply()
+        child = self.reply(root)
+        grandchild = self.reply(child)
+        root.delete()
+        grandchild.refresh_from_db()
+        self.assertEqual((grandchild.depth, grandchild.thread_id), (1, child.pk))
+        self.assertEqual(list(Review.objects.subtree(Review.objects.get(pk=child.pk))), [child, grandchild])
+
+        other = self.reply()
+        child = Review.objects.get(pk=child.pk)
+        child.parent = other
+        child.save()
+        grandchild.refresh_from_db()
+        self.assertEqual((grandchild.depth, grandchild.thread_id), (2, other.pk))
+        self.assertEqual(list(Review.objects.subtree(other)), [other, child, grandchild])
+
+    def test_nested_orphans_are_rerooted(self):
+        root = self.reply()
+        first = self.reply(root)
+        deleted = self.reply(first)
+        second = self.reply(deleted)
+        leaf = self.reply(second)
+        Review.objects.filter(pk__in=[root.pk, deleted.pk]).delete()
+        first, second, leaf = Review.objects.filter(pk__in=[first.pk, second.pk, leaf.pk]).order_by("pk")
+        self.assertEqual((leaf.parent_id, leaf.depth, leaf.thread_id), (second.pk, 1, second.pk))
+        self.assertEqual(list(Review.objects.subtree(second)), [second, leaf])
+        self.assertEqual(list(Review.objects.subtree(first)), [first])
+
+    def test_cycles_and_depth_are_rejected(self):
+        root = self.reply()
+        child = self.reply(root)
+        grandchild = self.reply(child)
+        for parent in (root, grandchild):
+            root.parent = parent
+            with self.assertRaises(ValidationError):
+                root.save()
+        root.refresh_from_db()
+        self.assertEqual(root.path, "")
+
+        with mock.patch("movies.models.REVIEW_MAX_DEPTH", 3):
+            self.reply(grandchild)
+            with self.assertRaises(ValidationError):
+                self.reply(Review.objects.get(depth=3))
+            other = self.reply()
+            child.parent = self.reply(other)
+            with self.assertRaises(ValidationError):
+                child.save()
+
+    def test_movie_delete_does_not_reroot_reviews(self):
+        root = self.reply()
+        for _ in range(3):
+            self.reply(self.reply(root))
+        with CaptureQueriesContext(connection) as queries:
+            self.movie.delete()
+        # остается только SET_NULL каскада Django
+        updates = [query["sql"] for query in queries if query["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('SET "parent_id" = NULL', updates[0])
+        self.assertFalse(Review.objects.exists())
+
+
+class MovieCacheTest(TransactionTestCase):
+    """Версии кэша сдвигаются после фиксации транзакции, отсюда TransactionTestCase"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.movie = create_movie()
+        self.star = RatingStars.objects.create(value=5)
+
+    def test_list_is_cached_until_rating_changes(self):
+        self.client.get("/api/v1/movies/")
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/v1/movies/")
+        self.assertEqual(response.json()["results"][0]["average_rating"], None)
+        self.assertEqual(get_stats(), {"hits": 1, "misses": 1})
+
+        rate_movie("127.0.0.1", self.movie, self.star)
+        response = self.client.get("/api/v1/movies/")
+        self.assertEqual(response.json()["results"][0]["average_rating"], 5.0)
+
+    def test_rating_user_is_merged_per_client(self):
+        rate_movie("10.0.0.1", self.movie, self.star)
+        rated = self.client.get("/api/v1/movies/", REMOTE_ADDR="10.0.0.1").json()["results"]
+        other = self.client.get("/api/v1/movies/", REMOTE_ADDR="10.0.0.2").json()["results"]
+        self.assertEqual(get_stats(), {"hits": 1, "misses": 1})
+        self.assertEqual((rated[0]["rating_user"], other[0]["rating_user"]), (True, False))
+        self.assertEqual(list(rated[0]), ["id", "title", "tagline", "category", "rating_user", "average_rating"])
+        response = self.client.get("/api/v1/movies/rated/", REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.json(), [self.movie.pk])
+
+    def test_detail_is_invalidated_per_movie(self):
+        other = create_movie("Чужой")
+        genre = Genre.objects.create(name="Драма", description="-", url="drama")
+        self.client.get(f"/api/v1/movies/{self.movie.pk}/")
+        Review.objects.create(email="user@example.com", name="Автор", text="Текст", movie=other)
+        with self.assertNumQueries(0):
+            self.client.get(f"/api/v1/movies/{self.movie.pk}/")
+        self.movie.genres.add(genre)
+        response = self.client.get(f"/api/v1/movies/{self.movie.pk}/")
+        self.assertEqual(response.json()["genres"], ["Драма"])
+
+    def test_versions_change_after_commit(self):
+        names = ("all", "movie:list", f"movie:{self.movie.pk}")
+        versions = get_versions(*names)
+        with transaction.atomic():
+            self.movie.title = "Терминатор 2"
+            self.movie.save()
+            self.movie.genres.add(Genre.objects.create(name="Драма", description="-", url="drama"))
+            self.assertEqual(get_versions(*names), versions)
+        self.assertNotEqual(get_versions(*names), versions)
+
+
+class ConditionalGetTest(TransactionTestCase):
+    """Версии кэша сдвигаются после фиксации транзакции, отсюда TransactionTestCase"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.movie = create_movie()
+        self.person = create_person()
+        self.genre = Genre.objects.create(name="Драма", description="-", url="drama")
+
+    def get(self, url, etag=None, **params):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get(url, params, **headers)
+
+    def assert_changed(self, url, change, queries=1):
+        etag = self.get(url)["ETag"]
+        with self.assertNumQueries(queries):
+            self.assertEqual(self.get(url, etag).status_code, 304)
+        change()
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_movie_versions(self):
+        url = f"/api/v1/movies/{self.movie.pk}/"
+        self.assertIn("Last-Modified", self.get(url))
+        # Карточка фильма в кэше ответов: 304 отдается вместе с закэшированным ETag без запросов
+        self.assert_changed(url, lambda: self.movie.actors.add(self.person), queries=0)
+        self.assert_changed(url, lambda: self.genre.movie_set.add(self.movie), queries=0)
+        self.assert_changed(url, lambda: Genre.objects.get(pk=self.genre.pk).save(), queries=0)
+        self.assert_changed(url, lambda: Person.objects.get(pk=self.person.pk).save(), queries=0)
+        self.assert_changed(url, lambda: Review.objects.create(
+            email="user@example.com", name="Автор", text="Текст", movie=self.movie
+        ), queries=0)
+        self.assert_changed(url, lambda: rate_movie(
+            ip="127.0.0.1", movie=self.movie, star=RatingStars.objects.create(value=5)
+        ), queries=0)
+        self.assertNotEqual(self.get(url)["ETag"], self.get(url, fields="title")["ETag"])
+
+    def test_person_versions(self):
+        url = f"/api/v1/persons/{self.person.pk}/"
+        country = Country.objects.create(name="США")
+        self.assert_changed(url, lambda: self.person.countries.add(country))
+        self.assert_changed(url, lambda: Country.objects.get(pk=country.pk).save())
+        self.assertEqual(Person.objects.get(pk=self.person.pk).version, 3)
+
+
+class PaginationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_movies_are_paged_by_cursor(self):
+        movies = [create_movie(f"Фильм {i}") for i in range(5)]
+        data = self.client.get("/api/v1/movies/", {"page_size": 2}).json()
+        self.assertNotIn("count", data)
+        self.assertEqual([movie["id"] for movie in data["results"]], [movies[4].pk, movies[3].pk])
+        data = self.client.get(data["next"]).json()
+        self.assertEqual([movie["id"] for movie in data["results"]], [movies[2].pk, movies[1].pk])
+
+    def test_review_threads_are_not_split(self):
+        movie = create_movie()
+        for _ in range(3):
+            root = Review.objects.create(email="user@example.com", name="Автор", text="Текст", movie=movie)
+            Review.objects.create(email="user@example.com", name="Ответ", text="Текст", movie=movie, parent=root)
+        self.client.force_authenticate(User.objects.create(username="user"))
+        data = self.client.get("/api/v1/reviews/", {"page_size": 2}).json()
+        self.assertEqual(len(data["results"]), 2)
+        self.assertEqual([len(review["children"]) for review in data["results"]], [1, 1])
+
+
+class ValuesSerializersTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username="user"))
+        category = Category.objects.create(name="Фильмы", description="-", url="movies")
+        rated = create_movie("Терминатор", category=category, tagline="Он вернется")
+        create_movie("Чужой")
+        rate_movie(ip="127.0.0.1", movie=rated, star=RatingStars.objects.create(value=4))
+        create_person()
+        Person.objects.create(
+            first_name="Без", last_name="Фото", date_of_birthday=date(1950, 1, 1), description="-", image=""
+        )
+        for i in range(3):
+            root = Review.objects.create(email="user@example.com", name=f"Автор {i}", text="Текст", movie=rated)
+            reply = Review.objects.create(email="user@example.com", name="Ответ", text="-", movie=rated, parent=root)
+            Review.objects.create(email="user@example.com", name="Ответ 2", text="-", movie=rated, parent=reply)
+
+    def get_both(self, url, params=None):
+        responses = []
+        for enabled in (False, True):
+            cache.clear()
+            with override_settings(FAST_READ_SERIALIZERS=enabled):
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            responses.append(response.content)
+        return responses
+
+    def test_same_json(self):
+        for url, params in (
+            ("/api/v1/movies/", None),
+            ("/api/v1/movies/", {"page_size": 1}),
+            ("/api/v1/movies/", {"fields": "title,rating_user"}),
+            ("/api/v1/persons/", None),
+            ("/api/v1/persons/", {"fields": "image"}),
+            ("/api/v1/reviews/", {"page_size": 2}),
+            ("/api/v1/reviews/", {"fields": "name"}),
+        ):
+            slow, fast = self.get_both(url, params)
+            self.assertEqual(slow, fast, (url, params))
+        self.assertIn(b'"rating_user":true', self.get_both("/api/v1/movies/")[1])
+        review = json.loads(self.get_both("/api/v1/reviews/", {"fields": "name"})[0])["results"][0]
+        self.assertEqual(list(review), ["name", "children"])
+        self.assertEqual(list(review["children"][0]), ["name", "children"])
+        ratings = self.client.get("/api/v1/ratings/", {"fields": "star"}).json()
+        self.assertEqual([list(rating) for rating in ratings["results"]], [["star"]])
+
+    def test_values_queries(self):
+        with override_settings(FAST_READ_SERIALIZERS=True), CaptureQueriesContext(connection) as context:
+            self.client.get("/api/v1/reviews/")
+        self.assertEqual(len(context), 2)
+
+
+class RatingBufferTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        buffer_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(buffer_dir.cleanup)
+        settings = override_settings(RATING_INGESTION_MODE="buffered", RATING_BUFFER_DIR=buffer_dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username="user"))
+        self.movie = create_movie()
+        self.stars = {value: RatingStars.objects.create(value=value) for value in range(1, 6)}
+
+    def vote(self, star, ip="10.0.0.1"):
+        data = {"movie": self.movie.pk, "star": self.stars[star].pk}
+        return self.client.post("/api/v1/ratings/", data, REMOTE_ADDR=ip)
+
+    def test_votes_are_buffered_and_flushed(self):
+        self.assertEqual(self.vote(2).status_code, 202)
+        self.vote(4)
+        self.vote(3, ip="10.0.0.2")
+        self.assertFalse(Rating.objects.exists())
+        response = self.client.get("/api/v1/movies/rated/", REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.json(), [self.movie.pk])
+
+        self.assertEqual(flush_rating_buffer(), 2)
+        self.assertEqual(flush_rating_buffer(), 0)
+        self.movie.refresh_from_db()
+        self.assertEqual((self.movie.rating_count, self.movie.rating_sum), (2, 7))
+        self.assertEqual(Rating.objects.get(ip="10.0.0.1").star, self.stars[4])
+
+    def test_pending_votes_index_follows_buffer(self):
+        rating_buffer.append_vote("10.0.0.1", 1, 2)
+        rating_buffer.append_vote("10.0.0.2", 1, 3)
+        self.assertEqual(rating_buffer.get_pending_votes("10.0.0.1"), {1: 2})
+
+        current = os.path.join(settings.RATING_BUFFER_DIR, rating_buffer.CURRENT_FILE)
+        with open(current, "a") as buffer:
+            buffer.write('{"ip": "10.0.0.1", "movie": 1,')
+        self.assertEqual(rating_buffer.get_pending_votes("10.0.0.1"), {1: 2})
+        with open(current, "a") as buffer:
+            buffer.write(' "star": 4}\n')
+        self.assertEqual(rating_buffer.get_pending_votes("10.0.0.1"), {1: 4})
+
+        [batch] = rating_buffer.claim_batches()
+        rating_buffer.append_vote("10.0.0.1", 3, 5)
+        self.assertEqual(rating_buffer.get_pending_votes("10.0.0.1"), {1: 4, 3: 5})
+        rating_buffer.complete_batch(batch)
+        self.assertEqual(rating_buffer.get_pending_votes("10.0.0.1"), {3: 5})
+
+        # новый текущий файл после ротации не смешивается с прочитанным старым
+        rating_buffer.claim_batches()
+        for batch in rating_buffer.get_batch_paths():
+            rating_buffer.complete_batch(batch)
+        rating_buffer.append_vote("10.0.0.2", 4, 1)
+        rating_buffer.append_vote("10.0.0.2", 4, 1)
+        self.assertEqual(rating_buffer.get_pending_votes("10.0.0.1"), {})
+
+
+class RenditionsTest(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.settings_override = override_settings(MEDIA_ROOT=media.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def make_image(self, size=(900, 1200)):
+        buffer = BytesIO()
+        Image.new("RGB", size, "red").save(buffer, "JPEG")
+        return buffer.getvalue()
+
+    def test_renditions_on_upload(self):
+        person = create_person()
+        person.image = SimpleUploadedFile("arnold.jpg", self.make_image(), content_type="image/jpeg")
+        person.save()
+        self.assertFalse(default_storage.exists(get_rendition_name(person.image.name, "thumb")))
+        data = APIClient().get(f"/api/v1/persons/{person.pk}/").json()
+        self.assertEqual(set(data["image_renditions"].values()), {data["image"]})
+        call_command("run_tasks", "--once", "--concurrency", "1", stdout=StringIO())
+        for name, size in settings.IMAGE_RENDITIONS.items():
+            with default_storage.open(get_rendition_name(person.image.name, name)) as file:
+                image = Image.open(file)
+                self.assertEqual(image.format, "WEBP")
+                self.assertLessEqual(image.size, size)
+
+        data = APIClient().get(f"/api/v1/persons/{person.pk}/").json()
+        self.assertEqual(
+            data["image_renditions"]["thumb"],
+            f"http://testserver/media/{get_rendition_name(person.image.name, 'thumb')}",
+        )
+
+        previous = Person.objects.get(pk=person.pk).image.name
+        person = Person.objects.get(pk=person.pk)
+        person.image = SimpleUploadedFile("arnold.jpg", self.make_image(), content_type="image/jpeg")
+        person.save()
+        self.assertEqual(Person.objects.get(pk=person.pk).renditions, "")
+        call_command("run_tasks", "--once", "--concurrency", "1", stdout=StringIO())
+        self.assertFalse(default_storage.exists(get_rendition_name(previous, "thumb")))
+        person = Person.objects.get(pk=person.pk)
+        with mock.patch.object(default_storage, "exists") as exists:
+            url = get_thumbnail_url(person.image)
+        exists.assert_not_called()
+        self.assertEqual(url, default_storage.url(get_rendition_name(person.image.name, "thumb")))
+
+    def test_backfill_command(self):
+        name = default_storage.save("movies/poster.jpg", ContentFile(self.make_image()))
+        create_movie()
+        create_movie("Чужой")
+        out = StringIO()
+        call_command("make_renditions", "--type", "movie", "--workers", "2", stdout=out)
+        self.assertIn(f"записано превью: {len(settings.IMAGE_RENDITIONS)}", out.getvalue())
+        self.assertTrue(default_storage.exists(get_rendition_name(name, "medium")))
+        self.assertEqual(set(Movie.objects.values_list("renditions", flat=True)), {",".join(settings.IMAGE_RENDITIONS)})
+        call_command("make_renditions", stdout=out)
+        self.assertIn("записано превью: 0", out.getvalue())
+
+
+@task(max_attempts=2)
+def flaky_task(key):
+    TaskQueueTest.calls.append(key)
+    if len(TaskQueueTest.calls) == 1:
+        raise OSError("Временная ошибка")
+
+
+@task
+def reclaimed_task():
+    # Пока задача шла, ее вернули в очередь и взял другой обработчик
+    Task.objects.update(locked_by="other")
+
+
+@task
+def slow_task():
+    claimed_at = Task.objects.get().locked_at
+    deadline = time.monotonic() + 5
+    while Task.objects.get().locked_at == claimed_at and time.monotonic() < deadline:
+        time.sleep(0.01)
+    TaskHeartbeatTest.extended = Task.objects.get().locked_at > claimed_at
+
+
+class TaskQueueTest(TestCase):
+    calls = []
+
+    def setUp(self):
+        TaskQueueTest.calls = []
+
+    def run_tasks(self):
+        out = StringIO()
+        call_command("run_tasks", "--once", "--concurrency", "1", stdout=out)
+        return out.getvalue()
+
+    def test_retry(self):
+        flaky_task.delay("a")
+        self.assertEqual(TaskQueueTest.calls, [])
+        self.assertIn("с ошибкой: 1", self.run_tasks())
+        queued = Task.objects.get()
+        self.assertEqual((queued.status, queued.attempts), (Task.PENDING, 1))
+        self.assertIn("Временная ошибка", queued.last_error)
+
+        Task.objects.update(run_at=queued.created_at)
+        self.assertIn("Выполнено задач: 1", self.run_tasks())
+        self.assertEqual(TaskQueueTest.calls, ["a", "a"])
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(TASKS_LOCK_TIMEOUT=0)
+    def test_failed_after_max_attempts(self):
+        Task.objects.create(name="movies.tests.flaky_task", arguments='{"args": ["b"], "kwargs": {}}',
+                            status=Task.RUNNING, attempts=2, max_attempts=2, locked_at=datetime(2020, 1, 1, tzinfo=timezone.utc))
+        self.run_tasks()
+        self.assertEqual(TaskQueueTest.calls, [])
+        self.assertEqual(Task.objects.get().status, Task.FAILED)
+
+    def test_reclaimed_task_is_not_touched(self):
+        reclaimed_task.delay()
+        self.assertTrue(run_task(claim_tasks("worker", 1)[0]))
+        self.assertEqual(Task.objects.get().locked_by, "other")
+
+    def test_auth_email(self):
+        User.objects.create_user("user", "user@example.com", "password")
+        response = APIClient().post("/api/v1/auth/users/reset_password/", {"email": "user@example.com"})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(len(mail.outbox), 0)
+        self.run_tasks()
+        self.assertEqual(mail.outbox[0].to, ["user@example.com"])
+        self.assertIn("/password/reset/confirm/", mail.outbox[0].body)
+
+
+class TaskHeartbeatTest(TransactionTestCase):
+    """Heartbeat пишет из своего потока, поэтому задача не должна быть в транзакции теста"""
+    extended = False
+
+    @override_settings(TASKS_HEARTBEAT_INTERVAL=0.02)
+    def test_running_task_extends_lock(self):
+        slow_task.delay()
+        self.assertTrue(run_task(claim_tasks("worker", 1)[0]))
+        self.assertTrue(TaskHeartbeatTest.extended)
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(TASKS_LOCK_TIMEOUT=0)
+    def test_release_skips_extended_lock(self):
+        reclaimed_task.delay()
+        running = claim_tasks("worker", 1)[0]
+        Task.objects.update(locked_at=running.locked_at + timedelta(hours=1))
+        self.assertEqual(release_stale_tasks(), 0)
+        self.assertEqual(Task.objects.get().status, Task.RUNNING)
+
+
+class ASGIExportTest(TransactionTestCase):
+    """Запрос идет в потоке sync_to_async со своим соединением, поэтому данные фиксируются"""
+
+    def request(self, path):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http", "method": "GET", "path": path, "root_path": "", "query_string": b"",
+            "headers": [(b"host", b"testserver")], "server": ("testserver", 80), "client": ("127.0.0.1", 1),
+        }
+        asyncio.run(application(scope, receive, send))
+        return messages[0]["status"], b"".join(message.get("body", b"") for message in messages[1:])
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_export_through_asgi(self):
+        for title in ("Терминатор", "Чужой", "Хищник"):
+            create_movie(title)
+        status, body = self.request("/api/v1/movies/export/")
+        self.assertEqual(status, 200)
+        self.assertEqual([json.loads(line)["title"] for line in body.splitlines()], ["Терминатор", "Чужой", "Хищник"])
+        self.assertEqual(body, b"".join(self.client.get("/api/v1/movies/export/").streaming_content))
+        self.assertEqual(self.request("/api/v1/movies/")[1], self.client.get("/api/v1/movies/").content)
+
+
+class FakeConnection:
+    closed = False
+
+    def get_transaction_status(self):
+        return 0
+
+    def close(self):
+        self.closed = True
+
+
+class DatabaseConfigTest(TestCase):
+
+    @override_settings(DATABASE_REPLICAS=["replica_1"])
+    def test_replica_router(self):
+        router = ReadReplicaRouter()
+        self.assertIsNone(router.db_for_read(Movie))
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Movie), "replica_1")
+            self.assertEqual(router.db_for_read(Rating), "default")
+            self.assertEqual(router.db_for_write(Movie), "default")
+        self.assertFalse(router.allow_migrate("replica_1", "movies"))
+        with override_settings(DATABASE_REPLICAS=["replica_1", "replica_2"]), replica_reads():
+            self.assertEqual(len({router.db_for_read(model) for model in (Movie, Person, Genre) * 10}), 1)
+
+    @override_settings(DATABASE_REPLICAS=["default"])
+    def test_one_replica_per_request(self):
+        movie, person = create_movie(), create_person()
+        movie.actors.add(person)
+        cache.clear()
+        with mock.patch("movies.routers.random.choice", return_value="default") as choice:
+            for path in ("/api/v1/movies/", f"/api/v1/movies/{movie.pk}/", f"/api/v1/persons/{person.pk}/"):
+                choice.reset_mock()
+                self.assertEqual(self.client.get(path).status_code, 200)
+                self.assertEqual(choice.call_count, 1)
+
+    def test_health_check_skips_recent_connections(self):
+        default = connections["default"]
+        default.ensure_connection()
+        mark_connections_released()
+        # Вне транзакции теста, с оборванным соединением
+        patches = {"in_atomic_block": False, "is_usable": mock.DEFAULT, "close": mock.DEFAULT}
+        with mock.patch.multiple(default, **patches) as patched:
+            patched["is_usable"].return_value = False
+            check_connections()
+            self.assertFalse(patched["is_usable"].called)
+            default.released_at -= settings.DATABASE_HEALTH_CHECK_IDLE + 1
+            check_connections()
+            self.assertTrue(patched["close"].called)
+
+    def test_connection_pool(self):
+        pool = ConnectionPool(FakeConnection, max_size=2, timeout=0.01)
+        first = pool.get()
+        pool.put(first)
+        self.assertIs(pool.get(), first)
+        pool.get()
+        with self.assertRaises(OperationalError):
+            pool.get()
+        first.close()
+        pool.put(first)
+        self.assertIsNot(pool.get(), first)
+
+    def test_health(self):
+        response = APIClient().get("/api/v1/health/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"status": "ok", "checks": {"default": "ok", "cache": "ok"}})
+        with mock.patch("movies.health.check_database", return_value=False):
+            response = APIClient().get("/api/v1/health/")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["checks"]["default"], "error")
+
+
+class ImportCatalogueTest(TestCase):
+
+    def write(self, name, content):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, name)
+        with open(path, "w", encoding="utf-8") as target:
+            target.write(content)
+        return path
+
+    def test_import_jsonl_and_csv(self):
+        records = [
+            {"type": "country", "name": "США"},
+            {"type": "genre", "name": "Фантастика", "description": "-", "url": "sci-fi"},
+            {"type": "category", "name": "Фильмы", "description": "-", "url": "films"},
+            {"type": "person", "key": "cameron", "first_name": "Джеймс", "last_name": "Кэмерон",
+             "date_of_birthday": "1954-08-16", "description": "-", "image": "actors/cameron.jpg",
+             "countries": ["США"]},
+            {"type": "movie", "title": "Терминатор", "description": "-", "poster": "movies/t.jpg", "year": 1984,
+             "category": "films", "countries": ["США"], "genres": ["sci-fi"], "directors": ["cameron"]},
+            {"type": "movie", "title": "Чужие", "description": "-", "genres": ["unknown"]},
+        ]
+        path = self.write("catalogue.jsonl", "\n".join(json.dumps(record) for record in records))
+        out, err = StringIO(), StringIO()
+        call_command("import_catalogue", path, batch_size=2, stdout=out, stderr=err)
+
+        movie = Movie.objects.get(title="Терминатор")
+        self.assertEqual(movie.slug, f"{movie.pk}-terminator")
+        self.assertEqual(movie.category.url, "films")
+        self.assertEqual([genre.url for genre in movie.genres.all()], ["sci-fi"])
+        self.assertEqual([person.last_name for person in movie.directors.all()], ["Кэмерон"])
+        self.assertEqual(list(movie.countries.values_list("name", flat=True)), ["США"])
+        self.assertFalse(Movie.objects.filter(title="Чужие").exists())
+        self.assertIn("Строка 6", err.getvalue())
+
+        person_slug = Person.objects.get().slug
+        path = self.write("movies.csv", (
+            "title,description,year,genres,actors\n"
+            f"Титаник,-,1997,sci-fi,{person_slug}\n"
+            "Аватар,-,2009,,\n"
+        ))
+        call_command("import_catalogue", path, type="movie", stdout=out, stderr=err)
+        self.assertEqual(Movie.objects.get(title="Титаник").actors.get().slug, person_slug)
+        self.assertEqual(Movie.objects.get(title="Аватар").year, 2009)
+        self.assertEqual(Genre.objects.count(), 1)
+
+    def test_bad_rows_are_skipped(self):
+        lines = [
+            json.dumps({"type": "movie", "title": "Чужой", "year": "давно"}),
+            '{"type": "movie", "title": ',
+            json.dumps({"type": "person", "first_name": "Сигурни", "last_name": "Уивер",
+                        "date_of_birthday": "1949-13-08"}),
+            json.dumps({"type": "genre", "name": "Ужасы", "url": "horror!"}),
+            json.dumps({"type": "movie", "title": "Чужие", "description": "-", "year": "1986", "budget": "18500000"}),
+        ]
+        path = self.write("catalogue.jsonl", "\n".join(lines))
+        err = StringIO()
+        call_command("import_catalogue", path, batch_size=2, stdout=StringIO(), stderr=err)
+
+        movie = Movie.objects.get()
+        self.assertEqual((movie.title, movie.year, movie.budget), ("Чужие", 1986, 18500000))
+        self.assertFalse(Person.objects.exists() or Genre.objects.exists())
+        self.assertEqual([line.split(":")[0] for line in err.getvalue().splitlines()],
+                         ["Строка 1", "Строка 2", "Строка 3", "Строка 4"])
@@ -16,6 +16,10 @@ urlpatterns = [
     path('api-auth/', include('rest_framework.urls')),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('suggest/', views.SuggestView.as_view(), name='suggest'),
+    path('cache-stats/', views.CacheStatsView.as_view(), name='cache_stats'),
+    path('health/', views.HealthView.as_view(), name='health'),
 ]
 
 urlpatterns += router.urls
@@ -0,0 +1,151 @@
+from operator import itemgetter
+
+from django.conf import settings
+
+from .models import Movie, Person, Review
+from .renditions import get_rendition_urls
+from .review_tree import build_review_tree, get_tree_limits, serialize_review_tree
+from .serializers import (
+    DynamicFieldsMixin, MovieListSerializer, PersonListSerializer, ReviewSerializer, get_requested_fields,
+)
+
+
+def is_enabled():
+    return getattr(settings, "FAST_READ_SERIALIZERS", False)
+
+
+class ValuesSerializer:
+    """
+    Сериализатор только для чтения по строкам .values(). Колонки и преобразования полей
+    разбираются один раз при создании, на каждую строку остаются обращения к словарю
+    без механизма полей DRF. Ответ совпадает с serializer_class байт в байт:
+    те же ключи в том же порядке и те же типы значений.
+
+    fields - (поле ответа, колонка values(), преобразование значения или None);
+    преобразование "url" - ссылка на файл, как у FileField, "renditions" - ссылки
+    на его превью, как у RenditionsField (нужна колонка renditions в extra_columns).
+    Если колонки нет, третий элемент - постоянное значение поля (default у DRF).
+    """
+    model = None
+    serializer_class = None
+    fields = ()
+    # Колонки, нужные помимо полей ответа: ключ пагинации, связи дерева
+    extra_columns = ("id",)
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        names = self.get_field_names()
+        self.getters = [
+            (name, self.make_getter(name, column, convert))
+            for name, column, convert in self.fields if name in names
+        ]
+        self.columns = list(dict.fromkeys([
+            *self.extra_columns, *(column for name, column, _ in self.fields if name in names and column)
+        ]))
+
+    def get_field_names(self):
+        """Поля ответа с учетом ?fields=, как у DynamicFieldsMixin"""
+        names = {name for name, _, _ in self.fields}
+        if not issubclass(self.serializer_class, DynamicFieldsMixin):
+            return names
+        requested = get_requested_fields(self.context)[0]
+        if not requested:
+            return names
+        return names & {*requested, *getattr(self.serializer_class.Meta, "required_fields", ())}
+
+    def make_getter(self, name, column, convert):
+        if column is None:
+            return lambda row: convert
+        if convert is None:
+            return itemgetter(column)
+        if convert == "renditions":
+            return self.make_renditions_getter(column)
+        if convert == "url":
+            convert = self.make_url_converter(column)
+
+        def get(row):
+            value = row[column]
+            return None if value is None else convert(value)
+        return get
+
+    def make_url_converter(self, column):
+        """
+        Ссылка на файл, как у FileField DRF: пустое имя - None, при наличии request - абсолютная.
+        Ссылки запоминаются по имени файла: сборка URL дороже всего остального в строке.
+        """
+        storage = self.model._meta.get_field(column).storage
+        request = self.context.get("request")
+        urls = {}
+
+        def convert(name):
+            if not name:
+                return None
+            url = urls.get(name)
+            if url is None:
+                url = storage.url(name)
+                url = urls[name] = request.build_absolute_uri(url) if request is not None else url
+            return url
+        return convert
+
+    def make_renditions_getter(self, column):
+        """Ссылки на превью по имени файла и списку построенных превью из колонки renditions"""
+        field = self.model._meta.get_field(column)
+        request = self.context.get("request")
+        return lambda row: get_rendition_urls(field.attr_class(None, field, row[column]), request, row["renditions"])
+
+    def to_representation(self, rows):
+        getters = self.getters
+        return [{name: get(row) for name, get in getters} for row in rows]
+
+
+class MovieListValuesSerializer(ValuesSerializer):
+    model = Movie
+    serializer_class = MovieListSerializer
+    fields = (
+        ("id", "id", None),
+        ("title", "title", None),
+        ("tagline", "tagline", None),
+        ("category", "category__name", None),
+        ("rating_user", None, False),
+        ("average_rating", "average_rating", float),
+    )
+
+
+class PersonListValuesSerializer(ValuesSerializer):
+    model = Person
+    serializer_class = PersonListSerializer
+    fields = (
+        ("id", "id", None),
+        ("first_name", "first_name", None),
+        ("last_name", "last_name", None),
+        ("image", "image", "url"),
+        ("image_renditions", "image", "renditions"),
+    )
+    extra_columns = ("id", "renditions")
+
+
+class ReviewRow:
+    """Строка отзыва для build_review_tree: те же атрибуты, что у модели"""
+    __slots__ = ("pk", "parent_id", "row", "tree_children")
+
+    def __init__(self, row):
+        self.pk = row["id"]
+        self.parent_id = row["parent_id"]
+        self.row = row
+
+
+class ReviewValuesSerializer(ValuesSerializer):
+    """Дерево отзывов, как у ReviewSerializer с FilterReviewListSerializer"""
+    model = Review
+    serializer_class = ReviewSerializer
+    fields = (
+        ("name", "name", None),
+        ("text", "text", None),
+    )
+    extra_columns = ("id", "parent_id")
+
+    def to_representation(self, rows):
+        getters = self.getters
+        max_depth, max_children = get_tree_limits()
+        roots = build_review_tree(map(ReviewRow, rows), max_depth=max_depth, max_children=max_children)
+        return serialize_review_tree(roots, lambda review: {name: get(review.row) for name, get in getters})
@@ -1,19 +1,124 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, router
+from django.http import StreamingHttpResponse
 
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import permissions, viewsets
+from django_filters.utils import translate_validation
+from rest_framework import permissions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from .models import Movie, Person, Review, Rating
-from . import serializers
+from .models import Movie, Person, Review, Rating, Genre, Country
+from . import serializers, values_serializers
 from .services import get_client_ip_from_request
 from .filters import MovieFilter
 from .permissions import IsEmailOwner, IsIpOwner
+from .cache import CachedResponseMixin, ConditionalRetrieveMixin, get_stats
+from .export import EXPORT_FORMATS, iter_id_chunks
+from .facets import get_facets
+from .health import get_health
+from .rating_buffer import is_buffered
+from .ratings import get_rated_movie_ids
+from .routers import replica_reads
+from .search import search
+from .suggest import suggest
 
 
-class MovieViewSet(viewsets.ModelViewSet):
+def trim_queryset(queryset, fields):
+    """
+    Читает только колонки полей ответа, внешние ключи из ответа подтягивает JOIN-ом.
+    Поля не из колонок модели (M2M, rating_user) на выборку не влияют.
+    """
+    columns = {field.name: field for field in queryset.model._meta.concrete_fields}
+    names = [name for name in fields if name in columns]
+    related = [name for name in names if columns[name].is_relation]
+    return queryset.select_related(None).only(*names).select_related(*related)
+
+
+class SparseFieldsMixin:
+    """
+    Выборка под ?fields= и ?expand=: на чтение загружаются только колонки выбранных полей,
+    связи из relation_prefetches подгружаются, только если они есть в ответе.
+    """
+    relation_prefetches = {}
+
+    def get_selected_fields(self, serializer_class=None):
+        """Поля ответа с учетом параметров запроса и поля модели, из которых они читаются"""
+        serializer_class = serializer_class or self.get_serializer_class()
+        fields = serializer_class(context=self.get_serializer_context()).fields
+        return {
+            *fields,
+            *(field.source.split(".")[0] for field in fields.values() if field.source != "*"),
+            *(name for field in fields.values() for name in getattr(field, "extra_sources", ())),
+        }
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_selected_fields()
+        if self.request.method in SAFE_METHODS:
+            queryset = trim_queryset(queryset, fields)
+        return self.prefetch_relations(queryset, fields)
+
+    def prefetch_relations(self, queryset, fields):
+        """Подгружает выбранные связи фиксированным числом запросов: по одному на связь"""
+        return queryset.prefetch_related(*(
+            models.Prefetch(name, queryset=related)
+            for name, related in self.relation_prefetches.items() if name in fields
+        ))
+
+
+class ValuesListMixin:
+    """
+    Список из строк .values() через values_serializer_class вместо ModelSerializer,
+    если включен FAST_READ_SERIALIZERS и не запрошено раскрытие связей (?expand=).
+    """
+    values_serializer_class = None
+
+    def get_values_serializer(self):
+        context = self.get_serializer_context()
+        if not values_serializers.is_enabled() or serializers.get_requested_fields(context)[1]:
+            return None
+        return self.values_serializer_class(context=context)
+
+    def list(self, request, *args, **kwargs):
+        values_serializer = self.get_values_serializer()
+        if values_serializer is None:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset()).values(*values_serializer.columns)
+        page = self.paginate_queryset(queryset)
+        data = values_serializer.to_representation(queryset if page is None else page)
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+
+class ReplicaReadMixin:
+    """Чтение (GET, HEAD, OPTIONS) уходит на реплики из DATABASE_REPLICAS, запись - на основную базу"""
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class MovieViewSet(
+    ReplicaReadMixin, CachedResponseMixin, ConditionalRetrieveMixin, ValuesListMixin, SparseFieldsMixin, viewsets.ModelViewSet
+):
     """Вьюсет для отображения фильмов"""
-    queryset = Movie.objects.filter(draft=False)
+    queryset = Movie.objects.filter(draft=False).select_related("category")
     serializer_class = serializers.MovieListSerializer
+    values_serializer_class = values_serializers.MovieListValuesSerializer
+    # Связи MovieDetailSerializer и раскрываемые связи списка
+    relation_prefetches = {
+        "directors": Person.objects.only("id", "first_name", "last_name", "image", "renditions"),
+        "actors": Person.objects.only("id", "first_name", "last_name", "image", "renditions"),
+        "genres": Genre.objects.only("id", "name"),
+        "countries": Country.objects.only("id", "name"),
+        "reviews": Review.objects.only("id", "name", "text", "parent", "movie"),
+    }
     filter_backends = (DjangoFilterBackend,)
     filterset_class = MovieFilter
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
@@ -28,19 +133,74 @@ class MovieViewSet(viewsets.ModelViewSet):
             self.permission_classes = (permissions.IsAdminUser,)
         return [permission() for permission in self.permission_classes]
 
-    def get_queryset(self):
-        queryset = Movie.objects.filter(draft=False).annotate(
-            rating_user=models.Count("ratings", filter=models.Q(ratings__ip=get_client_ip_from_request(self.request)))
-        ).annotate(
-            average_rating=models.Sum(models.F('ratings__star')) / models.Count(models.F('ratings'))
-        )
-        return queryset
+    def list(self, request, *args, **kwargs):
+        """
+        Общая для всех клиентов часть списка берется из кэша,
+        rating_user проставляется после одним запросом по ip клиента.
+        """
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            movies = response.data["results"] if isinstance(response.data, dict) else response.data
+            if not movies or "rating_user" not in movies[0]:
+                return response
+            rated = get_rated_movie_ids(get_client_ip_from_request(request), [movie["id"] for movie in movies])
+            for movie in movies:
+                movie["rating_user"] = movie["id"] in rated
+        return response
+
+    @action(detail=False)
+    def rated(self, request):
+        """id фильмов, которые уже оценил клиент"""
+        return Response(sorted(get_rated_movie_ids(get_client_ip_from_request(request))))
 
+    @action(detail=False)
+    def export(self, request):
+        """
+        Весь каталог (с учетом фильтров) в формате карточки фильма потоком:
+        ?as=ndjson (по умолчанию), ?as=json (один массив) или ?as=csv. Фильмы читаются пачками
+        по EXPORT_CHUNK_SIZE, связи подгружаются на каждую пачку.
+        """
+        export_format = request.query_params.get("as", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {"detail": f"Формат выгрузки: {', '.join(EXPORT_FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        render, content_type = EXPORT_FORMATS[export_format]
+        # Ответ читается уже после dispatch: база выбирается сейчас, вся выгрузка идет с нее
+        queryset = self.filter_queryset(self.get_queryset()).using(router.db_for_read(Movie))
+        rows = self.iter_export_rows(queryset)
+        response = StreamingHttpResponse(render(rows), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="movies.{export_format}"'
+        return response
 
-class PersonViewSet(viewsets.ModelViewSet):
+    def iter_export_rows(self, queryset):
+        context = self.get_serializer_context()
+        fields = self.get_selected_fields(serializers.MovieDetailSerializer)
+        for ids in iter_id_chunks(queryset, settings.EXPORT_CHUNK_SIZE):
+            movies = Movie.objects.using(queryset.db).filter(pk__in=ids)
+            movies = self.prefetch_relations(trim_queryset(movies, fields), fields)
+            yield from serializers.MovieDetailSerializer(movies.order_by("pk"), many=True, context=context).data
+
+    @action(detail=False)
+    def facets(self, request):
+        """
+        Счетчики фильмов по жанрам, странам, категориям и годам для текущего фильтра.
+        Считаются по битовым картам в памяти; условия вне индекса отбираются одним запросом id.
+        """
+        filterset = self.filterset_class(request.query_params, queryset=self.get_queryset(), request=request)
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+        return Response(get_facets(filterset))
+
+
+class PersonViewSet(
+    ReplicaReadMixin, ConditionalRetrieveMixin, ValuesListMixin, SparseFieldsMixin, viewsets.ModelViewSet
+):
     """Вьюсет для отображения персоналий"""
     queryset = Person.objects.all()
     serializer_class = serializers.PersonListSerializer
+    values_serializer_class = values_serializers.PersonListValuesSerializer
+    relation_prefetches = {"countries": Country.objects.only("id", "name")}
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
     def get_serializer_class(self):
@@ -54,10 +214,11 @@ class PersonViewSet(viewsets.ModelViewSet):
         return [permission() for permission in self.permission_classes]
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(ValuesListMixin, viewsets.ModelViewSet):
     """Вьюсет для отображения отзывов"""
     queryset = Review.objects.all()
     serializer_class = serializers.ReviewSerializer
+    values_serializer_class = values_serializers.ReviewValuesSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_serializer_class(self):
@@ -65,6 +226,28 @@ class ReviewViewSet(viewsets.ModelViewSet):
             return serializers.ReviewCreateSerializer
         return self.serializer_class
 
+    def list(self, request, *args, **kwargs):
+        """
+        Страница строится по корневым отзывам, ответы на них догружаются
+        одним запросом по thread, чтобы ветки не разрывались между страницами.
+        """
+        values_serializer = self.get_values_serializer()
+        queryset = self.filter_queryset(self.get_queryset().top_level())
+        if values_serializer is not None:
+            queryset = queryset.values(*values_serializer.columns)
+        page = self.paginate_queryset(queryset)
+        roots = list(queryset if page is None else page)
+        replies = Review.objects.order_by("path", "pk")
+        if values_serializer is None:
+            replies = replies.filter(thread__in=[root.pk for root in roots])
+            data = self.get_serializer([*roots, *replies], many=True).data
+        else:
+            replies = replies.filter(thread__in=[root["id"] for root in roots]).values(*values_serializer.columns)
+            data = values_serializer.to_representation([*roots, *replies])
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
     def get_permissions(self):
         if self.action in ('update', 'partial_update'):
             self.permission_classes = (IsEmailOwner,)
@@ -79,6 +262,13 @@ class RatingViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.RatingSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        if is_buffered():
+            # Голос принят в буфер и будет записан фоновым flush_ratings
+            response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
     def perform_create(self, serializer):
         serializer.save(ip=get_client_ip_from_request(self.request))
 
@@ -86,3 +276,52 @@ class RatingViewSet(viewsets.ModelViewSet):
         if self.action in ('update', 'partial_update', 'delete'):
             self.permission_classes = (IsIpOwner,)
         return [permission() for permission in self.permission_classes]
+
+
+class CacheStatsView(APIView):
+    """Счетчики попаданий и промахов кэша ответов"""
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return Response(get_stats())
+
+
+class HealthView(APIView):
+    """Проверка для балансировщика: 200, если отвечают все базы и кэш, иначе 503 и что не ответило"""
+    permission_classes = (permissions.AllowAny,)
+    authentication_classes = ()
+    throttle_classes = ()
+
+    def get(self, request):
+        checks = {name: "ok" if ok else "error" for name, ok in get_health().items()}
+        healthy = "error" not in checks.values()
+        return Response(
+            {"status": "ok" if healthy else "error", "checks": checks},
+            status=status.HTTP_200_OK if healthy else status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+
+
+class SearchView(APIView):
+    """Полнотекстовый поиск фильмов и персон: ?q=терминатор или ?q=terminator"""
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request):
+        text = request.query_params.get("q", "").strip()
+        if not text:
+            return Response({"movies": [], "persons": []})
+        limit = settings.SEARCH_RESULTS_LIMIT
+        movies = search(Movie.objects.filter(draft=False).select_related("category"), text)[:limit]
+        persons = search(Person.objects.all(), text)[:limit]
+        context = {"request": request}
+        return Response({
+            "movies": serializers.MovieListSerializer(movies, many=True, context=context).data,
+            "persons": serializers.PersonListSerializer(persons, many=True, context=context).data,
+        })
+
+
+class SuggestView(APIView):
+    """Подсказки по мере набора: названия фильмов и имена персон, ?q=терм"""
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request):
+        return Response(suggest(request.query_params.get("q", ""), settings.SUGGEST_LIMIT))